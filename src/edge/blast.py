@@ -37,6 +37,42 @@ class Blast_Accession(object):
         return Fragment.objects.get(pk=self.fragment_id)
 
 
+class Blast_Result_Context(object):
+    """
+    Fragments referenced by a set of blast results. Fragments are bulk loaded
+    once, with their indexed form and length cached, and shared by code
+    post-processing blast results, instead of looking up the fragment for each
+    hit.
+    """
+
+    def __init__(self, genome=None):
+        self.genome = genome
+        self.__genome_fragment_ids = None
+        self.__fragments = {}
+
+    def genome_fragment_ids(self):
+        if self.__genome_fragment_ids is None:
+            self.__genome_fragment_ids = set(self.genome.fragments.values_list('id', flat=True))
+        return self.__genome_fragment_ids
+
+    def load(self, *result_lists):
+        fragment_ids = set()
+        for results in result_lists:
+            for res in results:
+                if res.fragment_id not in self.__fragments:
+                    fragment_ids.add(res.fragment_id)
+        self.__fragments.update(Fragment.bulk_indexed_fragments(fragment_ids))
+        return self
+
+    def fragment(self, fragment_id):
+        if fragment_id not in self.__fragments:
+            self.__fragments.update(Fragment.bulk_indexed_fragments([fragment_id]))
+        return self.__fragments[fragment_id]
+
+    def length(self, fragment_id):
+        return self.fragment(fragment_id).length
+
+
 class Blast_Result(object):
 
     def __init__(self, **kwargs):
@@ -75,12 +111,21 @@ def inverse_match(m):
     return ''.join([' ' if x == '|' else 'X' for x in m])
 
 
-def blast(dbname, blast_program, query, evalue_threshold=0.001):
+def blast_many(dbname, blast_program, queries, evalue_threshold=0.001):
+    """
+    Blast a list of queries against a database, in a single blast run. Returns
+    a list of lists of Blast_Result objects, one list for each query.
+    """
+
+    results = [[] for query in queries]
+    if len(queries) == 0:
+        return results
 
     infile = None
     with tempfile.NamedTemporaryFile(mode='w', delete=False) as f:
         infile = f.name
-        f.write(">Query\n%s\n" % query)
+        for i, query in enumerate(queries):
+            f.write(">Query%d\n%s\n" % (i, query))
 
     outfile = "%s.out.xml" % infile
     if blast_program == 'tblastn':
@@ -100,49 +145,79 @@ def blast(dbname, blast_program, query, evalue_threshold=0.001):
 
     if r != 0:
         print "Blast failed: %s" % cl
-        return []
+        return results
 
-    results = []
     with open(outfile, "r") as f:
-        blast_record = NCBIXML.read(f)
-        for alignment in blast_record.alignments:
-            accession = Blast_Accession(alignment.accession)
-            for hsp in alignment.hsps:
-                if accession.fragment_length is not None:
-                    if hsp.sbjct_start > accession.fragment_length and \
-                       hsp.sbjct_end > accession.fragment_length:
-                        continue
-                    # don't apply '% accession.fragment_length' to
-                    # sbjct_start/end. Blast_Result#strand compares sbjct_start
-                    # and sbjct_end to determine which strand the hit is on.
-                    # Caller should just handle when sbjct_start/end is greater
-                    # than fragment length. alternatively, we can store strand
-                    # explicit, but that also creates complexity when using
-                    # sbjct_start/end coordinates.
-
-                f = Blast_Result(fragment_id=accession.fragment_id,
-                                 fragment_length=accession.fragment_length,
-                                 hit_def=alignment.hit_def,
-                                 query_start=hsp.query_start,
-                                 query_end=hsp.query_end,
-                                 subject_start=hsp.sbjct_start,
-                                 subject_end=hsp.sbjct_end,
-                                 evalue=hsp.expect,
-                                 alignment=dict(query=hsp.query,
-                                                match=hsp.match,
-                                                matchi=inverse_match(hsp.match),
-                                                subject=hsp.sbjct))
-                results.append(f)
+        for blast_record in NCBIXML.parse(f):
+            query_results = results[int(blast_record.query.split()[0][len('Query'):])]
+            for alignment in blast_record.alignments:
+                accession = Blast_Accession(alignment.accession)
+                for hsp in alignment.hsps:
+                    if accession.fragment_length is not None:
+                        if hsp.sbjct_start > accession.fragment_length and \
+                           hsp.sbjct_end > accession.fragment_length:
+                            continue
+                        # don't apply '% accession.fragment_length' to
+                        # sbjct_start/end. Blast_Result#strand compares
+                        # sbjct_start and sbjct_end to determine which strand
+                        # the hit is on. Caller should just handle when
+                        # sbjct_start/end is greater than fragment length.
+                        # alternatively, we can store strand explicit, but
+                        # that also creates complexity when using
+                        # sbjct_start/end coordinates.
+
+                    f = Blast_Result(fragment_id=accession.fragment_id,
+                                     fragment_length=accession.fragment_length,
+                                     hit_def=alignment.hit_def,
+                                     query_start=hsp.query_start,
+                                     query_end=hsp.query_end,
+                                     subject_start=hsp.sbjct_start,
+                                     subject_end=hsp.sbjct_end,
+                                     evalue=hsp.expect,
+                                     alignment=dict(query=hsp.query,
+                                                    match=hsp.match,
+                                                    matchi=inverse_match(hsp.match),
+                                                    subject=hsp.sbjct))
+                    query_results.append(f)
 
     os.unlink(outfile)
     return results
 
 
-def blast_genome(genome, blast_program, query, evalue_threshold=0.001):
+def blast(dbname, blast_program, query, evalue_threshold=0.001):
+    return blast_many(dbname, blast_program, [query], evalue_threshold=evalue_threshold)[0]
+
+
+def blast_genome_many(genome, blast_program, queries, evalue_threshold=0.001, context=None):
+    """
+    Blast a list of queries against genome, in a single blast run. Returns a
+    list of lists of Blast_Result objects, one list for each query. If a
+    Blast_Result_Context is specified, it is used for genome fragment lookup,
+    and loads fragments for the returned results.
+    """
+
     dbname = genome.blastdb
     if not dbname:
-        return []
-    results = blast(dbname, blast_program, query,
-                    evalue_threshold=evalue_threshold)
-    genome_fragment_ids = [f.id for f in genome.fragments.all()]
-    return [r for r in results if r.fragment_id in genome_fragment_ids]
+        return [[] for query in queries]
+    results = blast_many(dbname, blast_program, queries,
+                         evalue_threshold=evalue_threshold)
+    if context is None:
+        genome_fragment_ids = set(genome.fragments.values_list('id', flat=True))
+    else:
+        genome_fragment_ids = context.genome_fragment_ids()
+    results = [[r for r in query_results if r.fragment_id in genome_fragment_ids]
+               for query_results in results]
+    if context is not None:
+        context.load(*results)
+    return results
+
+
+def blast_genome(genome, blast_program, query, evalue_threshold=0.001, context=None):
+    """
+    Blast query against genome. If a Blast_Result_Context is specified, it is
+    used for genome fragment lookup, and loads fragments for the returned
+    results.
+    """
+
+    return blast_genome_many(genome, blast_program, [query],
+                             evalue_threshold=evalue_threshold, context=context)[0]
@@ -1,43 +1,71 @@
 import json
-from edge.blast import blast_genome
+from edge.blast import blast_genome, Blast_Result_Context
+from edge.kmer import find_exact, Kmer_Index
 from edge.models import Operation
+from edge.pam import pam_index, is_valid_pam, match_pam, MAX_PROTOSPACER_LENGTH
 from Bio.Seq import Seq
 
 
 class CrisprTarget(object):
 
-    def __init__(self, fragment_id, fragment_name, strand, subject_start, subject_end, pam):
+    def __init__(self, fragment_id, fragment_name, strand, subject_start, subject_end, pam,
+                 guide=None):
         self.fragment_id = fragment_id
         self.fragment_name = fragment_name
         self.strand = strand
         self.subject_start = subject_start
         self.subject_end = subject_end
         self.pam = pam
+        self.guide = guide
 
     def to_dict(self):
         return self.__dict__
 
+    @staticmethod
+    def from_pam_site(site, pam, guide):
+        return CrisprTarget(site['fragment_id'], site['fragment_name'], site['strand'],
+                            site['subject_start'], site['subject_end'], pam, guide=guide)
+
+
+class CrisprGuideCheck(object):
+
+    def __init__(self, guide, targets, off_targets):
+        self.guide = guide
+        self.targets = targets
+        self.off_targets = off_targets
+
+    def to_dict(self):
+        return dict(guide=self.guide,
+                    targets=[t.to_dict() for t in self.targets],
+                    off_targets=self.off_targets)
 
-def match_pam(pam, query):
-    if len(query) != len(pam):
-        return False
-    for p, q in zip(pam.lower(), query.lower()):
-        if p != 'n' and p != q:
-            return False
-    return True
 
+def target_followed_by_pam(blast_res, pam, context=None, pam_upstream=False):
+    """
+    Returns CrisprTarget if guide matched by blast_res is followed by PAM, or
+    preceded by PAM if pam_upstream is True, otherwise returns None.
+    """
 
-def target_followed_by_pam(blast_res, pam):
-    fragment = blast_res.fragment.indexed_fragment()
+    if context is None:
+        context = Blast_Result_Context()
+    fragment = context.fragment(blast_res.fragment_id)
 
     if blast_res.strand() > 0:
-        pam_start = blast_res.subject_end+1
-        pam_end = pam_start+len(pam)-1
+        if pam_upstream:
+            pam_end = blast_res.subject_start-1
+            pam_start = pam_end-len(pam)+1
+        else:
+            pam_start = blast_res.subject_end+1
+            pam_end = pam_start+len(pam)-1
         query = fragment.get_sequence(bp_lo=pam_start, bp_hi=pam_end)
 
     else:
-        pam_end = blast_res.subject_end-1
-        pam_start = pam_end-len(pam)+1
+        if pam_upstream:
+            pam_start = blast_res.subject_start+1
+            pam_end = pam_start+len(pam)-1
+        else:
+            pam_end = blast_res.subject_end-1
+            pam_start = pam_end-len(pam)+1
         query = fragment.get_sequence(bp_lo=pam_start, bp_hi=pam_end)
         query = str(Seq(query).reverse_complement())
 
@@ -47,32 +75,120 @@ def target_followed_by_pam(blast_res, pam):
         subject_start = fragment.circ_bp(subject_start)
         subject_end = fragment.circ_bp(subject_end)
 
-        return CrisprTarget(blast_res.fragment_id, blast_res.fragment.name,
+        return CrisprTarget(blast_res.fragment_id, fragment.name,
                             blast_res.strand(), subject_start, subject_end, pam)
     return None
 
 
-def find_crispr_target(genome, guide, pam):
+def can_use_pam_index(guide, pam):
+    return Kmer_Index.can_search(guide) and is_valid_pam(pam) and\
+        len(guide) <= MAX_PROTOSPACER_LENGTH
+
+
+def pam_indices(genome, guides, pam, pam_upstream=False):
     """
-    Find sequences on genome that have exact match to guide, followed by pam
-    sequence.
+    Returns dictionary of guide length to genome's PAM site index for guides
+    of that length, for guides that can be looked up in a PAM site index.
+    """
+
+    lengths = set(len(guide) for guide in guides if can_use_pam_index(guide, pam))
+    return dict((length, pam_index(genome, pam, length, pam_upstream=pam_upstream))
+                for length in lengths)
+
+
+def find_crispr_targets(genome, guides, pam, pam_upstream=False):
+    """
+    Find targets for a list of guides. Returns a dictionary of guide to list
+    of CrisprTarget objects. Guides are looked up in genome's PAM site index,
+    built once per PAM and guide length; guides that cannot be looked up in
+    the index, e.g. those with ambiguous bases, are searched using k-mer index
+    or BLAST. PAM is expected after the guide, or before the guide if
+    pam_upstream is True.
     """
 
-    guide_matches = blast_genome(genome, 'blastn', guide)
-    targets = []
+    context = Blast_Result_Context(genome)
+    indices = pam_indices(genome, guides, pam, pam_upstream=pam_upstream)
+    targets = {}
+
+    for guide in guides:
+        if guide in targets:
+            continue
+
+        if can_use_pam_index(guide, pam):
+            targets[guide] = [CrisprTarget.from_pam_site(site, pam, guide)
+                              for site in indices[len(guide)].find(guide.lower())]
+            continue
 
-    for res in guide_matches:
-        if res.query_start == 1 and res.query_end == len(guide):
-            target = target_followed_by_pam(res, pam)
-            if target is not None:
-                targets.append(target)
+        guide_matches = find_exact(genome, guide, context=context)
+        if guide_matches is None:
+            guide_matches = blast_genome(genome, 'blastn', guide, context=context)
+        targets[guide] = []
+
+        for res in guide_matches:
+            if res.query_start == 1 and res.query_end == len(guide):
+                target = target_followed_by_pam(res, pam, context=context,
+                                                pam_upstream=pam_upstream)
+                if target is not None:
+                    target.guide = guide
+                    targets[guide].append(target)
 
     return targets
 
 
-def crispr_dsb(genome, guide, pam, genome_name=None, notes=None):
+def find_crispr_target(genome, guide, pam, pam_upstream=False):
+    """
+    Find sequences on genome that have exact match to guide, followed by pam
+    sequence, or preceded by pam sequence if pam_upstream is True.
+    """
+
+    return find_crispr_targets(genome, [guide], pam, pam_upstream=pam_upstream)[guide]
+
+
+def check_crispr_guides(genome, guides, pam, max_mismatches=3, pam_upstream=False):
+    """
+    Checks a batch of guides. Returns list of CrisprGuideCheck objects, one
+    for each unique guide, with on-target sites, and number of PAM sites
+    whose protospacer has 1, 2, ... up to max_mismatches mismatches to the
+    guide. Guides are looked up in the genome's PAM site index, loaded once
+    per guide length. Guides that cannot be looked up in the index are
+    searched using k-mer index or BLAST, without off-target counts.
+    """
+
+    if len(guides) > 0:
+        max_length = max(len(guide) for guide in guides)
+        if max_mismatches < 0 or max_mismatches > max_length:
+            raise Exception('Number of mismatches must be between 0 and guide length %s, got %s'
+                            % (max_length, max_mismatches))
 
-    targets = find_crispr_target(genome, guide, pam)
+    unique_guides = []
+    seen = set()
+    for guide in guides:
+        if guide not in seen:
+            seen.add(guide)
+            unique_guides.append(guide)
+
+    indices = pam_indices(genome, unique_guides, pam, pam_upstream=pam_upstream)
+    checks = {}
+    for guide in unique_guides:
+        if can_use_pam_index(guide, pam):
+            index = indices[len(guide)]
+            targets = [CrisprTarget.from_pam_site(site, pam, guide)
+                       for site in index.find(guide.lower())]
+            counts = index.count_mismatched(guide.lower(), max_mismatches)
+            checks[guide] = CrisprGuideCheck(guide, targets, counts[1:])
+
+    others = [guide for guide in unique_guides if guide not in checks]
+    if len(others) > 0:
+        for guide, targets in find_crispr_targets(genome, others, pam,
+                                                  pam_upstream=pam_upstream).iteritems():
+            checks[guide] = CrisprGuideCheck(guide, targets, None)
+
+    return [checks[guide] for guide in unique_guides]
+
+
+def crispr_dsb(genome, guide, pam, genome_name=None, notes=None, pam_upstream=False):
+
+    targets = find_crispr_target(genome, guide, pam, pam_upstream=pam_upstream)
 
     if len(targets) == 0:
         return None
@@ -86,7 +202,7 @@ def crispr_dsb(genome, guide, pam, genome_name=None, notes=None):
     new_genome.notes = notes
     new_genome.save()
 
-    op = CrisprOp.get_operation(guide=guide, pam=pam)
+    op = CrisprOp.get_operation(guide=guide, pam=pam, pam_upstream=pam_upstream)
     op.genome = new_genome
     op.save()
 
@@ -113,15 +229,32 @@ def crispr_dsb(genome, guide, pam, genome_name=None, notes=None):
 class CrisprOp(object):
 
     @staticmethod
-    def check(genome, guide, pam, genome_name=None, notes=None):
-        return find_crispr_target(genome, guide, pam)
+    def check(genome, guide, pam, genome_name=None, notes=None, pam_upstream=False):
+        """
+        Returns list of targets for guide, or a list of guides; each target
+        records the guide it matched.
+        """
+
+        guides = guide if isinstance(guide, list) else [guide]
+        targets = find_crispr_targets(genome, guides, pam, pam_upstream=pam_upstream)
+        return [t for g in guides for t in targets[g]]
+
+    @staticmethod
+    def check_many(genome, guides, pam, max_mismatches=3, pam_upstream=False):
+        return check_crispr_guides(genome, guides, pam, max_mismatches=max_mismatches,
+                                   pam_upstream=pam_upstream)
 
     @staticmethod
-    def get_operation(guide, pam, genome_name=None, notes=None):
+    def get_operation(guide, pam, genome_name=None, notes=None, pam_upstream=False):
         params = dict(guide=guide, pam=pam)
+        # only recorded when set, so operations with downstream PAM keep
+        # their params, and fingerprints, from before it was an option
+        if pam_upstream:
+            params['pam_upstream'] = True
         op = Operation(type=Operation.CRISPR_DSB[0], params=json.dumps(params))
         return op
 
     @staticmethod
-    def perform(genome, guide, pam, genome_name, notes):
-        return crispr_dsb(genome, guide, pam, genome_name=genome_name, notes=notes)
+    def perform(genome, guide, pam, genome_name, notes, pam_upstream=False):
+        return crispr_dsb(genome, guide, pam, genome_name=genome_name, notes=notes,
+                          pam_upstream=pam_upstream)
@@ -0,0 +1,71 @@
+import os
+import glob
+import zlib
+import tempfile
+from django.conf import settings
+from edge.io import IO
+from edge.blastdb import make_required_dirs
+
+
+# export formats, and IO method generating each format
+EXPORT_FORMATS = {'gff': 'gff_lines', 'fa': 'fasta_lines', 'gb': 'genbank_lines'}
+
+
+def export_fn(genome, version, fmt):
+    return '%s/genome/%s/%s/edge-genome-%d-%s.%s' % (settings.EXPORT_CACHE_DIR,
+                                                     genome.id % 1024, (genome.id >> 10) % 1024,
+                                                     genome.id, version, fmt)
+
+
+def render_export(io, fmt, fn):
+    """
+    Renders export of a genome in the specified format to a file, and to a
+    gzip compressed file with .gz suffix, in one pass. Files are written under
+    temporary names and renamed when complete.
+    """
+
+    dirn = os.path.dirname(fn)
+    z = zlib.compressobj(6, zlib.DEFLATED, 16+zlib.MAX_WBITS)
+    with tempfile.NamedTemporaryFile(dir=dirn, delete=False) as out:
+        with tempfile.NamedTemporaryFile(dir=dirn, delete=False) as gz_out:
+            try:
+                for lines in getattr(io, EXPORT_FORMATS[fmt])():
+                    if isinstance(lines, unicode):
+                        lines = lines.encode('utf-8')
+                    out.write(lines)
+                    gz_out.write(z.compress(lines))
+                gz_out.write(z.flush())
+            except:
+                os.unlink(out.name)
+                os.unlink(gz_out.name)
+                raise
+    os.chmod(out.name, 0644)
+    os.chmod(gz_out.name, 0644)
+    os.rename(gz_out.name, fn+'.gz')
+    os.rename(out.name, fn)
+
+
+def cached_export(genome, fmt, io=None):
+    """
+    Returns (version, filename, filename of gzip compressed file) of export of
+    a genome in the specified format. Exports are rendered once for each
+    version of a genome, and reused until location index of any fragment of
+    the genome changes; exports of older versions are then removed.
+    """
+
+    io = IO(genome) if io is None else io
+    version = io.version()
+    fn = export_fn(genome, version, fmt)
+
+    if not os.path.exists(fn) or not os.path.exists(fn+'.gz'):
+        make_required_dirs(fn)
+        render_export(io, fmt, fn)
+        pattern = export_fn(genome, '*', fmt)
+        for old_fn in glob.glob(pattern)+glob.glob(pattern+'.gz'):
+            if old_fn not in (fn, fn+'.gz'):
+                try:
+                    os.unlink(old_fn)
+                except OSError:
+                    pass
+
+    return version, fn, fn+'.gz'
@@ -2,6 +2,58 @@ from django.db import connection
 from BCBio import GFF
 from edge.models import *
 import time
+import urllib
+
+
+NAME_FIELDS = ('name', 'Name', 'gene', 'locus', 'locus_tag', 'product', 'protein_id')
+
+
+def feature_name(feature_id, feature_type, qualifiers):
+    name = feature_id
+    if name == '' or name is None:
+        name = feature_type
+    for field in NAME_FIELDS:
+        if field in qualifiers:
+            v = qualifiers[field]
+            if len(v) > 0:
+                name = v[0]
+                break
+    return name[0:100]
+
+
+def parse_gff3_annotations(lines):
+    """
+    Parses features from lines of GFF3 text, without sequences. Generator
+    yielding, for each feature, the sequence ID and a dictionary of arguments
+    to Fragment.annotate.
+    """
+
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line.startswith('##FASTA'):
+            break
+        if line.strip() == '' or line.startswith('#'):
+            continue
+
+        cols = line.split('\t')
+        if len(cols) != 9:
+            raise Exception('Expecting 9 tab separated columns in GFF line "%s"' % (line,))
+        seqid, source, type, start, end, score, strand, phase, attributes = cols
+
+        qualifiers = {}
+        for attribute in attributes.split(';'):
+            if attribute.strip() == '':
+                continue
+            if '=' not in attribute:
+                raise Exception('Invalid GFF attribute "%s"' % (attribute,))
+            k, v = attribute.split('=', 1)
+            qualifiers[urllib.unquote(k.strip())] = [urllib.unquote(x) for x in v.split(',')]
+        feature_id = qualifiers['ID'][0] if 'ID' in qualifiers else None
+
+        yield (urllib.unquote(seqid),
+               dict(first_base1=int(start), last_base1=int(end),
+                    name=feature_name(feature_id, type, qualifiers), type=type,
+                    strand={'+': 1, '-': -1}.get(strand, None), qualifiers=qualifiers))
 
 
 class GFFImporter(object):
@@ -33,7 +85,6 @@ class GFFFragmentImporter(object):
         self.__rec = gff_rec
         self.__sequence = None
         self.__features = None
-        self.__fclocs = None
 
     def do_import(self):
         self.parse_gff()
@@ -46,8 +97,6 @@ class GFFFragmentImporter(object):
         return f
 
     def parse_gff(self):
-        name_fields = ('name', 'Name', 'gene', 'locus', 'locus_tag', 'product', 'protein_id')
-
         self.__sequence = str(self.__rec.seq)
         seqlen = len(self.__sequence)
         print '%s: %s' % (self.__rec.id, seqlen)
@@ -58,17 +107,7 @@ class GFFFragmentImporter(object):
             if feature.location.start == 0 and feature.location.end == seqlen:
                 continue
 
-            # get name
-            name = feature.id
-            if name == '':
-                name = feature.type
-            for field in name_fields:
-                if field in feature.qualifiers:
-                    v = feature.qualifiers[field]
-                    if len(v) > 0:
-                        name = v[0]
-                        break
-            name = name[0:100]
+            name = feature_name(feature.id, feature.type, feature.qualifiers)
 
             # get qualifiers
             qualifiers = {}
@@ -100,58 +139,20 @@ class GFFFragmentImporter(object):
         new_fragment.save()
         new_fragment = new_fragment.indexed_fragment()
 
-        prev = None
+        sequences = []
         flen = 0
-        seqlen = len(self.__sequence)
         for sz in chunk_sizes:
-            prev = new_fragment._append_to_fragment(prev, flen, self.__sequence[flen:flen+sz])
+            sequences.append(self.__sequence[flen:flen+sz])
             flen += sz
-        if flen < seqlen:
-            f = new_fragment._append_to_fragment(prev, flen, self.__sequence[flen:seqlen])
+        if flen < len(self.__sequence):
+            sequences.append(self.__sequence[flen:])
+        new_fragment._append_to_fragment(sequences)
 
         return new_fragment
 
     def annotate(self, fragment):
-        self.__fclocs = {c.base_first: c
-                         for c in Fragment_Chunk_Location.objects
-                                                         .select_related('chunk')
-                                                         .filter(fragment=fragment)}
-
-        for feature in self.__features:
-            f_start, f_end, f_name, f_type, f_strand, f_qualifiers = feature
-            # print '  %s %s: %s-%s %s' % (f_type, f_name, f_start, f_end, f_strand)
-            self._annotate_feature(fragment, f_start, f_end, f_name, f_type, f_strand, f_qualifiers)
-
-    def _annotate_feature(self, fragment, first_base1, last_base1, name, type, strand, qualifiers):
-        if fragment.circular and last_base1 < first_base1:
-            # has to figure out the total length from last chunk
-            length = len(self.__sequence)-first_base1+1+last_base1
-        else:
-            length = last_base1-first_base1+1
-            if length <= 0:
-                raise Exception('Annotation must have length one or more')
-
-        if first_base1 not in self.__fclocs or\
-           (last_base1 < len(self.__sequence) and last_base1+1 not in self.__fclocs):
-            raise Exception('Missing chunks for feature')
-
-        annotation_start = self.__fclocs[first_base1]
-        if last_base1 != len(self.__sequence):
-            annotation_end = self.__fclocs[last_base1+1]
-        else:
-            annotation_end = self.__fclocs[1]
-
-        new_feature = fragment._add_feature(name, type, length, strand, qualifiers)
-
-        fc = annotation_start
-        a_i = 1
-        while True:
-            chunk = fc.chunk
-            fragment._annotate_chunk(chunk, new_feature, a_i, a_i+len(chunk.sequence)-1)
-            a_i += len(chunk.sequence)
-            if fc.base_last+1 in self.__fclocs:
-                fc = self.__fclocs[fc.base_last+1]
-            else:
-                fc = self.__fclocs[1]
-            if fc.id == annotation_end.id:
-                break
+        # fragment is pre-chunked at feature boundaries, so no chunk is split
+        fragment.annotate_many([dict(first_base1=f_start, last_base1=f_end, name=f_name,
+                                     type=f_type, strand=f_strand, qualifiers=f_qualifiers)
+                                for f_start, f_end, f_name, f_type, f_strand, f_qualifiers
+                                in self.__features])
@@ -1,53 +1,158 @@
-from BCBio import GFF
+import re
+import json
+import urllib
+import hashlib
+from StringIO import StringIO
+from Bio import SeqIO
+from Bio.Alphabet import generic_dna
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 from Bio.SeqFeature import SeqFeature, FeatureLocation
+from edge.models import Chunk, Fragment
+from edge.kmer import genome_index_signature
+
+
+# bases per line in FASTA output
+FASTA_LINE_LENGTH = 60
+
+# number of chunks to read at a time when streaming sequence
+CHUNK_BATCH_SIZE = 100
 
 
 class IO(object):
     """
-    Class for exporting genome sequences and features.
+    Class for exporting genome sequences and features. Output is streamed one
+    fragment at a time, reading annotations from a cursor and sequences a few
+    chunks at a time, so memory use does not grow with genome size.
     """
 
     def __init__(self, genome):
         self.__genome = genome.indexed_genome()
 
-    def to_fasta(self, filename):
+    def version(self):
         """
-        Export to FASTA format, saving to the specified filename.
+        Returns a string identifying current version of the genome's export,
+        derived from location index timestamps, versions and annotations of the
+        genome's fragments.
         """
-        outf = open(filename, 'w')
+
+        signature = genome_index_signature(self.__genome)
+        annotations = Fragment.annotation_versions([x[0] for x in signature])
+        signature = [x+[annotations[x[0]]] for x in signature]
+        return hashlib.sha1(json.dumps([self.__genome.id, signature])).hexdigest()
+
+    def __fragments(self):
         for fragment in self.__genome.fragments.all():
-            fragment = fragment.indexed_fragment()
-            outf.write('>%s\n' % (fragment.name,))
-            outf.write(fragment.sequence)
-            outf.write('\n')
-        outf.close()
+            yield fragment.indexed_fragment()
 
-    def to_gff(self, filename):
+    def __sequence(self, fragment):
+        chunk_ids = list(fragment.fragment_chunk_location_set.order_by('base_first')
+                                                             .values_list('chunk_id', flat=True))
+        for i in range(0, len(chunk_ids), CHUNK_BATCH_SIZE):
+            ids = chunk_ids[i:i+CHUNK_BATCH_SIZE]
+            sequences = dict(Chunk.objects.filter(id__in=ids).values_list('id', 'sequence'))
+            for chunk_id in ids:
+                yield sequences[chunk_id]
+
+    def __wrapped_sequence(self, fragment):
+        line = ''
+        for sequence in self.__sequence(fragment):
+            line += sequence
+            if len(line) >= FASTA_LINE_LENGTH:
+                n = len(line)-len(line) % FASTA_LINE_LENGTH
+                yield '\n'.join(line[i:i+FASTA_LINE_LENGTH]
+                                for i in range(0, n, FASTA_LINE_LENGTH))+'\n'
+                line = line[n:]
+        if len(line) > 0:
+            yield line+'\n'
+
+    def fasta_lines(self):
         """
-        Export to GFF format, saving to the specified filename.
+        Generator yielding FASTA output, a few lines at a time.
         """
-        records = []
 
-        for fragment in self.__genome.fragments.all():
-            fragment = fragment.indexed_fragment()
-            seq = Seq(fragment.sequence)
-            rec = SeqRecord(seq, "%s" % (fragment.name,))
-            features = []
+        for fragment in self.__fragments():
+            yield '>%s\n' % (fragment.name,)
+            for lines in self.__wrapped_sequence(fragment):
+                yield lines
+
+    def gff_lines(self):
+        """
+        Generator yielding GFF3 output, with sequences in a ##FASTA section, a
+        few lines at a time.
+        """
+
+        yield '##gff-version 3\n'
+        with_sequence = []
+        for fragment in self.__fragments():
+            length = fragment.length
+            if length > 0:
+                yield '##sequence-region %s 1 %s\n' % (fragment.name, length)
+                with_sequence.append(fragment)
+            for annotation in fragment.iter_annotations():
+                yield self.__gff_feature(fragment, annotation)
+
+        if len(with_sequence) > 0:
+            yield '##FASTA\n'
+            for fragment in with_sequence:
+                # description Biopython writes for records without one, kept
+                # so output matches GFF exported before
+                yield '>%s <unknown description>\n' % (fragment.name,)
+                for lines in self.__wrapped_sequence(fragment):
+                    yield lines
 
-            for annotation in fragment.annotations():
+    def genbank_lines(self):
+        """
+        Generator yielding GenBank output, one fragment record at a time. Unlike
+        GFF and FASTA output, each record is built in memory.
+        """
+
+        for fragment in self.__fragments():
+            # GenBank LOCUS names are at most 16 characters, without spaces
+            locus = re.sub(r'\s', '_', fragment.name)[0:16]
+            rec = SeqRecord(Seq(''.join(self.__sequence(fragment)), generic_dna),
+                            id=locus, name=locus, description=fragment.name)
+            for annotation in fragment.iter_annotations():
                 # FeatureLocation first bp is AfterPosition, so -1
-                loc = FeatureLocation(annotation.base_first-1, annotation.base_last)
-                qualifiers = {'name': annotation.feature.name}
-                feature = SeqFeature(loc,
-                                     type=annotation.feature.type,
-                                     strand=1,
-                                     qualifiers=qualifiers)
-                features.append(feature)
-
-            rec.features = features
-            records.append(rec)
-
-        with open(filename, "w") as out_handle:
-            GFF.write(records, out_handle, include_fasta=True)
+                loc = FeatureLocation(annotation.base_first-1, annotation.base_last,
+                                      strand=annotation.feature.strand)
+                rec.features.append(SeqFeature(loc, type=annotation.feature.type,
+                                               qualifiers={'name': annotation.feature.name}))
+            out = StringIO()
+            SeqIO.write([rec], out, 'genbank')
+            yield out.getvalue()
+
+    def __gff_feature(self, fragment, annotation):
+        feature = annotation.feature
+        strand = {1: '+', -1: '-'}.get(feature.strand, '.')
+        name = feature.name
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        return '\t'.join([fragment.name, 'feature', feature.type or 'sequence_feature',
+                          str(annotation.base_first), str(annotation.base_last), '.', strand,
+                          '0' if feature.type == 'CDS' else '.',
+                          'name=%s' % urllib.quote(name.strip(), safe=':/ ')])+'\n'
+
+    def to_fasta(self, filename):
+        """
+        Export to FASTA format, saving to the specified filename.
+        """
+        with open(filename, 'w') as outf:
+            for lines in self.fasta_lines():
+                outf.write(lines)
+
+    def to_genbank(self, filename):
+        """
+        Export to GenBank format, saving to the specified filename.
+        """
+        with open(filename, 'w') as outf:
+            for lines in self.genbank_lines():
+                outf.write(lines)
+
+    def to_gff(self, filename):
+        """
+        Export to GFF format, saving to the specified filename.
+        """
+        with open(filename, 'w') as outf:
+            for lines in self.gff_lines():
+                outf.write(lines)
@@ -0,0 +1,331 @@
+import os
+import json
+import mmap
+import shutil
+import tempfile
+import threading
+import numpy
+from collections import OrderedDict
+from django.conf import settings
+from django.db.models import Max
+from edge.models import Fragment
+from edge.blast import Blast_Result
+from edge.blastdb import make_required_dirs
+from Bio.Seq import Seq
+
+
+KMER_LENGTH = 12
+INDEX_FORMAT_VERSION = 1
+
+# 2-bit encoding of bases; anything else can't be part of an indexed k-mer
+BASE_CODES = numpy.zeros(256, dtype=numpy.uint8)+4
+for _i, _b in enumerate('acgt'):
+    BASE_CODES[ord(_b)] = _i
+    BASE_CODES[ord(_b.upper())] = _i
+
+# separates fragments in the indexed sequence, so no k-mer spans two fragments
+FRAGMENT_SEPARATOR = '|'
+
+
+def default_genome_index_name(genome):
+    return "%s/genome/%s/%s/edge-genome-%d-kmer" % (settings.KMER_DATA_DIR,
+                                                    genome.id % 1024, (genome.id >> 10) % 1024,
+                                                    genome.id)
+
+
+def genome_index_signature(genome):
+    """
+    Returns list of (fragment ID, index timestamp, index version, length) for
+    fragments in the genome, or None if any fragment does not have a fresh
+    location index. An index built for the genome is valid as long as the
+    signature is unchanged.
+    """
+
+    q = genome.fragments.annotate(indexed_length=Max('fragment_chunk_location__base_last'))\
+                        .values_list('id', 'fragment_index__fresh',
+                                     'fragment_index__updated_on', 'fragment_index__version',
+                                     'indexed_length')
+    signature = []
+    for fragment_id, fresh, updated_on, version, length in q:
+        if fresh is not True or updated_on is None or length is None:
+            return None
+        signature.append([fragment_id, updated_on.isoformat(), version, length])
+    return sorted(signature)
+
+
+def encode_kmers(sequence, k=KMER_LENGTH):
+    """
+    Returns an array of k-mer codes, one for each position in the sequence
+    where a k-mer starts, and a boolean array indicating whether the k-mer at
+    that position only has ACGT bases.
+    """
+
+    bases = BASE_CODES[numpy.frombuffer(sequence, dtype=numpy.uint8)]
+    n = len(bases)-k+1
+    if n <= 0:
+        return numpy.zeros(0, dtype=numpy.uint32), numpy.zeros(0, dtype=bool)
+
+    codes = numpy.zeros(n, dtype=numpy.uint32)
+    for i in range(k):
+        codes <<= 2
+        codes |= bases[i:i+n] & 3
+
+    invalid = numpy.concatenate(([0], numpy.cumsum(bases > 3)))
+    valid = (invalid[k:k+n]-invalid[0:n]) == 0
+    return codes, valid
+
+
+def build_genome_index(genome, dirname=None):
+    """
+    Builds k-mer index for all fragments of a genome. The index is a directory
+    with a sorted array of k-mer codes, an array of positions of those k-mers,
+    the concatenated sequence of all fragments, and fragment metadata.
+    """
+
+    dirname = default_genome_index_name(genome) if dirname is None else dirname
+
+    fragment_ids = list(genome.fragments.values_list('id', flat=True))
+    fragments = Fragment.bulk_indexed_fragments(fragment_ids)
+    # bulk_indexed_fragments re-indexes stale fragments, so get signature after
+    signature = genome_index_signature(genome)
+
+    sequences = []
+    fragment_meta = []
+    starts = []
+    offset = 0
+    for fragment_id in sorted(fragments.keys()):
+        fragment = fragments[fragment_id]
+        sequence = str(fragment.sequence).lower()
+        length = len(sequence)
+        # like the blast db, double circular sequence, so we can find matches
+        # across circular boundary; only index k-mers starting in first copy
+        indexed = sequence+sequence if fragment.circular is True else sequence
+        fragment_meta.append(dict(id=fragment.id, name=fragment.name, offset=offset,
+                                  length=length, circular=fragment.circular))
+        starts.append((offset, offset+length))
+        sequences.append(indexed)
+        sequences.append(FRAGMENT_SEPARATOR)
+        offset += len(indexed)+1
+
+    sequence = ''.join(sequences)
+    codes, valid = encode_kmers(sequence)
+    indexed_positions = numpy.zeros(len(codes), dtype=bool)
+    for start, end in starts:
+        indexed_positions[start:min(end, len(codes))] = True
+    positions = numpy.nonzero(valid & indexed_positions)[0].astype(numpy.uint32)
+    codes = codes[positions]
+    order = numpy.argsort(codes, kind='mergesort')
+
+    # write to a temporary directory, then move into place, so readers never
+    # see partially written index
+    make_required_dirs(dirname)
+    tmpdir = tempfile.mkdtemp(dir=os.path.dirname(dirname))
+    numpy.save('%s/codes.npy' % tmpdir, codes[order])
+    numpy.save('%s/positions.npy' % tmpdir, positions[order])
+    with open('%s/sequence.dat' % tmpdir, 'wb') as f:
+        f.write(sequence)
+    with open('%s/meta.json' % tmpdir, 'w') as f:
+        json.dump(dict(version=INDEX_FORMAT_VERSION, k=KMER_LENGTH,
+                       signature=signature, fragments=fragment_meta), f)
+
+    if os.path.isdir(dirname):
+        shutil.rmtree(dirname)
+    os.rename(tmpdir, dirname)
+    return dirname
+
+
+class Kmer_Index(object):
+    """
+    Memory mapped k-mer index of a genome, for finding exact matches of a
+    query sequence.
+    """
+
+    def __init__(self, dirname):
+        with open('%s/meta.json' % dirname) as f:
+            meta = json.load(f)
+        self.dirname = dirname
+        self.k = meta['k']
+        self.signature = meta['signature']
+        self.fragments = meta['fragments']
+        self.__offsets = numpy.array([f['offset'] for f in self.fragments], dtype=numpy.int64)
+        self.__codes = numpy.load('%s/codes.npy' % dirname, mmap_mode='r')
+        self.__positions = numpy.load('%s/positions.npy' % dirname, mmap_mode='r')
+        with open('%s/sequence.dat' % dirname, 'rb') as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                self.__sequence = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.__sequence = ''
+
+    def close(self):
+        """
+        Releases memory mapped files of the index; the index can no longer be
+        searched.
+        """
+
+        if isinstance(self.__sequence, mmap.mmap):
+            self.__sequence.close()
+        # numpy memory maps are unmapped, and their files closed, when the
+        # arrays are garbage collected
+        self.__codes = None
+        self.__positions = None
+
+    def bases(self):
+        """
+        Returns sequence of all fragments, as a read-only array of bytes.
+        Fragments are at offsets specified in self.fragments.
+        """
+        return numpy.memmap('%s/sequence.dat' % self.dirname, dtype=numpy.uint8, mode='r')
+
+    @staticmethod
+    def can_search(query):
+        return len(query) > 0 and all(BASE_CODES[ord(c)] < 4 for c in query)
+
+    def __find_positions(self, query):
+        if len(query) >= self.k:
+            code = 0
+            for c in query[0:self.k]:
+                code = (code << 2) | int(BASE_CODES[ord(c)])
+            lo = numpy.searchsorted(self.__codes, code, side='left')
+            hi = numpy.searchsorted(self.__codes, code, side='right')
+            candidates = sorted(int(p) for p in self.__positions[lo:hi])
+            return [p for p in candidates if self.__sequence[p:p+len(query)] == query]
+
+        # query shorter than k-mer, scan the sequence
+        positions = []
+        p = self.__sequence.find(query)
+        while p >= 0:
+            positions.append(p)
+            p = self.__sequence.find(query, p+1)
+        return positions
+
+    def __to_result(self, query, position, strand):
+        i = int(numpy.searchsorted(self.__offsets, position, side='right'))-1
+        fragment = self.fragments[i]
+        start = position-fragment['offset']
+        if start >= fragment['length']:
+            # match in second copy of a circular sequence
+            return None
+
+        subject = self.__sequence[position:position+len(query)]
+        if strand > 0:
+            subject_start, subject_end = start+1, start+len(query)
+        else:
+            subject = str(Seq(subject).reverse_complement())
+            subject_start, subject_end = start+len(query), start+1
+
+        return Blast_Result(fragment_id=fragment['id'],
+                            fragment_length=fragment['length'],
+                            hit_def=fragment['name'],
+                            query_start=1,
+                            query_end=len(query),
+                            subject_start=subject_start,
+                            subject_end=subject_end,
+                            evalue=0.0,
+                            alignment=dict(query=query,
+                                           match='|'*len(query),
+                                           matchi=' '*len(query),
+                                           subject=subject))
+
+    def find(self, query, both_strands=True):
+        """
+        Returns list of Blast_Result objects, each an exact, full length match
+        of the query. Query must only have ACGT bases.
+        """
+
+        query = str(query).lower()
+        searches = [(query, 1)]
+        if both_strands:
+            rc = str(Seq(query).reverse_complement())
+            # palindromic query matches same positions on both strands
+            if rc != query:
+                searches.append((rc, -1))
+
+        results = []
+        for q, strand in searches:
+            for position in self.__find_positions(q):
+                res = self.__to_result(query, position, strand)
+                if res is not None:
+                    results.append(res)
+
+        return sorted(results, key=lambda r: (r.fragment_id,
+                                              min(r.subject_start, r.subject_end)))
+
+
+class Loaded_Indices(object):
+    """
+    Indices loaded by this process, by key. Each index keeps several files
+    open, so at most size indices are kept; least recently used index is
+    dropped when another index is added. A dropped index is not closed, since
+    another thread may still be using it; its files are closed when it is
+    garbage collected.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.__indices = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__indices)
+
+    def get(self, key):
+        with self.__lock:
+            index = self.__indices.pop(key, None)
+            if index is not None:
+                self.__indices[key] = index
+            return index
+
+    def put(self, key, index):
+        with self.__lock:
+            self.__indices.pop(key, None)
+            self.__indices[key] = index
+            while len(self.__indices) > max(self.size, 1):
+                self.__indices.popitem(last=False)
+
+
+# loaded indices, by genome ID
+_loaded_indices = Loaded_Indices(settings.KMER_LOADED_INDICES)
+
+
+def genome_index(genome):
+    """
+    Returns Kmer_Index for the genome, building or re-building the index if
+    fragments of the genome changed since the index was built.
+    """
+
+    signature = genome_index_signature(genome)
+    index = _loaded_indices.get(genome.id)
+    if index is not None and signature is not None and index.signature == signature:
+        return index
+
+    dirname = default_genome_index_name(genome)
+    index = None
+    if signature is not None and os.path.isfile('%s/meta.json' % dirname):
+        index = Kmer_Index(dirname)
+        if index.signature != signature:
+            index.close()
+            index = None
+
+    if index is None:
+        build_genome_index(genome, dirname)
+        index = Kmer_Index(dirname)
+
+    _loaded_indices.put(genome.id, index)
+    return index
+
+
+def find_exact(genome, query, both_strands=True, context=None):
+    """
+    Finds exact, full length matches of query on genome, using the genome's
+    k-mer index instead of BLAST. Returns a list of Blast_Result objects, or
+    None if the query cannot be searched using the index, e.g. it has
+    ambiguous bases; caller should then fall back to BLAST.
+    """
+
+    query = str(query).lower()
+    if not Kmer_Index.can_search(query):
+        return None
+    results = genome_index(genome).find(query, both_strands=both_strands)
+    if context is not None:
+        context.load(results)
+    return results
@@ -0,0 +1,59 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from edge.models import Fragment
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks annotating a fragment with many features, one at a time and
+    all at once. Creates a random fragment and rolls back all changes when
+    done. Optional arguments: number of features (default 10000) and number of
+    features to annotate one at a time (default 500).
+    """
+
+    def annotations(self, n, length):
+        annotations = []
+        for i in range(n):
+            first = random.randint(1, length-2000)
+            annotations.append(dict(first_base1=first, last_base1=first+random.randint(50, 2000),
+                                    name='F%d' % i, type='gene', strand=random.choice([1, -1])))
+        return annotations
+
+    def handle(self, *args, **options):
+        n = int(args[0]) if len(args) > 0 else 10000
+        n_one_by_one = int(args[1]) if len(args) > 1 else 500
+
+        # don't keep list of queries in DEBUG mode
+        connection.use_debug_cursor = False
+
+        random.seed(0)
+        length = 1000000
+        sequence = ''.join(random.choice('agct') for i in range(length))
+        annotations = self.annotations(n, length)
+
+        try:
+            with transaction.atomic():
+                f = Fragment.create_with_sequence('Benchmark', sequence)
+
+                t0 = time.time()
+                for a in annotations[0:n_one_by_one]:
+                    f.annotate(**a)
+                t = time.time()-t0
+                self.stdout.write('annotate: %d features, %.2fs, %.1f features/s'
+                                  % (n_one_by_one, t, n_one_by_one/t))
+
+                f = Fragment.create_with_sequence('Benchmark', sequence)
+                t0 = time.time()
+                f.annotate_many(annotations)
+                t = time.time()-t0
+                self.stdout.write('annotate_many: %d features, %.2fs, %.1f features/s'
+                                  % (n, t, n/t))
+                raise Rollback()
+        except Rollback:
+            pass
@@ -0,0 +1,59 @@
+import random
+import time
+from Bio import SeqIO
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from edge.models import Fragment
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks applying point mutations to the first sequence of a FASTA file,
+    e.g. the E. coli MG1655 chromosome, one at a time and all at once. Rolls
+    back all changes when done. Optional arguments after FASTA file: number of
+    mutations (default 1000) and number of mutations to apply one at a time
+    (default 50).
+    """
+
+    def handle(self, *args, **options):
+        if len(args) < 1:
+            raise Exception('Expecting FASTA file as argument')
+        n = int(args[1]) if len(args) > 1 else 1000
+        n_one_by_one = int(args[2]) if len(args) > 2 else 50
+
+        # don't keep list of queries in DEBUG mode
+        connection.use_debug_cursor = False
+
+        record = next(SeqIO.parse(args[0], 'fasta'))
+        sequence = str(record.seq)
+        self.stdout.write('%s: %d bps' % (record.id, len(sequence)))
+
+        random.seed(0)
+        edits = [dict(before_base1=bp, length_to_remove=1, sequence=random.choice('agct'))
+                 for bp in random.sample(xrange(1, len(sequence)+1), n)]
+
+        try:
+            with transaction.atomic():
+                root = Fragment.create_with_sequence(record.id, sequence)
+
+                f = root.update('One at a time')
+                t0 = time.time()
+                for e in edits[0:n_one_by_one]:
+                    f.replace_bases(e['before_base1'], e['length_to_remove'], e['sequence'])
+                t = time.time()-t0
+                self.stdout.write('replace_bases: %d mutations, %.2fs, %.1f mutations/s'
+                                  % (n_one_by_one, t, n_one_by_one/t))
+
+                f = root.update('All at once')
+                t0 = time.time()
+                f.apply_edits(edits)
+                t = time.time()-t0
+                self.stdout.write('apply_edits: %d mutations, %.2fs, %.1f mutations/s'
+                                  % (n, t, n/t))
+                raise Rollback()
+        except Rollback:
+            pass
@@ -0,0 +1,32 @@
+import time
+from Bio import SeqIO
+from django.core.management.base import BaseCommand
+from edge.orfs import find_orfs, detect_orfs_by_translation
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks ORF detection on each sequence of a FASTA file, e.g. the E.
+    coli MG1655 chromosome.
+    """
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise Exception('Expecting FASTA file as argument')
+
+        for record in SeqIO.parse(args[0], 'fasta'):
+            seq = str(record.seq)
+            self.stdout.write('%s: %d bps' % (record.id, len(seq)))
+
+            t0 = time.time()
+            orfs = find_orfs(seq)
+            t1 = time.time()
+            reference = detect_orfs_by_translation(seq)
+            t2 = time.time()
+            circular = find_orfs(seq, circular=True)
+            t3 = time.time()
+
+            self.stdout.write('  find_orfs: %d ORFs, %.2fs' % (len(orfs), t1-t0))
+            self.stdout.write('  detect_orfs_by_translation: %d ORFs, %.2fs, same ORFs: %s'
+                              % (len(reference), t2-t1, orfs == reference))
+            self.stdout.write('  find_orfs, circular: %d ORFs, %.2fs' % (len(circular), t3-t2))
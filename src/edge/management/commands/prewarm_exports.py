@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from edge.models import Genome
+from edge.io import IO
+from edge.exports import EXPORT_FORMATS, cached_export
+
+
+class Command(BaseCommand):
+    """
+    Renders cached exports of all active genomes. Optional arguments: export
+    formats to render, from gff, fa and gb (default all).
+    """
+
+    def handle(self, *args, **options):
+        formats = args if len(args) > 0 else sorted(EXPORT_FORMATS.keys())
+        for fmt in formats:
+            if fmt not in EXPORT_FORMATS:
+                raise Exception('Unknown export format %s' % (fmt,))
+
+        for genome in Genome.objects.filter(active=True):
+            io = IO(genome)
+            for fmt in formats:
+                version, fn, gz_fn = cached_export(genome, fmt, io=io)
+                self.stdout.write('%s: %s' % (genome.id, fn))
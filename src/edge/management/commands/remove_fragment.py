@@ -1,6 +1,6 @@
 from django.core.management.base import BaseCommand
 from django.db import transaction
-from edge.models import Fragment, Chunk_Feature, Chunk
+from edge.models import Fragment, Chunk_Feature, Chunk, Genome
 
 
 @transaction.atomic()
@@ -12,7 +12,10 @@ def remove_fragment(fragment_id):
     fragment.start_chunk = None
     fragment.save()
     Chunk.objects.filter(initial_fragment_id=fragment_id).delete()
+    genome_ids = list(fragment.genome_fragment_set.values_list('genome_id', flat=True))
     fragment.genome_fragment_set.all().delete()
+    for genome_id in genome_ids:
+        Genome.update_fragment_fingerprint(genome_id)
     fragment.delete()
 
 
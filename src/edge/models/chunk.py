@@ -57,6 +57,27 @@ class Annotation(object):
         return sorted(annotations, key=lambda a: a.base_first)
 
 
+@transaction.atomic()  # this method has to be in a transaction, see below
+def bulk_create_with_ids(klass, entries):
+    # IMPORTANT: this entire method must be within a transaction, so we can
+    # compute and assign unique IDs, following the current max ID
+
+    if len(entries) == 0:
+        return entries
+
+    cur_id = 1
+    try:
+        cur_id = klass.objects.select_for_update().order_by('-id').values('id')[0]['id']+1
+    except IndexError:
+        pass
+
+    for entry in entries:
+        entry.id = cur_id
+        cur_id += 1
+    klass.objects.bulk_create(entries)
+    return entries
+
+
 class BigIntPrimaryModel(models.Model):
     class Meta:
         app_label = "edge"
@@ -75,6 +96,10 @@ class BigIntPrimaryModel(models.Model):
                 self.id = 1
         return super(BigIntPrimaryModel, self).save(*args, **kwargs)
 
+    @classmethod
+    def bulk_create(klass, entries):
+        return bulk_create_with_ids(klass, entries)
+
 
 class Chunk(BigIntPrimaryModel):
     class Meta:
@@ -115,10 +140,19 @@ class Feature(models.Model):
     @property
     def qualifiers(self):
         if self._qualifiers is not None:
-            return json.loads(self._qualifiers)
+            # decode once, until qualifiers change
+            cached = getattr(self, '_decoded_qualifiers', None)
+            if cached is None or cached[0] is not self._qualifiers:
+                cached = (self._qualifiers, json.loads(self._qualifiers))
+                self._decoded_qualifiers = cached
+            return cached[1]
         else:
             return None
 
+    @property
+    def qualifiers_json(self):
+        return self._qualifiers if self._qualifiers is not None else 'null'
+
 
 class Chunk_Feature_Manager(models.Manager):
     def get_query_set(self):
@@ -173,23 +207,3 @@ class Fragment_Chunk_Location(BigIntPrimaryModel):
     def annotations(self):
         return [Annotation(base_first=self.base_first, base_last=self.base_last, chunk_feature=cf)
                 for cf in self.chunk.chunk_feature_set.all()]
-
-    @staticmethod
-    @transaction.atomic()  # this method has to be in a transaction, see below
-    def bulk_create(entries):
-        # IMPORTANT: this entire method must be within a transaction, so we can
-        # compute and assign unique BigIntPrimary IDs
-
-        cur_id = 1
-        try:
-            cur_id = Fragment_Chunk_Location.objects\
-                                            .select_for_update()\
-                                            .order_by('-id')\
-                                            .values('id')[0]['id']+1
-        except IndexError:
-            pass
-
-        for entry in entries:
-            entry.id = cur_id
-            cur_id += 1
-        Fragment_Chunk_Location.objects.bulk_create(entries)
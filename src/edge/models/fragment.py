@@ -1,6 +1,6 @@
 from django.utils import timezone
 from django.db import models
-from django.db.models import Q
+from django.db.models import Q, Max
 from edge.models.chunk import *
 from edge.models.fragment_writer import Fragment_Writer
 from edge.models.fragment_annotator import Fragment_Annotator
@@ -42,12 +42,62 @@ class Fragment(models.Model):
         new_fragment.save()
         new_fragment = new_fragment.indexed_fragment()
         if initial_chunk_size is None or initial_chunk_size == 0:
-            new_fragment.insert_bases(None, sequence)
+            new_fragment._append_to_fragment([sequence])
         else:
-            for i in range(0, len(sequence), initial_chunk_size):
-                new_fragment.insert_bases(None, sequence[i:i+initial_chunk_size])
+            new_fragment._append_to_fragment([sequence[i:i+initial_chunk_size]
+                                              for i in range(0, len(sequence),
+                                                             initial_chunk_size)])
         return new_fragment
 
+    @staticmethod
+    def bulk_indexed_fragments(fragment_ids):
+        """
+        Returns a dictionary of fragment ID to Indexed_Fragment, for the
+        specified fragment IDs. Fragments with fresh location index are loaded,
+        along with their lengths, in a single query; only fragments with stale
+        index are re-indexed individually. Lengths are cached on the returned
+        objects, so use these objects for reading only.
+        """
+
+        fragment_ids = list(set(fragment_ids))
+        if len(fragment_ids) == 0:
+            return {}
+
+        max_base_last = Max('fragment_chunk_location__base_last')
+        q = Indexed_Fragment.objects.filter(id__in=fragment_ids)\
+                                    .select_related('fragment_index')\
+                                    .annotate(indexed_length=max_base_last)
+
+        fragments = {}
+        for fragment in q:
+            try:
+                fresh = fragment.fragment_index.fresh
+            except Fragment_Index.DoesNotExist:
+                fresh = False
+            if fresh is True and fragment.indexed_length is not None:
+                fragment._preloaded_length = fragment.indexed_length
+            else:
+                fragment = fragment.indexed_fragment()
+                fragment._preloaded_length = fragment.length
+            fragments[fragment.id] = fragment
+
+        return fragments
+
+    @staticmethod
+    def annotation_versions(fragment_ids):
+        """
+        Returns a dictionary of fragment ID to annotations version of each
+        fragment. Annotating a fragment does not touch its location index
+        version, so use this along with location index versions to tell if a
+        fragment has changed.
+        """
+
+        fragment_ids = list(set(fragment_ids))
+        versions = dict((fragment_id, None) for fragment_id in fragment_ids)
+        versions.update(Fragment_Index.objects.filter(fragment_id__in=fragment_ids)
+                                              .values_list('fragment_id', 'annotations_version'))
+        return versions
+
     def predecessors(self):
         pred = [self]
         f = self.parent
@@ -112,6 +162,7 @@ class Fragment(models.Model):
             index = Fragment_Index(fragment=self)
         index.fresh = True
         index.updated_on = timezone.now()
+        index.version += 1
         index.save()
 
         return indexed
@@ -146,6 +197,12 @@ class Fragment_Index(models.Model):
     fragment = models.OneToOneField(Fragment)
     fresh = models.BooleanField()
     updated_on = models.DateTimeField('Updated', null=True)
+    # incremented whenever the location index or sequence changes, along with
+    # updated_on, which may not change if fragment changes within a second
+    version = models.IntegerField(default=0)
+    # incremented whenever annotations on chunks of the fragment change,
+    # including annotations added via other fragments sharing those chunks
+    annotations_version = models.IntegerField(default=0)
 
 
 class Indexed_Fragment(Fragment, Fragment_Writer, Fragment_Annotator, Fragment_Updater):
@@ -161,6 +218,9 @@ class Indexed_Fragment(Fragment, Fragment_Writer, Fragment_Annotator, Fragment_U
         app_label = "edge"
         proxy = True
 
+    # set by Fragment.bulk_indexed_fragments, for fragments loaded read-only
+    _preloaded_length = None
+
     def chunks(self):
         q = self.fragment_chunk_location_set.select_related('chunk').order_by('base_first')
         for fcl in q:
@@ -173,6 +233,8 @@ class Indexed_Fragment(Fragment, Fragment_Writer, Fragment_Annotator, Fragment_U
 
     @property
     def length(self):
+        if self._preloaded_length is not None:
+            return self._preloaded_length
         q = self.fragment_chunk_location_set.order_by('-base_last')[:1]
         q = list(q)
         if len(q) == 0:
@@ -262,6 +324,125 @@ class Indexed_Fragment(Fragment, Fragment_Writer, Fragment_Annotator, Fragment_U
         chunk_features = sorted(chunk_features, key=lambda t: t[1].base_first)
         return Annotation.from_chunk_feature_and_location_array(chunk_features)
 
+    def iter_annotations(self, bp_lo=None, bp_hi=None, after=None):
+        """
+        Like annotations, but as a generator reading chunk features from a
+        cursor in location order, for exporting fragments with many
+        annotations. Only annotations overlapping with one still being merged
+        are kept in memory. Annotations are ordered by (base_first, feature
+        id); if after is such a tuple, only annotations following it are
+        returned.
+        """
+
+        if after is not None:
+            # also read the base before after's base_first, so annotations
+            # starting before it are merged and skipped, rather than returned
+            # starting at the boundary
+            bp_lo = after[0]-1 if bp_lo is None else max(bp_lo, after[0]-1)
+
+        for a in self.__iter_annotations(bp_lo, bp_hi):
+            if after is None or (a.base_first, a.feature.id) > after:
+                yield a
+
+    def sample_annotations(self, m, bp_lo=None, bp_hi=None):
+        """
+        Returns up to m annotations spread over a region, in location order.
+        Region is divided into m bins; annotations are taken from each bin in
+        turn, in location order, so result is deterministic. Reads annotations
+        from a cursor, keeping only annotations that may be in the sample.
+        """
+
+        if m <= 0:
+            return []
+
+        lo = 1 if bp_lo is None else bp_lo
+        hi = self.length if bp_hi is None else bp_hi
+        bin_size = max(1, -(-(hi-lo+1) // m))
+        bins = {}
+        kept = 0
+
+        def rounds_needed():
+            # number of rounds, taking one annotation from each bin per round,
+            # to get m annotations from the annotations we have
+            lengths = sorted(len(v) for v in bins.values())
+            total, n, rounds = 0, len(lengths), 0
+            for i, k in enumerate(lengths):
+                # rounds from current rounds to k all take from bins i and up
+                if total+(k-rounds)*(n-i) >= m:
+                    return rounds+(m-total+n-i-1) // (n-i)
+                total += (k-rounds)*(n-i)
+                rounds = k
+            return None
+
+        for a in self.iter_annotations(bp_lo=bp_lo, bp_hi=bp_hi):
+            b = max(0, min(m-1, (a.base_first-lo) // bin_size))
+            bins.setdefault(b, []).append(a)
+            kept += 1
+            if kept >= 3*m:
+                # more annotations in a bin can only reduce rounds needed, so
+                # annotations past current rounds needed are never sampled;
+                # leaves fewer than m annotations plus one per bin
+                rounds = rounds_needed()
+                for v in bins.values():
+                    del v[rounds:]
+                kept = sum(len(v) for v in bins.values())
+
+        sample = []
+        r = 0
+        while len(sample) < m and len(sample) < kept:
+            sample.extend(bins[b][r] for b in sorted(bins.keys()) if r < len(bins[b]))
+            r += 1
+        return sorted(sample[0:m], key=lambda a: (a.base_first, a.feature.id))
+
+    def __iter_annotations(self, bp_lo, bp_hi):
+        rules = [Q(chunk__fragment_chunk_location__fragment=self)]
+        if bp_lo is not None:
+            rules.append(Q(chunk__fragment_chunk_location__base_last__gte=bp_lo))
+        if bp_hi is not None:
+            rules.append(Q(chunk__fragment_chunk_location__base_first__lte=bp_hi))
+
+        fcl_tb = Fragment_Chunk_Location._meta.db_table
+        bf = [f.column for f in Fragment_Chunk_Location._meta.fields if f.name == 'base_first'][0]
+        bl = [f.column for f in Fragment_Chunk_Location._meta.fields if f.name == 'base_last'][0]
+        q = Chunk_Feature.objects.filter(*rules)\
+                                 .select_related('feature')\
+                                 .extra(select=dict(fcl_base_first='%s.%s' % (fcl_tb, bf),
+                                                    fcl_base_last='%s.%s' % (fcl_tb, bl)),
+                                        order_by=['fcl_base_first', 'feature'])
+
+        # annotations in order of base_first, and the last annotation of each
+        # feature, which may still be extended by the next chunk
+        pending = []
+        extending = {}
+        for cf in q.iterator():
+            base_first = int(cf.fcl_base_first)
+            base_last = int(cf.fcl_base_last)
+
+            a = extending.get(cf.feature_id)
+            if a is not None and a.feature_base_last == cf.feature_base_first-1 and\
+               a.base_last == base_first-1:
+                # merge annotation
+                a.base_last = base_last
+                a.feature_base_last = cf.feature_base_last
+            else:
+                a = Annotation(base_first=base_first, base_last=base_last,
+                               chunk_feature=cf, fragment=self)
+                pending.append(a)
+                extending[cf.feature_id] = a
+
+            # annotations ending before current chunk can no longer be extended
+            i = 0
+            while i < len(pending) and (pending[i].base_last < base_first-1 or
+                                        extending.get(pending[i].feature.id) is not pending[i]):
+                if extending.get(pending[i].feature.id) is pending[i]:
+                    del extending[pending[i].feature.id]
+                yield pending[i]
+                i += 1
+            del pending[0:i]
+
+        for a in pending:
+            yield a
+
     def update(self, name):
         new_fragment = \
             Fragment(name=name, circular=self.circular, parent=self, start_chunk=self.start_chunk)
@@ -276,5 +457,7 @@ class Indexed_Fragment(Fragment, Fragment_Writer, Fragment_Annotator, Fragment_U
                                                    base_last=fc.base_last))
         Fragment_Chunk_Location.bulk_create(entries)
         Fragment_Index(fragment=new_fragment, fresh=True,
-                       updated_on=self.fragment_index.updated_on).save()
+                       updated_on=self.fragment_index.updated_on,
+                       version=self.fragment_index.version,
+                       annotations_version=self.fragment_index.annotations_version).save()
         return new_fragment.indexed_fragment()
@@ -1,3 +1,4 @@
+from django.db import transaction
 from edge.models.chunk import *
 
 
@@ -37,9 +38,11 @@ class Fragment_Annotator:
         # we hit annotation_end, and add annotation for each chunk
         chunk = annotation_start
         a_i = 1
+        chunk_ids = []
         while True:
             fc = self.fragment_chunk(chunk)
             self._annotate_chunk(chunk, new_feature, a_i, a_i+len(chunk.sequence)-1)
+            chunk_ids.append(chunk.id)
             a_i += len(chunk.sequence)
             if chunk.id == annotation_end.id:
                 break
@@ -47,4 +50,69 @@ class Fragment_Annotator:
             if chunk is None:
                 chunk = self.start_chunk
 
+        self._touch_annotations(chunk_ids)
         return new_feature
+
+    @transaction.atomic()
+    def annotate_many(self, annotations):
+        """
+        Adds many annotations at once. Each annotation is a dictionary of
+        arguments to annotate. Chunks are split at all annotation boundaries
+        in one pass, and features and chunk features are bulk inserted. Returns
+        list of new features, in same order as annotations.
+        """
+
+        if len(annotations) == 0:
+            return []
+
+        fragment_length = self.length
+        features = []
+        split_bases = []
+        for a in annotations:
+            first_base1 = a['first_base1']
+            last_base1 = a['last_base1']
+            if self.circular and last_base1 < first_base1:
+                length = fragment_length-first_base1+1+last_base1
+            else:
+                length = last_base1-first_base1+1
+                if length <= 0:
+                    raise Exception('Annotation must have length one or more')
+            strand = a['strand']
+            if strand not in (1, -1, None):
+                raise Exception('Strand must be 1, -1, or None')
+            f = Feature(name=a['name'], type=a['type'], length=length, strand=strand,
+                        operation=a.get('operation', None))
+            qualifiers = a.get('qualifiers', None)
+            f.set_qualifiers({} if qualifiers is None else qualifiers)
+            features.append(f)
+            split_bases.extend([first_base1, last_base1+1])
+
+        self._split_before_many(split_bases)
+        bulk_create_with_ids(Feature, features)
+
+        locations = list(self.fragment_chunk_location_set.order_by('base_first')
+                                                         .values_list('chunk_id', 'base_first',
+                                                                      'base_last'))
+        by_base_first = dict((loc[1], i) for i, loc in enumerate(locations))
+
+        # for each annotation, starting with chunk at first base, walk through
+        # chunks until we hit chunk at last base
+        entries = []
+        for a, feature in zip(annotations, features):
+            if a['first_base1'] not in by_base_first:
+                raise Exception('Annotation must start within the fragment')
+            i = by_base_first[a['first_base1']]
+            a_i = 1
+            while True:
+                chunk_id, base_first, base_last = locations[i]
+                entries.append(Chunk_Feature(chunk_id=chunk_id, feature=feature,
+                                             feature_base_first=a_i,
+                                             feature_base_last=a_i+base_last-base_first))
+                a_i += base_last-base_first+1
+                if base_last == a['last_base1'] or a_i > feature.length:
+                    break
+                i = (i+1) % len(locations)
+
+        Chunk_Feature.bulk_create(entries)
+        self._touch_annotations([e.chunk_id for e in entries])
+        return features
@@ -1,5 +1,7 @@
+from django.db import transaction
 from django.db.models import F
 from edge.models.chunk import *
+from edge.models.fragment_writer import IN_BATCH_SIZE
 
 
 class Fragment_Updater:
@@ -11,23 +13,42 @@ class Fragment_Updater:
         if Edge.objects.filter(to_chunk=chunk, fragment=self).count() > 0:
             raise Exception('Fragment %s already linked to chunk %s' % (self.id, chunk.id))
 
-    def _append_to_fragment(self, prev_chunk, cur_fragment_length, sequence):
-        # only use this if you are appending chunk to fragment while importing
-        # a fragment
-        new_chunk = self._add_chunk(sequence, self)
-        if prev_chunk is not None:  # add chunks after prev_chunk_id
-            self._add_edges(prev_chunk,
-                            Edge(from_chunk=prev_chunk, fragment=self, to_chunk=new_chunk))
-        else:
-            self.start_chunk = new_chunk
-            self.save()
-        self._add_edges(new_chunk, Edge(from_chunk=new_chunk, fragment=self, to_chunk=None))
-        self.fragment_chunk_location_set.create(
-            chunk=new_chunk,
-            base_first=cur_fragment_length+1,
-            base_last=cur_fragment_length+1+len(sequence)-1
-        )
-        return new_chunk
+    def _assert_not_linked_to_any(self, unsaved_edges):
+        # like _assert_not_linked_to, for targets of many new edges; ignores
+        # existing edges the new edges are going to replace
+        to_chunk_ids = [e.to_chunk_id for e in unsaved_edges]
+        from_chunk_ids = set(e.from_chunk_id for e in unsaved_edges)
+        for i in range(0, len(to_chunk_ids), IN_BATCH_SIZE):
+            q = Edge.objects.filter(to_chunk_id__in=to_chunk_ids[i:i+IN_BATCH_SIZE], fragment=self)
+            q = [e for e in q if e.from_chunk_id not in from_chunk_ids]
+            if len(q) > 0:
+                raise Exception('Fragment %s already linked to chunk %s'
+                                % (self.id, q[0].to_chunk_id))
+
+    def _append_to_fragment(self, sequences):
+        # only use this if you are appending chunks to a new, empty fragment
+        # while importing the fragment. chunks, edges and locations are bulk
+        # inserted.
+        new_chunks = Chunk.bulk_create([Chunk(sequence=s, initial_fragment=self)
+                                        for s in sequences])
+        if len(new_chunks) == 0:
+            return
+        self.start_chunk = new_chunks[0]
+        self.save()
+
+        # last chunk gets an edge to None, so it is the END
+        Edge.bulk_create([Edge(from_chunk=c1, fragment=self, to_chunk=c2)
+                          for c1, c2 in zip(new_chunks, new_chunks[1:]+[None])])
+
+        locations = []
+        base_first = 1
+        for chunk in new_chunks:
+            locations.append(Fragment_Chunk_Location(fragment_id=self.id, chunk_id=chunk.id,
+                                                     base_first=base_first,
+                                                     base_last=base_first+len(chunk.sequence)-1))
+            base_first += len(chunk.sequence)
+        Fragment_Chunk_Location.bulk_create(locations)
+        self._touch_index()
 
     def insert_bases(self, before_base1, sequence):
         # find chunks before and containing the insertion point
@@ -36,9 +57,9 @@ class Fragment_Updater:
         # create new chunk
         new_chunk = self._add_chunk(sequence, self)
 
+        edges = []
         if prev_chunk is not None:  # add chunks after prev_chunk_id
-            self._add_edges(prev_chunk, Edge(from_chunk=prev_chunk,
-                                             fragment=self, to_chunk=new_chunk))
+            edges.append(Edge(from_chunk=prev_chunk, fragment=self, to_chunk=new_chunk))
 
         else:  # add chunks at start of fragment
             self.start_chunk = new_chunk
@@ -47,7 +68,8 @@ class Fragment_Updater:
         # chunk may be None, but that's okay, we want to make sure this chunk
         # is the END and not going to be superseded by child fragment appending
         # more chunks!
-        self._add_edges(new_chunk, Edge(from_chunk=new_chunk, fragment=self, to_chunk=chunk))
+        edges.append(Edge(from_chunk=new_chunk, fragment=self, to_chunk=chunk))
+        self._add_many_edges(edges)
 
         # shift base_first and base_last for existing chunks
         if before_base1 is not None:
@@ -69,6 +91,7 @@ class Fragment_Updater:
                 base_first=fragment_length+1,
                 base_last=fragment_length+1+len(sequence)-1
             )
+        self._touch_index()
 
     def remove_bases(self, before_base1, length):
         if length <= 0:
@@ -104,6 +127,7 @@ class Fragment_Updater:
         self.fragment_chunk_location_set.filter(base_first__gt=before_base1)\
                                         .update(base_first=F('base_first')-length,
                                                 base_last=F('base_last')-length)
+        self._touch_index()
 
     def replace_bases(self, before_base1, length_to_remove, sequence):
 
@@ -115,27 +139,107 @@ class Fragment_Updater:
         self.remove_bases(before_base1, length_to_remove)
         self.insert_bases(before_base1, sequence)
 
+    @transaction.atomic()
+    def apply_edits(self, edits):
+        """
+        Applies a list of edits, each a dictionary with before_base1,
+        length_to_remove and sequence to insert. Positions are on the fragment
+        before any edit is applied, and edits must not overlap. Chunks are split
+        for all edits in one pass, edges are rewired in bulk, and location index
+        is rebuilt once at the end.
+        """
+
+        edits = sorted([e for e in edits
+                        if e.get('length_to_remove', 0) > 0 or len(e.get('sequence', '')) > 0],
+                       key=lambda e: e['before_base1'])
+        if len(edits) == 0:
+            return
+
+        length = self.length
+        next_allowed = 1
+        for e in edits:
+            before_base1 = e['before_base1']
+            length_to_remove = e.get('length_to_remove', 0)
+            if length_to_remove < 0:
+                raise Exception('Cannot remove less than zero base pair')
+            if before_base1 < next_allowed or before_base1+length_to_remove-1 > length or\
+               before_base1 > length+1:
+                raise Exception('Edits must be within the fragment, and must not overlap')
+            next_allowed = max(before_base1+length_to_remove, before_base1+1)
+
+        self._split_before_many([e['before_base1'] for e in edits] +
+                                [e['before_base1']+e.get('length_to_remove', 0) for e in edits])
+        locations = list(self.fragment_chunk_location_set.order_by('base_first')
+                                                         .values_list('chunk_id', 'base_first',
+                                                                      'base_last'))
+        by_base_first = dict((loc[1], i) for i, loc in enumerate(locations))
+
+        new_chunks = [Chunk(sequence=e['sequence'], initial_fragment=self)
+                      if len(e.get('sequence', '')) > 0 else None for e in edits]
+        Chunk.bulk_create([c for c in new_chunks if c is not None])
+
+        # chunks of the fragment after edits, as (chunk ID, length)
+        chunks = []
+        i = 0
+        for e, new_chunk in zip(edits, new_chunks):
+            j = by_base_first.get(e['before_base1'], len(locations))
+            chunks.extend((loc[0], loc[2]-loc[1]+1) for loc in locations[i:j])
+            if new_chunk is not None:
+                chunks.append((new_chunk.id, len(new_chunk.sequence)))
+            i = by_base_first.get(e['before_base1']+e.get('length_to_remove', 0), len(locations))
+        chunks.extend((loc[0], loc[2]-loc[1]+1) for loc in locations[i:])
+        if len(chunks) == 0:
+            raise Exception('Cannot remove entire fragment')
+
+        # add edges between chunks that are not already next to each other. the
+        # last chunk gets an edge to None, so it is the END and not going to be
+        # superseded by child fragment appending more chunks
+        chunk_ids = [loc[0] for loc in locations]
+        original_next = dict(zip(chunk_ids, chunk_ids[1:]+[None]))
+        new_ids = [c[0] for c in chunks]
+        edges = [Edge(from_chunk_id=c1, fragment_id=self.id, to_chunk_id=c2)
+                 for c1, c2 in zip(new_ids, new_ids[1:]+[None])
+                 if c1 not in original_next or original_next[c1] != c2]
+        self._add_many_edges(edges)
+
+        if self.start_chunk_id != new_ids[0]:
+            self.start_chunk = Chunk.objects.get(pk=new_ids[0])
+            self.save()
+
+        # rebuild location index
+        self.fragment_chunk_location_set.all().delete()
+        entries = []
+        base_first = 1
+        for chunk_id, chunk_length in chunks:
+            entries.append(Fragment_Chunk_Location(fragment_id=self.id, chunk_id=chunk_id,
+                                                   base_first=base_first,
+                                                   base_last=base_first+chunk_length-1))
+            base_first += chunk_length
+        Fragment_Chunk_Location.bulk_create(entries)
+        self._touch_index()
+
     def insert_fragment(self, before_base1, fragment):
         fragment = fragment.indexed_fragment()
 
         # find chunks before and containing the insertion point
         prev_chunk, my_next_chunk = self._find_and_split_before(before_base1)
 
+        chunks = list(fragment.chunks())
+
         # for each chunk in inserted fragment, add an edge for current fragment
+        edges = []
         last_chunk = prev_chunk
-        fragment_length = 0
-        for chunk in fragment.chunks():
-            # also compute how long fragment is
-            fragment_length += len(chunk.sequence)
+        for chunk in chunks:
             if last_chunk is None:  # add new chunks at start of fragment
                 self.start_chunk = chunk
                 self.save()
             else:
-                self._assert_not_linked_to(chunk)
-                self._add_edges(last_chunk, Edge(from_chunk=last_chunk,
-                                                 fragment=self, to_chunk=chunk))
+                edges.append(Edge(from_chunk=last_chunk, fragment=self, to_chunk=chunk))
             last_chunk = chunk
 
+        self._assert_not_linked_to_any(edges)
+        self._add_many_edges(edges)
+
         # my_next_chunk may be None, but that's okay, we want to make sure this
         # chunk is the END and not going to be superseded by child fragment
         # appending more chunks!
@@ -143,30 +247,27 @@ class Fragment_Updater:
         self._add_edges(last_chunk, Edge(from_chunk=last_chunk,
                                          fragment=self, to_chunk=my_next_chunk))
 
+        # also compute how long fragment is
+        fragment_length = sum(len(chunk.sequence) for chunk in chunks)
+
         # shift base_first and base_last for existing chunks
         if before_base1 is not None:
             self.fragment_chunk_location_set.filter(base_first__gte=before_base1)\
                                             .update(base_first=F('base_first')+fragment_length,
                                                     base_last=F('base_last')+fragment_length)
+            base_first = before_base1
+        else:
+            base_first = self.length+1
 
         # add location for new chunks in the new fragment
-        values = []
-        c = 0
-        original_length = self.length
-        for chunk in fragment.chunks():
-            if before_base1 is not None:
-                self.fragment_chunk_location_set.create(
-                    chunk=chunk,
-                    base_first=before_base1+c,
-                    base_last=before_base1+c+len(chunk.sequence)-1
-                )
-            else:
-                self.fragment_chunk_location_set.create(
-                    chunk=chunk,
-                    base_first=original_length+1+c,
-                    base_last=original_length+1+c+len(chunk.sequence)-1
-                )
-            c += len(chunk.sequence)
+        locations = []
+        for chunk in chunks:
+            locations.append(Fragment_Chunk_Location(fragment_id=self.id, chunk_id=chunk.id,
+                                                     base_first=base_first,
+                                                     base_last=base_first+len(chunk.sequence)-1))
+            base_first += len(chunk.sequence)
+        Fragment_Chunk_Location.bulk_create(locations)
+        self._touch_index()
 
     def replace_with_fragment(self, before_base1, length_to_remove, fragment):
 
@@ -1,8 +1,18 @@
 from django.db import connection
 from django.db.models import F
+from django.utils import timezone
 from edge.models.chunk import *
 
 
+# max number of IDs in an IN clause; sqlite limits number of query parameters
+IN_BATCH_SIZE = 500
+
+
+def _batches(ids):
+    for i in range(0, len(ids), IN_BATCH_SIZE):
+        yield ids[i:i+IN_BATCH_SIZE]
+
+
 class Fragment_Writer:
     """
     Mixin that includes helpers for updating a fragment.
@@ -28,19 +38,26 @@ class Fragment_Writer:
             self.save()
 
     def _add_edges(self, chunk, *unsaved_edges):
-        existing_edges = list(Edge.objects.filter(from_chunk=chunk))
-
-        # get list of fragment IDs in new edges
+        # remove old edges with same fragment ids as new edges, in one query,
+        # then bulk insert new edges
         new_fragment_ids = [e.fragment_id for e in unsaved_edges]
+        Edge.objects.filter(from_chunk=chunk, fragment_id__in=new_fragment_ids).delete()
+        Edge.bulk_create(list(unsaved_edges))
 
-        # remove old edges with same fragment ids as new edges
-        for e in existing_edges:
-            if e.fragment_id in new_fragment_ids:
-                e.delete()
+    def _add_many_edges(self, unsaved_edges):
+        """
+        Like _add_edges, for edges from many chunks. Removes old edges from the
+        same chunks with same fragment IDs as the new edges, then bulk inserts
+        the new edges.
+        """
 
-        # add new edges
+        by_fragment = {}
         for edge in unsaved_edges:
-            edge.save()
+            by_fragment.setdefault(edge.fragment_id, set()).add(edge.from_chunk_id)
+        for fragment_id, chunk_ids in by_fragment.iteritems():
+            for ids in _batches(list(chunk_ids)):
+                Edge.objects.filter(fragment_id=fragment_id, from_chunk_id__in=ids).delete()
+        Edge.bulk_create(unsaved_edges)
 
     def _split_annotations(self, annotations, bps_to_split, split1, split2):
         for a in annotations:
@@ -58,6 +75,28 @@ class Fragment_Writer:
                 index.fresh = False
                 index.save()
 
+    def _touch_index(self):
+        # sequence changed, but location index was updated in place and is
+        # still fresh. bump index timestamp and version so anything cached
+        # against the version is rebuilt.
+        from edge.models.fragment import Fragment_Index
+        Fragment_Index.objects.filter(fragment_id=self.id).update(updated_on=timezone.now(),
+                                                                  version=F('version')+1)
+
+    def _touch_annotations(self, chunk_ids):
+        # annotations are on chunks, and chunks are shared with other
+        # fragments, so bump annotations version of all fragments using the
+        # annotated chunks
+        from edge.models.fragment import Fragment_Index
+        fragment_ids = set([self.id])
+        for ids in _batches(list(set(chunk_ids))):
+            fragment_ids.update(Fragment_Chunk_Location.objects.filter(chunk_id__in=ids)
+                                                               .values_list('fragment_id',
+                                                                            flat=True))
+        for ids in _batches(list(fragment_ids)):
+            Fragment_Index.objects.filter(fragment_id__in=ids)\
+                                  .update(annotations_version=F('annotations_version')+1)
+
     # make sure you call this atomically! otherwise we may have corrupted chunk
     # and index
     def __split_chunk(self, chunk, bps_to_split):
@@ -110,6 +149,136 @@ class Fragment_Writer:
                                          .update(base_last=F('base_first')+len(s1)-1)
         return split2
 
+    # make sure you call this atomically! otherwise we may have corrupted chunk
+    # and index
+    def _split_before_many(self, before_bases):
+        """
+        Splits chunks so each of the specified bases starts a chunk, in one pass
+        over the location index. Like __split_chunk, but new chunks, edges,
+        annotations and locations for all splits are bulk inserted.
+        """
+
+        from edge.models.fragment import Fragment_Index
+
+        before_bases = sorted(set(before_bases))
+        if len(before_bases) and before_bases[0] <= 0:
+            raise Exception('chunk index should be 1-based')
+
+        if len(before_bases) == 0:
+            return
+
+        # find offsets to split each chunk at, only reading locations, not
+        # sequences, of chunks around the bases
+        bounds_by_chunk = []
+        i = 0
+        q = self.fragment_chunk_location_set.filter(base_last__gte=before_bases[0],
+                                                    base_first__lte=before_bases[-1])\
+                                            .order_by('base_first')\
+                                            .values_list('chunk_id', 'base_first', 'base_last')
+        for chunk_id, base_first, base_last in q:
+            offsets = []
+            while i < len(before_bases) and before_bases[i] <= base_last:
+                if before_bases[i] > base_first:
+                    offsets.append(before_bases[i]-base_first)
+                i += 1
+            if len(offsets) > 0:
+                bounds_by_chunk.append((chunk_id, [0]+offsets+[base_last-base_first+1]))
+        if len(bounds_by_chunk) == 0:
+            return
+
+        chunk_ids = [chunk_id for chunk_id, bounds in bounds_by_chunk]
+        chunks = {}
+        for ids in _batches(chunk_ids):
+            chunks.update((c.id, c) for c in Chunk.objects.filter(id__in=ids))
+        splits = [(chunks[chunk_id], bounds) for chunk_id, bounds in bounds_by_chunk]
+
+        # invalidate chunk location index for all fragments using split chunks,
+        # except parent fragment and current fragment
+        index_to_invalidate = set()
+        index_to_update = {}
+        for ids in _batches(chunk_ids):
+            for chunk_id, fragment_id in \
+                Fragment_Chunk_Location.objects.filter(chunk_id__in=ids,
+                                                       fragment__fragment_index__fresh=True)\
+                                               .values_list('chunk_id', 'fragment_id')\
+                                               .distinct():
+                if fragment_id not in [self.id, self.parent_id]:
+                    index_to_invalidate.add(fragment_id)
+                else:
+                    index_to_update.setdefault(chunk_id, []).append(fragment_id)
+        for ids in _batches(list(index_to_invalidate)):
+            Fragment_Index.objects.filter(fragment_id__in=ids).update(fresh=False)
+
+        # save original annotations and locations, before they are reset
+        annotations = {}
+        locations = {}
+        for ids in _batches(chunk_ids):
+            for row in Chunk_Feature.objects.filter(chunk_id__in=ids)\
+                                            .values_list('chunk_id', 'feature_id',
+                                                         'feature_base_first'):
+                annotations.setdefault(row[0], []).append(row[1:])
+            Chunk_Feature.objects.filter(chunk_id__in=ids).delete()
+            for row in Fragment_Chunk_Location.objects\
+                                              .filter(chunk_id__in=ids,
+                                                      fragment_id__in=[self.id, self.parent_id])\
+                                              .values_list('chunk_id', 'fragment_id',
+                                                           'base_first'):
+                if row[1] in index_to_update.get(row[0], []):
+                    locations.setdefault(row[0], []).append(row[1:])
+
+        # splitted chunks should be "created" by the fragment that created the
+        # original chunk
+        pieces = {}
+        new_chunks = []
+        for chunk, bounds in splits:
+            pieces[chunk.id] = [chunk]
+            for lo, hi in zip(bounds[1:-1], bounds[2:]):
+                c = Chunk(sequence=chunk.sequence[lo:hi],
+                          initial_fragment_id=chunk.initial_fragment_id)
+                pieces[chunk.id].append(c)
+                new_chunks.append(c)
+        Chunk.bulk_create(new_chunks)
+
+        new_edges = []
+        new_annotations = []
+        new_locations = []
+        for chunk, bounds in splits:
+            chunk_pieces = pieces[chunk.id]
+            Chunk.objects.filter(id=chunk.id).update(sequence=chunk.sequence[0:bounds[1]])
+
+            # move all edges from original chunk to last piece, and chain
+            # pieces together
+            Edge.objects.filter(from_chunk_id=chunk.id).update(from_chunk=chunk_pieces[-1])
+            for c1, c2 in zip(chunk_pieces[:-1], chunk_pieces[1:]):
+                new_edges.append(Edge(from_chunk=c1, fragment_id=chunk.initial_fragment_id,
+                                      to_chunk=c2))
+
+            for c, lo, hi in zip(chunk_pieces, bounds[:-1], bounds[1:]):
+                for feature_id, feature_base_first in annotations.get(chunk.id, []):
+                    new_annotations.append(Chunk_Feature(chunk=c, feature_id=feature_id,
+                                                         feature_base_first=feature_base_first+lo,
+                                                         feature_base_last=feature_base_first+hi-1))
+
+            for fragment_id, base_first in locations.get(chunk.id, []):
+                for c, lo, hi in zip(chunk_pieces[1:], bounds[1:-1], bounds[2:]):
+                    new_locations.append(Fragment_Chunk_Location(fragment_id=fragment_id,
+                                                                 chunk_id=c.id,
+                                                                 base_first=base_first+lo,
+                                                                 base_last=base_first+hi-1))
+            if chunk.id in index_to_update:
+                Fragment_Chunk_Location.objects\
+                                       .filter(chunk_id=chunk.id,
+                                               fragment_id__in=index_to_update[chunk.id])\
+                                       .update(base_last=F('base_first')+bounds[1]-1)
+
+        Edge.bulk_create(new_edges)
+        Chunk_Feature.bulk_create(new_annotations)
+        Fragment_Chunk_Location.bulk_create(new_locations)
+
+        # if start chunk got split, update the object reference
+        if self.start_chunk_id in pieces:
+            self.start_chunk = self.start_chunk.reload()
+
     def _find_chunk_prev_next(self, before_base1):
         prev_chunk = None
         next_chunk = None
@@ -1,3 +1,4 @@
+import hashlib
 from django.db import models
 from edge.models.chunk import *
 from edge.models.fragment import *
@@ -16,10 +17,49 @@ class Genome(models.Model, Genome_Updater):
     created_on = models.DateTimeField('Created', auto_now_add=True, null=True)
     active = models.BooleanField(default=True)
     blastdb = models.TextField(null=True, blank=True)
+    # identifies set of fragments in the genome, see fragment_fingerprint_of
+    fragment_fingerprint = models.CharField(max_length=40, null=True, db_index=True)
 
     def __unicode__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        super(Genome, self).save(*args, **kwargs)
+        # fingerprint on this object may be stale if fragments changed since
+        # it was loaded, so always recompute from Genome_Fragment rows
+        self.fragment_fingerprint = Genome.update_fragment_fingerprint(self.id)
+
+    @staticmethod
+    def fragment_fingerprint_of(fragment_ids):
+        """
+        Returns fingerprint of a set of fragment IDs.
+        """
+
+        fragment_ids = sorted(set(int(x) for x in fragment_ids))
+        return hashlib.sha1(','.join(str(x) for x in fragment_ids)).hexdigest()
+
+    @staticmethod
+    def update_fragment_fingerprint(genome_id):
+        """
+        Recomputes and returns fragment fingerprint of a genome from its
+        Genome_Fragment rows. Called whenever Genome_Fragment rows change.
+        """
+
+        fragment_ids = Genome_Fragment.objects.filter(genome_id=genome_id)\
+                                              .values_list('fragment_id', flat=True)
+        fingerprint = Genome.fragment_fingerprint_of(fragment_ids)
+        Genome.objects.filter(id=genome_id).update(fragment_fingerprint=fingerprint)
+        return fingerprint
+
+    @staticmethod
+    def with_fragments(fragment_ids):
+        """
+        Returns query for genomes with exactly the specified set of fragments.
+        """
+
+        return Genome.objects.filter(
+            fragment_fingerprint=Genome.fragment_fingerprint_of(fragment_ids))
+
     @staticmethod
     def create(name, notes=None):
         new_genome = Genome(name=name, notes=notes, parent=None)
@@ -37,10 +77,26 @@ class Genome(models.Model, Genome_Updater):
         name = self.name if name is None else name
         new_genome = Genome(name=name, notes=notes, parent=self)
         new_genome.save()
-        for f in self.fragments.all():
-            Genome_Fragment(genome=new_genome, fragment=f, inherited=True).save()
+        Genome_Fragment.objects.bulk_create(
+            [Genome_Fragment(genome=new_genome, fragment_id=fragment_id, inherited=True)
+             for fragment_id in self.fragments.values_list('id', flat=True)])
+        new_genome.fragment_fingerprint = Genome.update_fragment_fingerprint(new_genome.id)
         return new_genome
 
+    def child_with_operation(self, op):
+        """
+        Returns most recent child genome created by a single operation with
+        same type and parameters as op, or None.
+        """
+
+        fingerprint = op.fingerprint_of(op.type, op.params)
+        candidates = self.children.filter(operation__fingerprint=fingerprint).values('id')
+        children = Genome.objects.filter(id__in=candidates)\
+                                 .annotate(operation_count=models.Count('operation'))\
+                                 .filter(operation_count=1)\
+                                 .order_by('-id')[:1]
+        return children[0] if len(children) > 0 else None
+
     @property
     def has_location_index(self):
         for f in self.fragments.all():
@@ -153,3 +209,11 @@ class Genome_Fragment(models.Model):
     genome = models.ForeignKey(Genome)
     fragment = models.ForeignKey(Fragment)
     inherited = models.BooleanField()
+
+    def save(self, *args, **kwargs):
+        super(Genome_Fragment, self).save(*args, **kwargs)
+        Genome.update_fragment_fingerprint(self.genome_id)
+
+    def delete(self, *args, **kwargs):
+        super(Genome_Fragment, self).delete(*args, **kwargs)
+        Genome.update_fragment_fingerprint(self.genome_id)
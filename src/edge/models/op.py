@@ -1,3 +1,5 @@
+import json
+import hashlib
 from django.db import models
 from edge.models import Genome
 
@@ -11,7 +13,30 @@ class Operation(models.Model):
     RECOMBINATION = (1, 'Homologous Recombination')
     CRISPR_DSB = (2, 'CRISPR-Cas9 WT (Double Stranded Break)')
     PCR_SEQ_VERIFICATION = (3, 'PCR Product Sequence Verification')
+    ORF_ANNOTATION = (4, 'ORF Annotation')
+    VARIANT_APPLICATION = (5, 'Variant Application')
 
     genome = models.ForeignKey(Genome)
-    type = models.IntegerField(choices=(RECOMBINATION, CRISPR_DSB, PCR_SEQ_VERIFICATION))
+    type = models.IntegerField(choices=(RECOMBINATION, CRISPR_DSB, PCR_SEQ_VERIFICATION,
+                                        ORF_ANNOTATION, VARIANT_APPLICATION))
     params = models.TextField(null=True, blank=True)
+    # identifies type and parameters of the operation, see fingerprint_of
+    fingerprint = models.CharField(max_length=40, null=True, db_index=True)
+
+    def save(self, *args, **kwargs):
+        self.fingerprint = Operation.fingerprint_of(self.type, self.params)
+        super(Operation, self).save(*args, **kwargs)
+
+    @staticmethod
+    def fingerprint_of(op_type, params):
+        """
+        Returns fingerprint of operation type and parameters. Parameters that
+        are JSON are canonicalized first, so order of keys does not matter.
+        """
+
+        if params is not None:
+            try:
+                params = json.dumps(json.loads(params), sort_keys=True)
+            except ValueError:
+                pass
+        return hashlib.sha1(json.dumps([op_type, params])).hexdigest()
@@ -0,0 +1,159 @@
+import json
+import billiard
+import multiprocessing
+from collections import deque
+from django.conf import settings
+import edge.orfs
+from edge.kmer import genome_index, Kmer_Index
+from edge.models import Fragment, Operation
+from edge.orfs import find_orfs
+
+
+# loaded k-mer index in each worker process, by directory name
+_worker_indices = {}
+
+
+def _find_fragment_orfs(args):
+    dirname, i = args
+    index = _worker_indices.get(dirname)
+    if index is None:
+        index = Kmer_Index(dirname)
+        _worker_indices[dirname] = index
+    fragment = index.fragments[i]
+    offset = fragment['offset']
+    sequence = index.bases()[offset:offset+fragment['length']].tostring()
+    return fragment['id'], find_orfs(sequence, circular=fragment['circular'] is True)
+
+
+def _in_daemonic_process():
+    """
+    Returns True if running in a daemonic process, e.g. a Celery prefork pool
+    worker, which is not allowed to start processes of its own.
+    """
+
+    return multiprocessing.current_process().daemon or billiard.current_process().daemon
+
+
+def genome_orfs(genome, processes=None):
+    """
+    Finds ORFs on each fragment of a genome. Generator yielding a (fragment
+    ID, list of ORFs) tuple for each fragment. ORFs are found by a pool of
+    worker processes, each reading fragment sequence from the genome's memory
+    mapped k-mer index. Only a few fragments are in flight at any time, so
+    memory use does not grow with genome size. ORFs are found in the calling
+    process if it is daemonic, e.g. when running in a Celery worker.
+    """
+
+    if processes is None:
+        processes = settings.ORF_ANNOTATION_PROCESSES
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    index = genome_index(genome)
+    jobs = [(index.dirname, i) for i in range(len(index.fragments))]
+
+    if processes <= 1 or len(jobs) <= 1 or _in_daemonic_process():
+        for job in jobs:
+            yield _find_fragment_orfs(job)
+        return
+
+    pool = multiprocessing.Pool(min(processes, len(jobs)))
+    try:
+        pending = deque()
+        for job in jobs:
+            pending.append(pool.apply_async(_find_fragment_orfs, (job,)))
+            if len(pending) >= processes*2:
+                yield pending.popleft().get()
+        while len(pending) > 0:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def annotate_fragment_orfs(fragment_id, orfs, op=None):
+    fragment = Fragment.objects.get(pk=fragment_id).indexed_fragment()
+    fragment.annotate_many([dict(first_base1=orf['start'], last_base1=orf['end'],
+                                 name=orf['name'], type='ORF', strand=orf['strand'],
+                                 operation=op) for orf in orfs])
+
+
+def annotate_genome_orfs(genome, op=None, processes=None, progress=None):
+    """
+    Annotates ORFs on all fragments of a genome, one fragment at a time, as
+    ORFs for each fragment are found. Like other operations, fragments
+    inherited from parent genome are first replaced by new versions of the
+    fragments. Calls progress, if specified, with number of fragments
+    annotated, total number of fragments, and number of ORFs annotated so far.
+    Returns number of ORFs annotated.
+    """
+
+    for gf in genome.genome_fragment_set.filter(inherited=True):
+        with genome.update_fragment_by_fragment_id(gf.fragment_id):
+            pass
+
+    total = genome.fragments.count()
+    done = 0
+    annotated = 0
+    for fragment_id, orfs in genome_orfs(genome, processes=processes):
+        annotate_fragment_orfs(fragment_id, orfs, op)
+        done += 1
+        annotated += len(orfs)
+        if progress is not None:
+            progress(done, total, annotated)
+    return annotated
+
+
+class OrfFragmentSummary(object):
+
+    def __init__(self, fragment_id, fragment_name, orfs):
+        self.fragment_id = fragment_id
+        self.fragment_name = fragment_name
+        self.orfs = orfs
+
+    def to_dict(self):
+        return self.__dict__
+
+
+def orf_annotation(genome, genome_name=None, notes=None):
+
+    if genome_name is None or genome_name.strip() == "":
+        genome_name = "%s with ORF annotations" % (genome.name,)
+
+    new_genome = genome.update()
+    new_genome.name = genome_name
+    new_genome.notes = notes
+    new_genome.save()
+
+    op = OrfAnnotationOp.get_operation()
+    op.genome = new_genome
+    op.save()
+
+    # annotating a large genome takes a while, do it in the background
+    from edge.tasks import annotate_genome_orfs_task
+    annotate_genome_orfs_task.apply_async((new_genome.id, op.id), countdown=10)
+
+    return new_genome
+
+
+class OrfAnnotationOp(object):
+
+    @staticmethod
+    def check(genome, genome_name=None, notes=None):
+        """
+        Returns number of ORFs on each fragment of genome.
+        """
+
+        names = dict(genome.fragments.values_list('id', 'name'))
+        return [OrfFragmentSummary(fragment_id, names[fragment_id], len(orfs))
+                for fragment_id, orfs in genome_orfs(genome)]
+
+    @staticmethod
+    def get_operation(genome_name=None, notes=None):
+        params = dict(min_protein_len=edge.orfs.min_protein_len)
+        op = Operation(type=Operation.ORF_ANNOTATION[0], params=json.dumps(params))
+        return op
+
+    @staticmethod
+    def perform(genome, genome_name, notes):
+        return orf_annotation(genome, genome_name=genome_name, notes=notes)
@@ -1,11 +1,135 @@
 import math
+import numpy
 from Bio.Seq import Seq
+from Bio.Data import CodonTable
 
 trans_table = 1       # standard translation table
 min_protein_len = 100
 
 
-def detect_orfs(seq):
+# codon index is 16*b1+4*b2+b3, with bases a=0, c=1, g=2, t=3; codons with
+# other bases are translated with Biopython
+BASE_CODES = numpy.zeros(256, dtype=numpy.uint8)+4
+for _i, _b in enumerate('acgt'):
+    BASE_CODES[ord(_b)] = _i
+    BASE_CODES[ord(_b.upper())] = _i
+
+
+def codon_table(table_id):
+    table = CodonTable.unambiguous_dna_by_id[table_id]
+    codons = [a+b+c for a in 'ACGT' for b in 'ACGT' for c in 'ACGT']
+    is_start = numpy.array([c == 'ATG' for c in codons], dtype=bool)
+    is_stop = numpy.array([c in table.stop_codons for c in codons], dtype=bool)
+    return is_start, is_stop
+
+
+def frame_codons(codes, sequence, frame, table_id):
+    """
+    Returns arrays indicating whether each codon in frame translates to M or a
+    stop.
+    """
+
+    n = (len(codes)-frame)//3
+    codons = codes[frame:frame+n*3].reshape(n, 3)
+    index = codons[:, 0].astype(numpy.int32)*16+codons[:, 1]*4+codons[:, 2]
+    ambiguous = (codons > 3).any(axis=1)
+    index[ambiguous] = 0
+
+    is_start, is_stop = codon_table(table_id)
+    starts = is_start[index]
+    stops = is_stop[index]
+
+    for i in numpy.nonzero(ambiguous)[0]:
+        aa = str(Seq(sequence[frame+i*3:frame+i*3+3]).translate(table_id))
+        starts[i] = aa == 'M'
+        stops[i] = aa == '*'
+
+    return starts, stops
+
+
+def find_orfs(seq, circular=False):
+    """
+    Finds ORFs on both strands of a sequence, in all six frames, using
+    vectorized scans for start and stop codons. Returns same list of
+    dictionaries as detect_orfs_by_translation. If circular is True, also
+    finds ORFs across the end of the sequence, by scanning the sequence
+    doubled up; these ORFs have end coordinate less than start coordinate.
+    """
+
+    seq = str(seq)
+    seq_len = len(seq)
+    aa_len = seq_len//3
+    orf_list = []
+    if seq_len == 0:
+        return orf_list
+
+    rc = str(Seq(seq).reverse_complement())
+    if circular:
+        strands = [(+1, seq+seq), (-1, rc+rc)]
+    else:
+        strands = [(+1, seq), (-1, rc)]
+
+    for strand, nuc in strands:
+        codes = BASE_CODES[numpy.frombuffer(nuc, dtype=numpy.uint8)]
+        for frame in range(3):
+            starts, stops = frame_codons(codes, nuc, frame, trans_table)
+            aa_ends = numpy.nonzero(stops)[0]
+            if len(aa_ends) == 0:
+                continue
+
+            # scan for start codon begins after previous stop codon, and
+            # stops once scan would begin after end of (the first copy of)
+            # the sequence
+            aa_starts = numpy.concatenate(([0], aa_ends[:-1]+1))
+            keep = aa_starts < aa_len
+            aa_ends = aa_ends[keep]
+            aa_starts = aa_starts[keep]
+            # don't want an ORF that's actually bigger than the sequence
+            aa_starts = numpy.maximum(aa_starts, aa_ends-aa_len+1)
+
+            # first start codon after beginning of each scan
+            start_codons = numpy.nonzero(starts)[0]
+            i = numpy.searchsorted(start_codons, aa_starts)
+            found = i < len(start_codons)
+            start_codon = numpy.zeros(len(aa_ends), dtype=numpy.int64)-1
+            start_codon[found] = start_codons[i[found]]
+
+            ok = (start_codon >= 0) & (start_codon < aa_ends) & (start_codon < aa_len) &\
+                 (aa_ends-start_codon >= min_protein_len)
+
+            for start_codon, aa_end in zip(start_codon[ok], aa_ends[ok]):
+                start_codon = int(start_codon)
+                aa_end = int(aa_end)
+                # the following start and end need to start with 1, not 0.
+                if strand == 1:
+                    start = frame+start_codon*3+1
+                    end = frame+aa_end*3+3
+                    if end > seq_len:
+                        end = (end-1) % seq_len+1
+                else:
+                    start = seq_len-frame-aa_end*3-3+1
+                    end = seq_len-frame-start_codon*3
+                    if start <= 0:
+                        start = (start-1) % seq_len+1
+                    if end <= 0:
+                        end = (end-1) % seq_len+1
+
+                f = dict(name='ORF frame '+str(frame+1), start=start, end=end, strand=strand)
+                orf_list.append(f)
+
+    return orf_list
+
+
+def detect_orfs(seq, circular=False):
+    return find_orfs(seq, circular=circular)
+
+
+def detect_orfs_by_translation(seq):
+    """
+    Finds ORFs by translating each of the six frames. This is the original,
+    slower implementation, kept as reference for find_orfs.
+    """
+
     orf_list = []
 
     seq = Seq(seq)
@@ -0,0 +1,289 @@
+import os
+import json
+import shutil
+import tempfile
+import numpy
+from django.conf import settings
+from edge.blastdb import make_required_dirs
+from edge.kmer import genome_index, BASE_CODES, Loaded_Indices
+
+
+INDEX_FORMAT_VERSION = 1
+
+# protospacer is hashed into a 64 bit integer, 2 bits per base
+MAX_PROTOSPACER_LENGTH = 32
+
+# IUPAC nucleotide codes, as bitmask of A=1, C=2, G=4, T=8
+IUPAC_MASKS = dict(a=1, c=2, g=4, t=8, r=5, y=10, s=6, w=9, k=12, m=3,
+                   b=14, d=13, h=11, v=7, n=15)
+
+BASE_MASKS = numpy.zeros(256, dtype=numpy.uint8)
+for _b in 'acgt':
+    BASE_MASKS[ord(_b)] = IUPAC_MASKS[_b]
+    BASE_MASKS[ord(_b.upper())] = IUPAC_MASKS[_b]
+
+POPCOUNT = numpy.array([bin(_i).count('1') for _i in range(256)], dtype=numpy.uint8)
+
+
+def complement_mask(m):
+    # swap A and T bits, and C and G bits
+    return ((m & 1) << 3) | ((m & 8) >> 3) | ((m & 2) << 1) | ((m & 4) >> 1)
+
+
+def pam_masks(pam):
+    return [IUPAC_MASKS[c] for c in pam.lower()]
+
+
+def is_valid_pam(pam):
+    return len(pam) > 0 and all(c in IUPAC_MASKS for c in pam.lower())
+
+
+def match_pam(pam, query):
+    """
+    Returns True if query matches PAM, which may have IUPAC ambiguity codes.
+    """
+
+    if len(query) != len(pam):
+        return False
+    for p, q in zip(pam.lower(), query.lower()):
+        if p == q:
+            continue
+        if p not in IUPAC_MASKS or IUPAC_MASKS[p] & BASE_MASKS[ord(q)] == 0:
+            return False
+    return True
+
+
+def default_pam_index_name(genome, pam, protospacer_length, pam_upstream):
+    return "%s/genome/%s/%s/edge-genome-%d-pam-%s-%d%s" % (
+        settings.KMER_DATA_DIR, genome.id % 1024, (genome.id >> 10) % 1024, genome.id,
+        pam.lower(), protospacer_length, '-up' if pam_upstream else '')
+
+
+def hash_protospacer(protospacer):
+    """
+    Returns hash of protospacer, or None if protospacer has bases other than
+    ACGT or is too long to hash.
+    """
+
+    if len(protospacer) == 0 or len(protospacer) > MAX_PROTOSPACER_LENGTH:
+        return None
+    h = 0
+    for c in protospacer:
+        code = int(BASE_CODES[ord(c)])
+        if code > 3:
+            return None
+        h = (h << 2) | code
+    return h
+
+
+def build_pam_index(genome, pam, protospacer_length, pam_upstream=False, dirname=None):
+    """
+    Finds all PAM sites on both strands of a genome, and builds an index of
+    hashes of protospacers adjacent to the PAM sites. By default, PAM is
+    expected downstream (3') of protospacer, as for Cas9; set pam_upstream to
+    index PAM upstream (5') of protospacer, e.g. TTTV for Cas12a.
+    """
+
+    dirname = default_pam_index_name(genome, pam, protospacer_length, pam_upstream) \
+        if dirname is None else dirname
+
+    kmer_index = genome_index(genome)
+    L = protospacer_length
+    P = len(pam)
+    W = L+P
+
+    # pattern of window with PAM and protospacer, on the sense strand, and
+    # where protospacer starts in the window
+    if pam_upstream:
+        fwd_pattern, fwd_proto = pam_masks(pam)+[15]*L, P
+    else:
+        fwd_pattern, fwd_proto = [15]*L+pam_masks(pam), 0
+    rev_pattern = [complement_mask(m) for m in reversed(fwd_pattern)]
+    rev_proto = W-fwd_proto-L
+
+    weights = numpy.array([4**(L-1-i) for i in range(L)], dtype=numpy.uint64)
+
+    hashes = []
+    fragment_indices = []
+    starts = []
+    ends = []
+    strands = []
+
+    if len(kmer_index.fragments) > 0:
+        bases = kmer_index.bases()
+        masks = BASE_MASKS[bases]
+        codes = BASE_CODES[bases]
+
+    for i, fragment in enumerate(kmer_index.fragments):
+        offset = fragment['offset']
+        length = fragment['length']
+        if fragment['circular'] is True:
+            # circular fragment sequence is doubled, windows can start
+            # anywhere on first copy
+            n = length if W <= length else 0
+        else:
+            n = length-W+1
+        if n <= 0:
+            continue
+
+        for pattern, proto, strand in ((fwd_pattern, fwd_proto, 1), (rev_pattern, rev_proto, -1)):
+            ok = numpy.ones(n, dtype=bool)
+            for j, m in enumerate(pattern):
+                if m != 15:
+                    ok &= (masks[offset+j:offset+j+n] & m) != 0
+            windows = numpy.nonzero(ok)[0]
+
+            protospacers = codes[offset+proto+windows[:, None]+numpy.arange(L)]
+            valid = (protospacers < 4).all(axis=1)
+            windows = windows[valid]
+            protospacers = protospacers[valid]
+            if strand < 0:
+                protospacers = 3-protospacers[:, ::-1]
+
+            first = windows+proto+1
+            last = windows+proto+L
+            if fragment['circular'] is True:
+                first = (first-1) % length+1
+                last = (last-1) % length+1
+
+            hashes.append((protospacers.astype(numpy.uint64)*weights).sum(axis=1))
+            fragment_indices.append(numpy.zeros(len(windows), dtype=numpy.uint32)+i)
+            starts.append(first if strand > 0 else last)
+            ends.append(last if strand > 0 else first)
+            strands.append(numpy.zeros(len(windows), dtype=numpy.int8)+strand)
+
+    def concat(arrays, dtype):
+        if len(arrays) == 0:
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.concatenate(arrays).astype(dtype)
+
+    hashes = concat(hashes, numpy.uint64)
+    order = numpy.argsort(hashes, kind='mergesort')
+
+    make_required_dirs(dirname)
+    tmpdir = tempfile.mkdtemp(dir=os.path.dirname(dirname))
+    numpy.save('%s/hashes.npy' % tmpdir, hashes[order])
+    numpy.save('%s/fragments.npy' % tmpdir, concat(fragment_indices, numpy.uint32)[order])
+    numpy.save('%s/starts.npy' % tmpdir, concat(starts, numpy.uint32)[order])
+    numpy.save('%s/ends.npy' % tmpdir, concat(ends, numpy.uint32)[order])
+    numpy.save('%s/strands.npy' % tmpdir, concat(strands, numpy.int8)[order])
+    with open('%s/meta.json' % tmpdir, 'w') as f:
+        json.dump(dict(version=INDEX_FORMAT_VERSION, pam=pam, protospacer_length=L,
+                       pam_upstream=pam_upstream, signature=kmer_index.signature,
+                       fragments=[dict(id=x['id'], name=x['name'])
+                                  for x in kmer_index.fragments]), f)
+
+    if os.path.isdir(dirname):
+        shutil.rmtree(dirname)
+    os.rename(tmpdir, dirname)
+    return dirname
+
+
+class Pam_Index(object):
+    """
+    Memory mapped index of PAM sites on a genome, with hashes of the adjacent
+    protospacers, sorted by hash.
+    """
+
+    def __init__(self, dirname):
+        with open('%s/meta.json' % dirname) as f:
+            meta = json.load(f)
+        self.dirname = dirname
+        self.pam = meta['pam']
+        self.protospacer_length = meta['protospacer_length']
+        self.signature = meta['signature']
+        self.fragments = meta['fragments']
+        self.__hashes = numpy.load('%s/hashes.npy' % dirname, mmap_mode='r')
+        self.__fragments = numpy.load('%s/fragments.npy' % dirname, mmap_mode='r')
+        self.__starts = numpy.load('%s/starts.npy' % dirname, mmap_mode='r')
+        self.__ends = numpy.load('%s/ends.npy' % dirname, mmap_mode='r')
+        self.__strands = numpy.load('%s/strands.npy' % dirname, mmap_mode='r')
+
+    def __len__(self):
+        return len(self.__hashes)
+
+    def close(self):
+        """
+        Releases memory mapped files of the index; numpy memory maps are
+        unmapped, and their files closed, when the arrays are garbage collected.
+        """
+
+        self.__hashes = None
+        self.__fragments = None
+        self.__starts = None
+        self.__ends = None
+        self.__strands = None
+
+    def __site(self, i):
+        fragment = self.fragments[int(self.__fragments[i])]
+        return dict(fragment_id=fragment['id'],
+                    fragment_name=fragment['name'],
+                    strand=int(self.__strands[i]),
+                    subject_start=int(self.__starts[i]),
+                    subject_end=int(self.__ends[i]))
+
+    def find(self, protospacer):
+        """
+        Returns list of sites with protospacer adjacent to a PAM, as
+        dictionaries of fragment ID and name, strand, and protospacer start and
+        end positions.
+        """
+
+        h = hash_protospacer(protospacer)
+        if h is None or len(protospacer) != self.protospacer_length:
+            return []
+        h = numpy.uint64(h)
+        lo = numpy.searchsorted(self.__hashes, h, side='left')
+        hi = numpy.searchsorted(self.__hashes, h, side='right')
+        sites = [self.__site(i) for i in range(lo, hi)]
+        return sorted(sites, key=lambda s: (s['fragment_id'],
+                                            min(s['subject_start'], s['subject_end'])))
+
+    def count_mismatched(self, protospacer, max_mismatches):
+        """
+        Returns list of number of PAM sites whose protospacer differs from the
+        specified protospacer by 0, 1, ... up to max_mismatches bases.
+        """
+
+        h = hash_protospacer(protospacer)
+        if h is None or len(protospacer) != self.protospacer_length:
+            return [0]*(max_mismatches+1)
+        x = numpy.bitwise_xor(self.__hashes, numpy.uint64(h))
+        # one bit per mismatched base
+        x = (x | (x >> numpy.uint64(1))) & numpy.uint64(0x5555555555555555)
+        mismatches = POPCOUNT[x.view(numpy.uint8)].reshape(-1, 8).sum(axis=1, dtype=numpy.int64)
+        mismatches = mismatches[mismatches <= max_mismatches]
+        return [int(n) for n in numpy.bincount(mismatches, minlength=max_mismatches+1)]
+
+
+# loaded indices, by genome ID, PAM, protospacer length and PAM position
+_loaded_indices = Loaded_Indices(settings.KMER_LOADED_INDICES)
+
+
+def pam_index(genome, pam, protospacer_length, pam_upstream=False):
+    """
+    Returns Pam_Index for the genome, building or re-building the index if
+    fragments of the genome changed since the index was built.
+    """
+
+    # also makes sure k-mer index, and its signature, is up to date
+    signature = genome_index(genome).signature
+    key = (genome.id, pam.lower(), protospacer_length, pam_upstream)
+    index = _loaded_indices.get(key)
+    if index is not None and index.signature == signature:
+        return index
+
+    dirname = default_pam_index_name(genome, pam, protospacer_length, pam_upstream)
+    index = None
+    if os.path.isfile('%s/meta.json' % dirname):
+        index = Pam_Index(dirname)
+        if index.signature != signature:
+            index.close()
+            index = None
+
+    if index is None:
+        build_pam_index(genome, pam, protospacer_length, pam_upstream, dirname)
+        index = Pam_Index(dirname)
+
+    _loaded_indices.put(key, index)
+    return index
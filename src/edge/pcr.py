@@ -1,18 +1,21 @@
-from edge.blast import blast_genome
+import bisect
+from edge.blast import blast_genome_many, Blast_Result_Context
 from Bio.Seq import Seq
 
 
+MIN_IDENTITIES = 0.90
+MIN_BINDING_LENGTH = 10
+# probably an over-estimation, for misdirected primers on circular genome
+MAX_PCR_SIZE = 50000
+
+
 def compute_pcr_product(primer_a_sequence, primer_a_blastres,
-                        primer_b_sequence, primer_b_blastres):
+                        primer_b_sequence, primer_b_blastres, context=None):
     """
-    Computes a PCR product based on two blast results.
+    Computes a PCR product based on two blast results. Fragments are looked up
+    using the specified Blast_Result_Context, if any.
     """
 
-    MIN_IDENTITIES = 0.90
-    MIN_BINDING_LENGTH = 10
-    # probably an over-estimation, for misdirected primers on circular genome
-    MAX_PCR_SIZE = 50000
-
     # primers must be on the same fragment
     if primer_a_blastres.fragment_id != primer_b_blastres.fragment_id:
         return None
@@ -54,7 +57,9 @@ def compute_pcr_product(primer_a_sequence, primer_a_blastres,
        primer_b_blastres.alignment_length() < MIN_BINDING_LENGTH:
         return None
 
-    fragment = primer_a_blastres.fragment.indexed_fragment()
+    if context is None:
+        context = Blast_Result_Context()
+    fragment = context.fragment(primer_a_blastres.fragment_id)
 
     # cannot produce product if elongated regions do not overlap. if we are on
     # a circular fragment, there will always be overlaps.
@@ -66,7 +71,11 @@ def compute_pcr_product(primer_a_sequence, primer_a_blastres,
     bp_lo = fwd_primer_res.subject_end+1
     bp_hi = rev_primer_res.subject_end-1
 
-    product_mid = fragment.get_sequence(bp_lo=bp_lo, bp_hi=bp_hi)
+    if fragment.circular is False and bp_lo > bp_hi:
+        # primers bind next to each other
+        product_mid = ''
+    else:
+        product_mid = fragment.get_sequence(bp_lo=bp_lo, bp_hi=bp_hi)
     if len(product_mid) > MAX_PCR_SIZE:
         return None
 
@@ -83,39 +92,130 @@ def compute_pcr_product(primer_a_sequence, primer_a_blastres,
     return (product, dict(fragment=fragment, region=(bs_start, bs_end)))
 
 
-def pcr_from_genome(genome, primer_a_sequence, primer_b_sequence):
+def can_prime(primer_sequence, blastres):
+    """
+    Returns True if the blast result aligns the 3' end of primer to the
+    genome, well enough for the primer to bind and elongate.
     """
-    PCR on genome, using two primer sequences. Returns tuple of PCR product
-    sequence, primer a blast results, and primer b blast results. Produuct
-    sequence may be None if primers do not bind unique or in a way that can
-    result in a PCR product.
 
-    A PCR can create a product if each primer uniquely binds to the genome,
-    primers bind to the same fragment, on sense and antisense strands
-    respectively, and non-overlapping in their sense strand binding positions
+    return blastres.query_end == len(primer_sequence) and\
+        blastres.identity_ratio() >= MIN_IDENTITIES and\
+        blastres.alignment_length() >= MIN_BINDING_LENGTH
+
+
+def amplicon_candidates(fwd_results, rev_results, context):
+    """
+    Finds pairs of forward (sense strand) and reverse (antisense strand)
+    primer binding sites that are close enough on the same fragment to
+    produce a PCR product, without checking every pair. Reverse primer sites
+    are sorted by the end of the product middle; for each forward primer
+    site, sites within MAX_PCR_SIZE bps downstream are found by bisection.
     """
 
-    primer_a_results = blast_genome(genome, 'blastn', primer_a_sequence)
-    primer_b_results = blast_genome(genome, 'blastn', primer_b_sequence)
+    by_fragment = {}
+    for res in rev_results:
+        by_fragment.setdefault(res.fragment_id, []).append(res)
+
+    sorted_rev = {}
+    for fragment_id, results in by_fragment.iteritems():
+        fragment = context.fragment(fragment_id)
+        results = sorted(results, key=lambda r: fragment.circ_bp(r.subject_end-1))
+        ends = [fragment.circ_bp(r.subject_end-1) for r in results]
+        sorted_rev[fragment_id] = (fragment, ends, results)
+
+    candidates = []
+    for fwd in fwd_results:
+        if fwd.fragment_id not in sorted_rev:
+            continue
+        fragment, ends, results = sorted_rev[fwd.fragment_id]
+        lo = fragment.circ_bp(fwd.subject_end+1)
+        if fragment.circular is True:
+            # product middle may wrap around end of circular fragment
+            windows = [(lo, lo+MAX_PCR_SIZE-1),
+                       (1, min(lo-1, lo+MAX_PCR_SIZE-1-fragment.length))]
+        else:
+            # reverse primer must bind downstream of forward primer
+            windows = [(lo-1, lo+MAX_PCR_SIZE-1)]
+        for first, last in windows:
+            i = bisect.bisect_left(ends, first)
+            j = bisect.bisect_right(ends, last)
+            candidates.extend((fwd, rev) for rev in results[i:j])
+
+    return candidates
+
+
+def pcr_many(genome, primer_pairs):
+    """
+    PCR on genome, for a list of primer pairs. Returns a list of results, in
+    the same format as pcr_from_genome, one for each pair. Unique primers are
+    blasted in a single run; binding sites that can produce a product are
+    then found by sweeping sorted binding sites, and product sequence is only
+    fetched for those sites.
+    """
 
-    pcr_products = []
-    uniq_products = {}
-    for a_res in primer_a_results:
-        for b_res in primer_b_results:
+    primers = []
+    for primer_a_sequence, primer_b_sequence in primer_pairs:
+        for primer in (primer_a_sequence, primer_b_sequence):
+            if primer not in primers:
+                primers.append(primer)
+
+    context = Blast_Result_Context(genome)
+    primer_results = dict(zip(primers, blast_genome_many(genome, 'blastn', primers,
+                                                         context=context)))
+
+    # sites where each primer can bind and elongate, by strand
+    binding_sites = {}
+    for primer, results in primer_results.iteritems():
+        binding = [r for r in results if can_prime(primer, r)]
+        binding_sites[primer] = {1: [r for r in binding if r.strand() == 1],
+                                 -1: [r for r in binding if r.strand() == -1]}
+
+    pcr_results = []
+    for primer_a_sequence, primer_b_sequence in primer_pairs:
+        a_sites = binding_sites[primer_a_sequence]
+        b_sites = binding_sites[primer_b_sequence]
+
+        # either primer can be the forward primer
+        candidates = amplicon_candidates(a_sites[1], b_sites[-1], context)
+        candidates += [(a_res, b_res) for b_res, a_res in
+                       amplicon_candidates(b_sites[1], a_sites[-1], context)]
+
+        pcr_products = []
+        uniq_products = {}
+        for a_res, b_res in candidates:
             product = compute_pcr_product(primer_a_sequence, a_res,
-                                          primer_b_sequence, b_res)
+                                          primer_b_sequence, b_res, context=context)
             if product is not None:
                 k = (product[0], a_res.fragment_id)
                 if k not in uniq_products:
                     pcr_products.append(product)
                     uniq_products[k] = product
 
-    if len(pcr_products) == 1:
-        product = pcr_products[0][0]
-        region = pcr_products[0][1]
-        return (product, primer_a_results, primer_b_results,
-                dict(region=region['region'],
-                     fragment_name=region['fragment'].name,
-                     fragment_id=region['fragment'].id))
-    else:
-        return (None, primer_a_results, primer_b_results, None)
+        primer_a_results = primer_results[primer_a_sequence]
+        primer_b_results = primer_results[primer_b_sequence]
+        if len(pcr_products) == 1:
+            product = pcr_products[0][0]
+            region = pcr_products[0][1]
+            pcr_results.append((product, primer_a_results, primer_b_results,
+                                dict(region=region['region'],
+                                     fragment_name=region['fragment'].name,
+                                     fragment_id=region['fragment'].id)))
+        else:
+            pcr_results.append((None, primer_a_results, primer_b_results, None))
+
+    return pcr_results
+
+
+def pcr_from_genome(genome, primer_a_sequence, primer_b_sequence):
+    """
+    PCR on genome, using two primer sequences. Returns tuple of PCR product
+    sequence, primer a blast results, and primer b blast results. Produuct
+    sequence may be None if primers do not bind unique or in a way that can
+    result in a PCR product.
+
+    A PCR can create a product if each primer uniquely binds to the genome,
+    primers bind to the same fragment, on sense and antisense strands
+    respectively, and non-overlapping in their sense strand binding positions
+    """
+
+    return pcr_many(genome, [(primer_a_sequence, primer_b_sequence)])[0]
@@ -1,7 +1,11 @@
-import re
 import os
+import re
+import json
+import shutil
+import hashlib
 import tempfile
 import subprocess
+import threading
 from django.conf import settings
 from Bio.Seq import Seq
 
@@ -50,28 +54,258 @@ def parse_primer3_output(d):
     return [primers[k] for k in sorted(primers.keys())]
 
 
+def primer3_record(opts):
+    lines = ['%s=%s\n' % (k, opts[k]) for k in opts]
+    lines.append('PRIMER_THERMODYNAMIC_PARAMETERS_PATH=%s/primer3_config/\n' % settings.PRIMER3_DIR)
+    lines.append('=\n')
+    return ''.join(lines)
+
+
+class Primer3_Process(object):
+    """
+    A long running primer3_core process. Records are streamed to the
+    process's stdin, and results read from its stdout, one '=' terminated
+    record for each input record.
+    """
+
+    def __init__(self):
+        cmd = "%s/primer3_core" % settings.PRIMER3_DIR
+        self.__proc = subprocess.Popen([cmd], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                       close_fds=True)
+
+    def is_alive(self):
+        return self.__proc.poll() is None
+
+    def __write(self, records):
+        try:
+            for record in records:
+                self.__proc.stdin.write(record)
+            self.__proc.stdin.flush()
+        except IOError:
+            # process exited, reader will report the error
+            pass
+
+    def __read(self):
+        r = {}
+        while True:
+            l = self.__proc.stdout.readline()
+            if l == '':
+                raise Exception('primer3_core exited unexpectedly')
+            l = l.rstrip('\n')
+            if l == '=':
+                return r
+            if '=' in l:
+                l = l.split('=')
+                r[l[0]] = '='.join(l[1:])
+
+    def run_many(self, records):
+        # write from another thread, so primer3_core never blocks writing
+        # results while we are still writing records
+        writer = threading.Thread(target=self.__write, args=(records,))
+        writer.start()
+        try:
+            return [self.__read() for record in records]
+        except:
+            self.close()
+            raise
+        finally:
+            writer.join()
+
+    def close(self):
+        if self.is_alive():
+            self.__proc.stdin.close()
+            self.__proc.wait()
+
+
+class Primer3_Pool(object):
+    """
+    Pool of idle primer3_core processes. primer3_core keeps global settings
+    from one record to the next, so a process is only reused for records
+    setting the same options, each record overriding all of the settings of
+    the previous one.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.__idle = {}
+        self.__lock = threading.Lock()
+
+    def acquire(self, key):
+        with self.__lock:
+            processes = self.__idle.get(key, [])
+            while len(processes) > 0:
+                process = processes.pop()
+                if process.is_alive():
+                    return process
+        return Primer3_Process()
+
+    def release(self, key, process):
+        with self.__lock:
+            processes = self.__idle.setdefault(key, [])
+            if process.is_alive() and len(processes) < self.size:
+                processes.append(process)
+                return
+        process.close()
+
+    def run_many(self, key, records):
+        process = self.acquire(key)
+        r = process.run_many(records)
+        self.release(key, process)
+        return r
+
+
+_primer3_pool = Primer3_Pool(settings.PRIMER3_PROCESSES)
+
+
+def primer3_run_many(opts_list):
+    """
+    Runs primer3 for each set of options. Records with the same options are
+    streamed to long running primer3_core processes, up to
+    settings.PRIMER3_PROCESSES processes in parallel. Returns a list of
+    parsed primer3 outputs, one for each set of options.
+    """
+
+    groups = {}
+    for i, opts in enumerate(opts_list):
+        groups.setdefault(tuple(sorted(opts.keys())), []).append(i)
+
+    jobs = []
+    for key, indices in groups.iteritems():
+        n = (len(indices)+_primer3_pool.size-1)//_primer3_pool.size
+        for i in range(0, len(indices), n):
+            jobs.append((key, indices[i:i+n]))
+
+    outputs = [None]*len(opts_list)
+    errors = []
+
+    def run(key, indices):
+        try:
+            records = [primer3_record(opts_list[i]) for i in indices]
+            for i, r in zip(indices, _primer3_pool.run_many(key, records)):
+                outputs[i] = r
+        except Exception as e:
+            errors.append(e)
+
+    if len(jobs) == 1:
+        run(*jobs[0])
+    else:
+        threads = [threading.Thread(target=run, args=job) for job in jobs]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    if len(errors) > 0:
+        raise errors[0]
+
+    return [parse_primer3_output(r) for r in outputs]
+
+
 def primer3_run(opts):
-    fn = None
-    with tempfile.NamedTemporaryFile(mode='w', delete=False) as f:
-        fn = f.name
-        for k in opts:
-            f.write('%s=%s\n' % (k, opts[k]))
-        f.write('PRIMER_THERMODYNAMIC_PARAMETERS_PATH=%s/primer3_config/\n' % settings.PRIMER3_DIR)
-        f.write('=')
-
-    cmd = "%s/primer3_core %s" % (settings.PRIMER3_DIR, fn)
-    out = subprocess.check_output(cmd.split(' '))
-    os.unlink(fn)
-    r = {}
-    for l in out.split('\n'):
-        if '=' in l:
-            l = l.split('=')
-            r[l[0]] = '='.join(l[1:])
-
-    return parse_primer3_output(r)
+    return primer3_run_many([opts])[0]
 
 
-def design_primers_from_template(template, roi_start, roi_len, junctions, primer3_opts):
+class Primer3_Cache(object):
+    """
+    Cache of primer3 results, keyed by hash of the complete set of primer3
+    options, including the template. Each entry is a file, sharded by hash,
+    so the cache is shared by all processes. Entries are touched when used;
+    least recently used entries are evicted when the cache grows over size.
+    """
+
+    # check cache size after this many new entries
+    EVICT_INTERVAL = 100
+
+    def __init__(self, dirname, size):
+        self.dirname = dirname
+        self.size = size
+        self.__added = 0
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def key(opts):
+        return hashlib.sha1(json.dumps(sorted(opts.items()))).hexdigest()
+
+    def __entry_fn(self, key):
+        return '%s/%s/%s/%s.json' % (self.dirname, key[0:2], key[2:4], key)
+
+    def get(self, opts):
+        fn = self.__entry_fn(Primer3_Cache.key(opts))
+        try:
+            with open(fn) as f:
+                primers = json.load(f)
+            os.utime(fn, None)
+        except (IOError, OSError, ValueError):
+            primers = None
+        return primers
+
+    def put(self, opts, primers):
+        fn = self.__entry_fn(Primer3_Cache.key(opts))
+        try:
+            os.makedirs(os.path.dirname(fn))
+        except OSError:
+            # directory exists, maybe created by another process
+            pass
+        # write to a temporary file, then move into place, so readers never
+        # see partially written entry
+        with tempfile.NamedTemporaryFile(mode='w', dir=os.path.dirname(fn), delete=False) as f:
+            json.dump(primers, f)
+        os.rename(f.name, fn)
+
+        with self.__lock:
+            self.__added += 1
+            evict = self.__added % Primer3_Cache.EVICT_INTERVAL == 0
+        if evict:
+            self.evict()
+
+    def entries(self):
+        fns = []
+        for dirpath, dirnames, filenames in os.walk(self.dirname):
+            fns.extend(os.path.join(dirpath, fn) for fn in filenames if fn.endswith('.json'))
+        return fns
+
+    def evict(self):
+        entries = []
+        for fn in self.entries():
+            try:
+                entries.append((os.path.getmtime(fn), fn))
+            except OSError:
+                pass
+        if len(entries) <= self.size:
+            return
+        for mtime, fn in sorted(entries)[0:len(entries)-self.size]:
+            try:
+                os.unlink(fn)
+            except OSError:
+                pass
+
+    def clear(self):
+        shutil.rmtree(self.dirname, ignore_errors=True)
+
+
+if settings.PRIMER3_CACHE_DIR is None:
+    primer3_cache = None
+else:
+    primer3_cache = Primer3_Cache(settings.PRIMER3_CACHE_DIR, settings.PRIMER3_CACHE_SIZE)
+
+
+def primer3_run_many_cached(opts_list):
+    """
+    Like primer3_run_many, but uses results cached from previous runs with
+    the same options, and only runs primer3 for the rest.
+    """
+
+    if primer3_cache is None:
+        return primer3_run_many(opts_list)
+
+    results = [primer3_cache.get(opts) for opts in opts_list]
+    misses = [i for i, r in enumerate(results) if r is None]
+    for i, r in zip(misses, primer3_run_many([opts_list[i] for i in misses])):
+        primer3_cache.put(opts_list[i], r)
+        results[i] = r
+    return results
+
+
+def primer3_template_opts(template, roi_start, roi_len, primer3_opts):
     primer3_opts = {} if primer3_opts is None else primer3_opts
     min_primer_product_size = min(PRIMER3_MIN_PRIMER*2+roi_len, len(template))
     max_primer_product_size = len(template)
@@ -90,8 +324,10 @@ def design_primers_from_template(template, roi_start, roi_len, junctions, primer
                      SEQUENCE_ID='_',
                      SEQUENCE_TEMPLATE=template,
                      SEQUENCE_TARGET='%s,%s' % (roi_start, roi_len)))
+    return opts
 
-    primers = primer3_run(opts)
+
+def add_junction_distances(template, junctions, primers):
     if junctions and len(junctions) > 0:
         for primer in primers:
             p1 = primer['PRIMER_LEFT_SEQUENCE']
@@ -101,10 +337,26 @@ def design_primers_from_template(template, roi_start, roi_len, junctions, primer
             p2_i = template.lower().index(p2_rc.lower())
             primer['PRIMER_LEFT_SEQUENCE_DISTANCE_TO_JUNCTION'] = junctions[0]-(p1_i+len(p1))
             primer['PRIMER_RIGHT_SEQUENCE_DISTANCE_TO_JUNCTION'] = p2_i-junctions[-1]
-
     return primers
 
 
+def design_primers_many(templates):
+    """
+    Design primers for a list of (template, roi_start, roi_len, junctions,
+    primer3_opts) tuples, with a single round trip to primer3. Returns list
+    of designed primers for each template.
+    """
+
+    opts_list = [primer3_template_opts(template, roi_start, roi_len, primer3_opts)
+                 for template, roi_start, roi_len, junctions, primer3_opts in templates]
+    results = primer3_run_many_cached(opts_list)
+    return [add_junction_distances(t[0], t[3], primers) for t, primers in zip(templates, results)]
+
+
+def design_primers_from_template(template, roi_start, roi_len, junctions, primer3_opts):
+    return design_primers_many([(template, roi_start, roi_len, junctions, primer3_opts)])[0]
+
+
 def design_primers(fragment, roi_start_bp, roi_len, upstream_window, downstream_window, opts):
     """
     Design primer using primer3 pipeline. Returns list of designed primers.
@@ -1,9 +1,9 @@
 from time import time
 import json
-from edge.blast import blast_genome
+from edge.blast import blast_genome, Blast_Result_Context
 from edge.models import Genome, Fragment, Operation
-from edge.primer import design_primers_from_template
-from edge.pcr import pcr_from_genome
+from edge.primer import design_primers_many
+from edge.pcr import pcr_many
 from edge.orfs import detect_orfs
 from Bio.Seq import Seq
 
@@ -29,8 +29,10 @@ def remove_overhangs(s):
     return s
 
 
-def blast_result_annotations(res):
-    fragment = Fragment.objects.get(pk=res.fragment_id).indexed_fragment()
+def blast_result_annotations(res, context=None):
+    if context is None:
+        context = Blast_Result_Context()
+    fragment = context.fragment(res.fragment_id)
 
     # get annotations, but only those that correspond to a full feature
 
@@ -121,7 +123,8 @@ def get_annotation_on_cassette(annotation, blast_res):
 
 def get_cassette_inherited_annotations(genome, cassette, fragment_id, region_start, region_end):
     # blast cassette against unmodified genome
-    cassette_blast_res = blast_genome(genome, 'blastn', cassette)
+    context = Blast_Result_Context(genome)
+    cassette_blast_res = blast_genome(genome, 'blastn', cassette, context=context)
 
     # find matches inside region to be replaced
     matches = [res for res in cassette_blast_res
@@ -132,7 +135,7 @@ def get_cassette_inherited_annotations(genome, cassette, fragment_id, region_sta
 
     for blast_res in matches:
         # get annotations for each match
-        annotations = blast_result_annotations(blast_res)
+        annotations = blast_result_annotations(blast_res, context=context)
 
         # print blast_res.to_dict()
         # print annotations
@@ -196,9 +199,11 @@ class RecombinationRegion(object):
 
 
 def compute_swap_region_from_results(front_arm_sequence, front_arm_blastres,
-                                     back_arm_sequence, back_arm_blastres, cassette):
+                                     back_arm_sequence, back_arm_blastres, cassette,
+                                     context=None):
     """
     Computes a region on fragment flanked by two arms from blast results.
+    Fragments are looked up using the specified Blast_Result_Context, if any.
     """
 
     MIN_IDENTITIES = 0.9
@@ -221,7 +226,9 @@ def compute_swap_region_from_results(front_arm_sequence, front_arm_blastres,
        back_arm_blastres.alignment_length() < len(back_arm_sequence)-MAX_MISSING_BP:
         return None
 
-    fragment = front_arm_blastres.fragment.indexed_fragment()
+    if context is None:
+        context = Blast_Result_Context()
+    fragment = context.fragment(front_arm_blastres.fragment_id)
 
     single_crossover = False
     single_crossover_front_0_i = None
@@ -327,39 +334,56 @@ def find_possible_swap_regions(genome, front_arm_sequence, back_arm_sequence, ca
     Computes all possible recombined region from arm sequences.
     """
 
-    front_arm_results = blast_genome(genome, 'blastn', front_arm_sequence)
-    back_arm_results = blast_genome(genome, 'blastn', back_arm_sequence)
+    context = Blast_Result_Context(genome)
+    front_arm_results = blast_genome(genome, 'blastn', front_arm_sequence, context=context)
+    back_arm_results = blast_genome(genome, 'blastn', back_arm_sequence, context=context)
 
     regions = []
     for a_res in front_arm_results:
         for b_res in back_arm_results:
             region = compute_swap_region_from_results(front_arm_sequence, a_res,
                                                       back_arm_sequence, b_res,
-                                                      cassette)
+                                                      cassette, context=context)
             if region is not None:
                 regions.append(region)
 
     return regions
 
 
+def remove_working_primers_many(genome, primer_lists):
+    """
+    For each list of primers, remove primers that produce a PCR product on
+    genome. All primers are screened together, with a single batch PCR.
+    """
+
+    pairs = [(primer['PRIMER_LEFT_SEQUENCE'], primer['PRIMER_RIGHT_SEQUENCE'])
+             for primers in primer_lists for primer in primers]
+    products = iter(pcr_many(genome, pairs))
+
+    failed_primer_lists = []
+    for primers in primer_lists:
+        failed_primers = []
+        for primer in primers:
+            if next(products)[0] is None:
+                failed_primers.append(primer)
+        failed_primer_lists.append(failed_primers)
+    return failed_primer_lists
+
+
 def remove_working_primers(genome, primers):
-    failed_primers = []
-    for primer in primers:
-        p1 = primer['PRIMER_LEFT_SEQUENCE']
-        p2 = primer['PRIMER_RIGHT_SEQUENCE']
-        p = pcr_from_genome(genome, p1, p2)
-        if p[0] is None:
-            failed_primers.append(primer)
-    return failed_primers
+    return remove_working_primers_many(genome, [primers])[0]
 
 
-def get_verification_primers(genome, region, primer3_opts):
+def verification_primer_templates(region, primer3_opts):
     """
-    Design primers to verify replacing region with cassette.
+    Returns list of (region attribute, screen against genome, design
+    arguments) tuples, for designing primers to verify replacing region with
+    cassette.
     """
 
     fragment = Fragment.objects.get(pk=region.fragment_id).indexed_fragment()
     cassette = region.cassette
+    templates = []
 
     check_junction_lu = CHECK_JUNCTION_LEFT_UP
     check_junction_ld = CHECK_JUNCTION_LEFT_DN
@@ -390,10 +414,8 @@ def get_verification_primers(genome, region, primer3_opts):
         roi_len = min(check_junction_lu+check_junction_ld,
                       min(len(front), check_junction_ld)+len(cassette))
         # remove primers that works on un-modified genome for creating a PCR product
-        region.verification_front =\
-            remove_working_primers(genome,
-                                   design_primers_from_template(template, roi_start, roi_len,
-                                                                junction, primer3_opts))
+        templates.append(('verification_front', True,
+                          (template, roi_start, roi_len, junction, primer3_opts)))
 
     #
     # back junction
@@ -415,10 +437,8 @@ def get_verification_primers(genome, region, primer3_opts):
         roi_len = min(check_junction_ru+check_junction_rd,
                       min(len(back), check_junction_rd)+len(cassette))
         # remove primers that works on un-modified genome for creating a PCR product
-        region.verification_back =\
-            remove_working_primers(genome,
-                                   design_primers_from_template(template, roi_start, roi_len,
-                                                                junction, primer3_opts))
+        templates.append(('verification_back', True,
+                          (template, roi_start, roi_len, junction, primer3_opts)))
 
     #
     # cassette
@@ -433,9 +453,42 @@ def get_verification_primers(genome, region, primer3_opts):
         junctions = [len(front), len(front+cassette)-1]
         roi_start = template.index(cassette)
         roi_len = len(cassette)
-        region.verification_cassette =\
-            design_primers_from_template(template, roi_start, roi_len,
-                                         junctions, primer3_opts)
+        templates.append(('verification_cassette', False,
+                          (template, roi_start, roi_len, junctions, primer3_opts)))
+
+    return templates
+
+
+def get_verification_primers_many(genome, regions, primer3_opts):
+    """
+    Design primers to verify replacing each region with cassette. Primers for
+    all regions are designed with a single round trip to primer3.
+    """
+
+    designs = []
+    for region in regions:
+        for attr, screen, args in verification_primer_templates(region, primer3_opts):
+            designs.append((region, attr, screen, args))
+
+    primers = design_primers_many([args for region, attr, screen, args in designs])
+
+    # remove primers that work on un-modified genome, screening primers of
+    # all regions together
+    screened = [i for i, design in enumerate(designs) if design[2] is True]
+    for i, failed in zip(screened, remove_working_primers_many(genome,
+                                                               [primers[i] for i in screened])):
+        primers[i] = failed
+
+    for (region, attr, screen, args), designed in zip(designs, primers):
+        setattr(region, attr, designed)
+
+
+def get_verification_primers(genome, region, primer3_opts):
+    """
+    Design primers to verify replacing region with cassette.
+    """
+
+    get_verification_primers_many(genome, [region], primer3_opts)
 
 
 def find_swap_region(genome, cassette, min_homology_arm_length,
@@ -464,8 +517,7 @@ def find_swap_region(genome, cassette, min_homology_arm_length,
         return []
 
     if design_primers is True:
-        for region in regions:
-            get_verification_primers(genome, region, primer3_opts)
+        get_verification_primers_many(genome, regions, primer3_opts)
 
     return regions
 
@@ -616,28 +668,35 @@ def annotate_integration(genome, new_genome, regions_before, regions_after, cass
     locked_genome = list(locked_genome)
     genome = locked_genome[0]
 
+    # collect annotations for each fragment, and add them all at once
+    fragment_annotations = {}
     for before, after, annotations in before_and_after_with_annotations:
-        with new_genome.annotate_fragment_by_fragment_id(after['fragment_id']) as f:
-            # region_start is already adjusted for multiple integration in this
-            # fragment
-
-            # collect list of annotations to be added later
-
-            # annotate cassette
-            if before['cassette_reversed']:
-                strand = -1
-            else:
-                strand = 1
-            f.annotate(after['start'], after['start']+len(before['cassette'])-1,
-                       cassette_name, 'operation', strand, operation=op)
-
-            # annotated inherited and new annotations
-            for annotation in annotations:
-                f.annotate(after['start']+annotation['base_first']-1,
-                           after['start']+annotation['base_last']-1,
-                           annotation['feature_name'],
-                           annotation['feature_type'],
-                           annotation['feature_strand'])
+        # region_start is already adjusted for multiple integration in this
+        # fragment
+        fragment_annotations.setdefault(after['fragment_id'], [])
+        new_annotations = fragment_annotations[after['fragment_id']]
+
+        # annotate cassette
+        if before['cassette_reversed']:
+            strand = -1
+        else:
+            strand = 1
+        new_annotations.append(dict(first_base1=after['start'],
+                                    last_base1=after['start']+len(before['cassette'])-1,
+                                    name=cassette_name, type='operation', strand=strand,
+                                    operation=op))
+
+        # annotated inherited and new annotations
+        for annotation in annotations:
+            new_annotations.append(dict(first_base1=after['start']+annotation['base_first']-1,
+                                        last_base1=after['start']+annotation['base_last']-1,
+                                        name=annotation['feature_name'],
+                                        type=annotation['feature_type'],
+                                        strand=annotation['feature_strand']))
+
+    for fragment_id, new_annotations in fragment_annotations.iteritems():
+        with new_genome.annotate_fragment_by_fragment_id(fragment_id) as f:
+            f.annotate_many(new_annotations)
 
 
 def recombine(genome, cassette, homology_arm_length,
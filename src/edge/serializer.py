@@ -0,0 +1,64 @@
+import re
+import uuid
+try:
+    # simplejson has faster C speedups than json in the standard library, and
+    # produces the same output
+    import simplejson as json
+except ImportError:
+    import json
+
+
+# number of list elements to encode at a time when streaming a list
+JSON_STREAM_BATCH_SIZE = 500
+
+
+class RawJSON(object):
+    """
+    JSON text to include in output as is, e.g. JSON already serialized and
+    stored in the database, so it does not have to be decoded and encoded
+    again.
+    """
+
+    __slots__ = ('json',)
+
+    def __init__(self, json):
+        self.json = json
+
+
+def to_json(obj):
+    """
+    Returns JSON encoding of obj. Encodes obj in one pass of the JSON
+    encoder, with a placeholder string for each RawJSON value; placeholders
+    are then replaced with the RawJSON text.
+    """
+
+    raw = []
+    token = uuid.uuid4().hex
+
+    def placeholder(o):
+        if isinstance(o, RawJSON):
+            raw.append(o.json)
+            return '%s:%s' % (token, len(raw)-1)
+        raise TypeError('%r is not JSON serializable' % (o,))
+
+    s = json.dumps(obj, default=placeholder)
+    if len(raw) > 0:
+        s = re.sub(r'"%s:(\d+)"' % (token,), lambda m: raw[int(m.group(1))], s)
+    return s
+
+
+def json_chunks(obj, batch_size=JSON_STREAM_BATCH_SIZE):
+    """
+    Generator yielding JSON encoding of obj in pieces, encoding batch_size
+    elements at a time if obj is a list, for streaming large responses.
+    """
+
+    if type(obj) not in (list, tuple):
+        yield to_json(obj)
+        return
+
+    yield '['
+    for i in range(0, len(obj), batch_size):
+        s = to_json(obj[i:i+batch_size])[1:-1]
+        yield s if i == 0 else ', '+s
+    yield ']'
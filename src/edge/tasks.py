@@ -2,6 +2,8 @@ from celery import task
 from edge.models import Genome, Operation
 from edge.blastdb import build_genome_db
 from edge.recombine import annotate_integration
+from edge.orf_annotation import annotate_genome_orfs
+from edge.variants import apply_genome_variants, vcf_path
 from django.db import transaction
 
 
@@ -27,3 +29,43 @@ def annotate_integration_task(genome_id, new_genome_id,
     op = Operation.objects.get(pk=op_id)
     annotate_integration_on_genome(genome, new_genome,
                                    regions_before, regions_after, cassette_name, op)
+
+
+@task(name="annotate_genome_orfs", bind=True)
+def annotate_genome_orfs_task(self, genome_id, op_id):
+    genome = Genome.objects.get(pk=genome_id)
+    op = Operation.objects.get(pk=op_id)
+
+    def progress(done, total, orfs):
+        # eagerly executed task has no result backend to report progress to
+        if not self.request.is_eager:
+            self.update_state(state='PROGRESS',
+                              meta=dict(fragments=done, total=total, orfs=orfs))
+
+    with transaction.atomic():
+        annotated = annotate_genome_orfs(genome, op, progress=progress)
+
+    # fragments changed after the genome was created, so build BLAST db now
+    # that new fragments are committed
+    build_genome_blastdb.delay(genome.id)
+    return annotated
+
+
+@task(name="apply_genome_variants", bind=True)
+def apply_genome_variants_task(self, genome_id, op_id):
+    genome = Genome.objects.get(pk=genome_id)
+    op = Operation.objects.get(pk=op_id)
+
+    def progress(chroms, variants):
+        # eagerly executed task has no result backend to report progress to
+        if not self.request.is_eager:
+            self.update_state(state='PROGRESS', meta=dict(chroms=chroms, variants=variants))
+
+    with transaction.atomic():
+        with open(vcf_path(op)) as f:
+            applied = apply_genome_variants(genome, f, op, progress=progress)
+
+    # fragments changed after the genome was created, so build BLAST db now
+    # that new fragments are committed
+    build_genome_blastdb.delay(genome.id)
+    return applied
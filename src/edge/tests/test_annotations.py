@@ -1,4 +1,6 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from edge.models import *
 
 
@@ -352,3 +354,81 @@ class AnnotationsTest(TestCase):
         self.assertEquals(f.annotations()[0].feature.name, 'X1')
         self.assertEquals(f.annotations()[0].feature_base_first, 1)
         self.assertEquals(f.annotations()[0].feature_base_last, 3)
+
+
+class AnnotateManyTest(TestCase):
+
+    def build_fragment(self, sequence, circular=False):
+        f = Fragment.create_with_sequence('Foo', sequence, circular=circular)
+        f.insert_bases(5, 'gata')
+        return Fragment.objects.get(pk=f.pk).indexed_fragment()
+
+    def summary(self, fragment):
+        fragment = Fragment.objects.get(pk=fragment.pk).indexed_fragment()
+        return (fragment.sequence,
+                [(a.base_first, a.base_last, a.feature.name, a.feature.type, a.feature.strand,
+                  a.feature.length, a.feature.qualifiers, a.feature_base_first,
+                  a.feature_base_last) for a in fragment.annotations()])
+
+    def check_same_as_annotate(self, annotations, circular=False):
+        sequence = 'agttcgaggctgaattccgtaggcatgcatgcaagctttacgt'
+        one_by_one = self.build_fragment(sequence, circular)
+        for a in annotations:
+            one_by_one.annotate(**a)
+        many = self.build_fragment(sequence, circular)
+        features = many.annotate_many(annotations)
+        self.assertEquals([f.name for f in features], [a['name'] for a in annotations])
+        self.assertEquals(self.summary(many), self.summary(one_by_one))
+
+    def test_annotates_same_as_one_at_a_time(self):
+        self.check_same_as_annotate([
+            dict(first_base1=2, last_base1=9, name='A1', type='gene', strand=1),
+            dict(first_base1=4, last_base1=20, name='A2', type='gene', strand=-1,
+                 qualifiers=dict(note=['x'])),
+            dict(first_base1=4, last_base1=20, name='A3', type='CDS', strand=None),
+            dict(first_base1=30, last_base1=47, name='A4', type='gene', strand=1),
+            dict(first_base1=7, last_base1=7, name='A5', type='gene', strand=1),
+        ])
+
+    def test_annotates_across_circular_boundary_same_as_one_at_a_time(self):
+        self.check_same_as_annotate([
+            dict(first_base1=40, last_base1=3, name='A1', type='gene', strand=1),
+            dict(first_base1=45, last_base1=47, name='A2', type='gene', strand=1),
+            dict(first_base1=1, last_base1=47, name='A3', type='gene', strand=-1),
+        ], circular=True)
+
+    def test_splits_existing_annotations(self):
+        f = self.build_fragment('agttcgaggctgaattccgtaggcatgcatgcaagctttacgt')
+        f.annotate(3, 30, 'A1', 'gene', 1)
+        f.annotate_many([dict(first_base1=10, last_base1=12, name='A2', type='gene', strand=1),
+                         dict(first_base1=20, last_base1=35, name='A3', type='gene', strand=1)])
+        a = [x for x in self.summary(f)[1] if x[2] == 'A1']
+        self.assertEquals(len(a), 1)
+        self.assertEquals(a[0][0:2], (3, 30))
+        self.assertEquals(a[0][7:9], (1, 28))
+
+    def test_child_inherits_annotations_added_by_parent(self):
+        root = Fragment.create_with_sequence('Foo', 'agttcgaggctgaattccgtaggcatgcatgc')
+        child = root.update('Bar')
+        child.insert_bases(3, 'gataca')
+        root.annotate_many([dict(first_base1=10, last_base1=12, name='A1', type='gene', strand=1),
+                            dict(first_base1=1, last_base1=4, name='A2', type='gene', strand=1)])
+        child = Fragment.objects.get(pk=child.pk).indexed_fragment()
+        self.assertEquals(child.sequence, 'ag'+'gataca'+'ttcgaggctgaattccgtaggcatgcatgc')
+        self.assertEquals([(a.base_first, a.base_last, a.feature.name)
+                           for a in child.annotations()],
+                          [(1, 2, 'A2'), (9, 10, 'A2'), (16, 18, 'A1')])
+
+    def test_only_reads_sequences_of_split_chunks(self):
+        f = Fragment.create_with_sequence('Foo', 'agttcgaggctgaattccgtaggcatgcatgc'*10)
+        f.annotate_many([dict(first_base1=i, last_base1=i+1, name='A', type='gene', strand=1)
+                         for i in range(1, 300, 5)])
+        f = Fragment.objects.get(pk=f.pk).indexed_fragment()
+        with CaptureQueriesContext(connection) as queries:
+            f.annotate_many([dict(first_base1=150, last_base1=150, name='B', type='gene',
+                                  strand=1)])
+        reads = [q['sql'] for q in queries.captured_queries
+                 if '"edge_chunk"."sequence"' in q['sql']]
+        # one query, for the chunk to split, not joined with location index
+        self.assertEquals(len(reads), 1)
+        self.assertNotIn('edge_fragment_chunk_location', reads[0])
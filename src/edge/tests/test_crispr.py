@@ -3,7 +3,8 @@ import json
 from django.test import TestCase
 from edge.models import Genome, Operation, Fragment, Genome_Fragment
 from edge.blastdb import build_all_genome_dbs, fragment_fasta_fn
-from edge.crispr import find_crispr_target, crispr_dsb
+from edge.crispr import find_crispr_target, crispr_dsb, target_followed_by_pam
+from edge.blast import Blast_Result, Blast_Result_Context
 from Bio.Seq import Seq
 
 
@@ -322,3 +323,48 @@ class GenomeCrisprDSBTest(TestCase):
         r = json.loads(res.content)
         c2 = r['id']
         self.assertEquals(c1, c2)
+
+
+class CrisprBlastResultContextTest(TestCase):
+
+    def test_checks_pam_on_circular_fragment_with_one_query_per_hit(self):
+        s1 = 'agaaggtctggtagcgatgtagtcgatct'
+        s2 = 'gactaggtacgtagtcgtcaggtcagtca'
+        pam = 'cgg'
+        s = pam[1:]+s2+s1+pam[:1]
+        f = Fragment.create_with_sequence('Bar', s, circular=True)
+        guide = s1[-20:]
+
+        res = Blast_Result(fragment_id=f.id,
+                           fragment_length=len(s),
+                           hit_def=f.name,
+                           query_start=1,
+                           query_end=len(guide),
+                           subject_start=len(s)-20,
+                           subject_end=len(s)-1,
+                           evalue=0.0,
+                           alignment=dict(query=guide, match='|'*len(guide),
+                                          matchi=' '*len(guide), subject=guide))
+
+        context = Blast_Result_Context()
+        with self.assertNumQueries(1):
+            context.load([res])
+
+        # pam is across circular boundary, so two queries for the sequence
+        with self.assertNumQueries(2):
+            t = target_followed_by_pam(res, 'ngg', context=context)
+        self.assertEquals(t.fragment_id, f.id)
+        self.assertEquals(t.fragment_name, 'Bar')
+        self.assertEquals(t.subject_start, len(s)-20)
+        self.assertEquals(t.subject_end, len(s)-1)
+
+    def test_reindexes_fragment_with_stale_index_when_loading_context(self):
+        f = Fragment.create_with_sequence('Bar', 'agaaggtctggtagcgatgtagtcgatct')
+        index = f.fragment_index
+        index.fresh = False
+        index.save()
+
+        context = Blast_Result_Context()
+        fragment = context.fragment(f.id)
+        self.assertEquals(fragment.length, 29)
+        self.assertEquals(Fragment.objects.get(pk=f.id).has_location_index, True)
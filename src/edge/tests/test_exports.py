@@ -0,0 +1,68 @@
+import os
+import gzip
+import shutil
+import tempfile
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+from edge.models import Genome, Fragment, Genome_Fragment
+from edge.io import IO
+from edge.exports import cached_export, export_fn
+
+
+class ExportCacheTest(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.settings_override = override_settings(EXPORT_CACHE_DIR=self.tmpdir)
+        self.settings_override.enable()
+
+        self.genome = Genome.create('Foo')
+        self.fragment = Fragment.create_with_sequence('Bar', 'agttcgaggctga'*10)
+        self.fragment.annotate(3, 20, 'A1', 'gene', 1)
+        Genome_Fragment(genome=self.genome, fragment=self.fragment, inherited=False).save()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.tmpdir)
+
+    def test_renders_export_and_compressed_export(self):
+        version, fn, gz_fn = cached_export(self.genome, 'gff')
+        self.assertTrue(fn.startswith(self.tmpdir))
+        gff = ''.join(IO(self.genome).gff_lines())
+        self.assertEquals(open(fn).read(), gff)
+        self.assertEquals(gzip.open(gz_fn).read(), gff)
+
+    def test_reuses_export_until_genome_changes(self):
+        version, fn, gz_fn = cached_export(self.genome, 'fa')
+        inode = os.stat(fn).st_ino
+        self.assertEquals(cached_export(self.genome, 'fa'), (version, fn, gz_fn))
+        self.assertEquals(os.stat(fn).st_ino, inode)
+
+        self.fragment.insert_bases(5, 'gataca')
+        new_version, new_fn, new_gz_fn = cached_export(self.genome, 'fa')
+        self.assertNotEquals(new_version, version)
+        self.assertIn('agttgatacacgagg', open(new_fn).read())
+        # exports of old version are removed
+        self.assertFalse(os.path.exists(fn))
+        self.assertFalse(os.path.exists(gz_fn))
+
+    def test_annotating_fragment_invalidates_export(self):
+        version, fn, gz_fn = cached_export(self.genome, 'gff')
+        self.fragment.annotate(30, 40, 'A2', 'gene', 1)
+        new_version, new_fn, new_gz_fn = cached_export(self.genome, 'gff')
+        self.assertNotEquals(new_version, version)
+        self.assertIn('name=A2', open(new_fn).read())
+
+    def test_prewarms_exports_of_active_genomes(self):
+        inactive = Genome.create('Baz')
+        inactive.active = False
+        inactive.save()
+
+        call_command('prewarm_exports', 'gff', 'gb')
+        version = IO(self.genome).version()
+        self.assertTrue(os.path.exists(export_fn(self.genome, version, 'gff')))
+        self.assertTrue(os.path.exists(export_fn(self.genome, version, 'gb')))
+        self.assertFalse(os.path.exists(export_fn(self.genome, version, 'fa')))
+        fn = export_fn(inactive, IO(inactive).version(), 'gff')
+        self.assertFalse(os.path.exists(os.path.dirname(fn)))
@@ -1,4 +1,6 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from edge.models import *
 
 
@@ -21,6 +23,17 @@ class FragmentCreateTests(TestCase):
         f = Fragment.create_with_sequence('Foo', s, initial_chunk_size=len(s)*1000)
         self.assertEquals(f.sequence, s)
 
+    def test_number_of_queries_to_create_fragment_does_not_depend_on_number_of_chunks(self):
+        s = 'gataccggtactag'*10
+        with CaptureQueriesContext(connection) as few:
+            f = Fragment.create_with_sequence('Foo', s, initial_chunk_size=len(s)/2)
+        with CaptureQueriesContext(connection) as many:
+            g = Fragment.create_with_sequence('Foo', s, initial_chunk_size=1)
+        self.assertEquals(len(many.captured_queries), len(few.captured_queries))
+        self.assertEquals(len(list(g.chunks())), len(s))
+        self.assertEquals(g.sequence, s)
+        self.assertEquals(Edge.objects.filter(fragment=g).count(), len(s))
+
 
 class FragmentTests(TestCase):
 
@@ -577,6 +590,89 @@ class FragmentTests(TestCase):
         self.assertEquals(bases_visited, 6+len(self.root_sequence))
 
 
+class FragmentApplyEditsTest(TestCase):
+
+    def setUp(self):
+        self.root_sequence = 'agttcgaggctgaattccgtaggcatgcatgcaagctttacgt'
+        self.root = Fragment.create_with_sequence('Foo', self.root_sequence)
+        self.root.annotate(5, 30, 'A1', 'gene', 1)
+
+    def walked_sequence(self, f):
+        f = Fragment.objects.get(pk=f.pk)
+        return ''.join(c.sequence for c in f.chunks_by_walking())
+
+    def check_same_as_one_at_a_time(self, edits):
+        one_by_one = self.root.update('Bar')
+        for e in sorted(edits, key=lambda e: -e['before_base1']):
+            if e.get('length_to_remove', 0) > 0:
+                one_by_one.remove_bases(e['before_base1'], e['length_to_remove'])
+            if len(e.get('sequence', '')) > 0:
+                if e['before_base1'] > len(self.root_sequence):
+                    one_by_one.insert_bases(None, e['sequence'])
+                else:
+                    one_by_one.insert_bases(e['before_base1'], e['sequence'])
+
+        f = self.root.update('Baz')
+        f.apply_edits(edits)
+        f = Fragment.objects.get(pk=f.pk).indexed_fragment()
+        self.assertEquals(f.sequence, one_by_one.sequence)
+        # edges agree with location index
+        self.assertEquals(self.walked_sequence(f), f.sequence)
+        self.assertEquals([(a.base_first, a.base_last, a.feature_base_first, a.feature_base_last)
+                           for a in f.annotations()],
+                          [(a.base_first, a.base_last, a.feature_base_first, a.feature_base_last)
+                           for a in one_by_one.annotations()])
+        # does not affect root
+        self.assertEquals(self.walked_sequence(self.root), self.root_sequence)
+        self.assertEquals(Fragment.objects.get(pk=self.root.pk).indexed_fragment().sequence,
+                          self.root_sequence)
+        return f
+
+    def test_applies_point_mutations(self):
+        f = self.check_same_as_one_at_a_time([
+            dict(before_base1=10, length_to_remove=1, sequence='t'),
+            dict(before_base1=3, length_to_remove=1, sequence='a'),
+            dict(before_base1=20, length_to_remove=1, sequence='c'),
+        ])
+        s = self.root_sequence
+        self.assertEquals(f.sequence, s[0:2]+'a'+s[3:9]+'t'+s[10:19]+'c'+s[20:])
+
+    def test_applies_insertions_and_deletions(self):
+        self.check_same_as_one_at_a_time([
+            dict(before_base1=1, sequence='ggg'),
+            dict(before_base1=4, length_to_remove=3),
+            dict(before_base1=7, sequence='tt'),
+            dict(before_base1=12, length_to_remove=5, sequence='a'),
+            dict(before_base1=len(self.root_sequence)+1, sequence='cc'),
+        ])
+
+    def test_applies_edits_at_start_and_end(self):
+        f = self.check_same_as_one_at_a_time([
+            dict(before_base1=1, length_to_remove=2),
+            dict(before_base1=len(self.root_sequence)-1, length_to_remove=2),
+        ])
+        self.assertEquals(f.sequence, self.root_sequence[2:-2])
+
+    def test_child_of_edited_fragment_inherits_edits(self):
+        f = self.root.update('Bar')
+        f.apply_edits([dict(before_base1=3, length_to_remove=1, sequence='a'),
+                       dict(before_base1=10, sequence='ccc')])
+        child = f.update('Baz')
+        child.insert_bases(None, 'tt')
+        self.assertEquals(self.walked_sequence(child), f.sequence+'tt')
+
+    def test_rejects_overlapping_edits(self):
+        f = self.root.update('Bar')
+        with self.assertRaises(Exception):
+            f.apply_edits([dict(before_base1=3, length_to_remove=3),
+                           dict(before_base1=5, length_to_remove=1, sequence='a')])
+        with self.assertRaises(Exception):
+            f.apply_edits([dict(before_base1=3, sequence='a'), dict(before_base1=3, sequence='t')])
+        with self.assertRaises(Exception):
+            f.apply_edits([dict(before_base1=1, length_to_remove=len(self.root_sequence))])
+        self.assertEquals(f.sequence, self.root_sequence)
+
+
 class FragmentChunkTest(TestCase):
 
     def setUp(self):
@@ -353,3 +353,89 @@ class GenomeTest(TestCase):
                                    [len(s0)+len(s1)+6+1, len(s0)+6+len(s1)+len(s2)+6]])
             else:
                 raise Exception('Unexpected fragment')
+
+
+class GenomeFragmentFingerprintTest(TestCase):
+
+    def test_fingerprint_follows_fragments_of_genome(self):
+        genome = Genome.create('Foo')
+        self.assertEquals(genome.fragment_fingerprint, Genome.fragment_fingerprint_of([]))
+        f1 = genome.add_fragment('chrI', 'atggcatattcgcagct')
+        f2 = genome.add_fragment('chrII', 'atggcatattcgcagct')
+        genome = Genome.objects.get(pk=genome.pk)
+        self.assertEquals(genome.fragment_fingerprint,
+                          Genome.fragment_fingerprint_of([f2.id, f1.id]))
+
+        # saving a stale copy of the genome does not lose fingerprint
+        stale = Genome.objects.get(pk=genome.pk)
+        genome.genome_fragment_set.get(fragment=f2).delete()
+        stale.name = 'Bar'
+        stale.save()
+        self.assertEquals(Genome.objects.get(pk=genome.pk).fragment_fingerprint,
+                          Genome.fragment_fingerprint_of([f1.id]))
+
+    def test_child_genome_has_fingerprint_of_updated_fragments(self):
+        parent = Genome.create('Foo')
+        f1 = parent.add_fragment('chrI', 'atggcatattcgcagct')
+        f2 = parent.add_fragment('chrII', 'atggcatattcgcagct')
+
+        child = parent.update()
+        self.assertEquals(child.fragment_fingerprint,
+                          Genome.fragment_fingerprint_of([f1.id, f2.id]))
+        with child.update_fragment_by_name('chrI') as f:
+            f.insert_bases(3, 'gataca')
+            new_f1 = f
+        child = Genome.objects.get(pk=child.pk)
+        self.assertEquals(child.fragment_fingerprint,
+                          Genome.fragment_fingerprint_of([new_f1.id, f2.id]))
+
+    def test_finds_genomes_with_exact_set_of_fragments(self):
+        g1 = Genome.create('Foo')
+        f1 = g1.add_fragment('chrI', 'atggcatattcgcagct')
+        f2 = g1.add_fragment('chrII', 'atggcatattcgcagct')
+        g2 = g1.update()
+        g3 = Genome.create('Bar')
+        g3.genome_fragment_set.create(fragment=f1, inherited=False)
+
+        self.assertItemsEqual([g.id for g in Genome.with_fragments([f2.id, f1.id])],
+                              [g1.id, g2.id])
+        self.assertItemsEqual([g.id for g in Genome.with_fragments([f1.id])], [g3.id])
+        self.assertItemsEqual([g.id for g in Genome.with_fragments([f2.id])], [])
+
+
+class GenomeChildWithOperationTest(TestCase):
+
+    def setUp(self):
+        self.genome = Genome.create('Foo')
+        self.genome.add_fragment('chrI', 'atggcatattcgcagct')
+
+    def add_child(self, *ops, **kwargs):
+        child = kwargs.get('parent', self.genome).update()
+        for op_type, params in ops:
+            Operation(genome=child, type=op_type, params=params).save()
+        return child
+
+    def test_fingerprint_ignores_order_of_params(self):
+        self.assertEquals(Operation.fingerprint_of(2, '{"guide": "a", "pam": "ngg"}'),
+                          Operation.fingerprint_of(2, '{"pam":"ngg","guide":"a"}'))
+        self.assertNotEquals(Operation.fingerprint_of(2, '{"guide": "a", "pam": "ngg"}'),
+                             Operation.fingerprint_of(1, '{"guide": "a", "pam": "ngg"}'))
+        self.assertNotEquals(Operation.fingerprint_of(4, None),
+                             Operation.fingerprint_of(4, 'null'))
+
+    def test_finds_most_recent_child_created_by_same_operation(self):
+        params = '{"guide": "a", "pam": "ngg"}'
+        c1 = self.add_child((Operation.CRISPR_DSB[0], params))
+        c2 = self.add_child((Operation.CRISPR_DSB[0], params))
+        self.add_child((Operation.CRISPR_DSB[0], '{"guide": "t", "pam": "ngg"}'))
+        self.add_child((Operation.RECOMBINATION[0], params))
+        # children with more than one operation are not considered
+        self.add_child((Operation.CRISPR_DSB[0], params), (Operation.ORF_ANNOTATION[0], '{}'))
+        # nor are grandchildren
+        self.add_child((Operation.CRISPR_DSB[0], params), parent=c1)
+
+        op = Operation(type=Operation.CRISPR_DSB[0], params='{"pam": "ngg", "guide": "a"}')
+        with self.assertNumQueries(1):
+            self.assertEquals(self.genome.child_with_operation(op).id, c2.id)
+        op = Operation(type=Operation.CRISPR_DSB[0], params='{"pam": "ngg", "guide": "c"}')
+        self.assertEquals(self.genome.child_with_operation(op), None)
@@ -47,3 +47,30 @@ Bar\tfeature\tgene\t9\t15\t.\t+\t.\tname=A1
 %s
 """ % (fragment.sequence,)
         self.assertEquals(expected, gff)
+
+    def test_outputs_wrapped_fasta_streamed_by_chunks(self):
+        s = ''.join('agct'[(i*7) % 4] for i in range(150))+'gg'
+        fragment = Fragment.create_with_sequence('Baz', s, initial_chunk_size=7)
+        Genome_Fragment(genome=self.genome, fragment=fragment, inherited=False).save()
+
+        fasta = ''.join(IO(self.genome).fasta_lines())
+        self.assertEquals(fasta, '>Bar\nagttcgaggctga\n>Baz\n%s\n%s\n%s\n'
+                          % (s[0:60], s[60:120], s[120:]))
+
+    def test_streamed_annotations_match_annotations(self):
+        fragment = Fragment.create_with_sequence('Baz', 'agct'*50, initial_chunk_size=7)
+        fragment.annotate(2, 60, 'A1', 'gene', 1)
+        fragment.annotate(10, 30, 'A2', 'gene', -1)
+        fragment.annotate(10, 100, 'A3', 'CDS', 1)
+        fragment.annotate(150, 160, 'A4', 'gene', 1)
+        fragment.insert_bases(20, 'gataca')
+        fragment.remove_bases(50, 3)
+        fragment.annotate(55, 70, 'A5', 'gene', 1)
+
+        def key(a):
+            return (a.base_first, a.base_last, a.feature.name,
+                    a.feature_base_first, a.feature_base_last)
+
+        self.assertEquals([key(a) for a in fragment.iter_annotations()],
+                          [key(a) for a in fragment.annotations()])
+        self.assertEquals(len(list(fragment.iter_annotations())), 10)
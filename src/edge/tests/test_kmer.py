@@ -0,0 +1,171 @@
+import weakref
+from Bio.Seq import Seq
+from django.test import TestCase
+from edge.models import Genome, Fragment, Genome_Fragment, Fragment_Index
+import edge.kmer
+from edge.kmer import find_exact, genome_index, build_genome_index, encode_kmers, Loaded_Indices
+from edge.kmer import genome_index_signature
+
+
+class KmerIndexTest(TestCase):
+
+    def build_genome(self, circular, *sequences):
+        g = Genome(name='Foo')
+        g.save()
+        for seq in sequences:
+            f = Fragment.create_with_sequence('Bar', seq, circular=circular)
+            Genome_Fragment(genome=g, fragment=f, inherited=False).save()
+        build_genome_index(g)
+        return Genome.objects.get(pk=g.id)
+
+    def test_encodes_kmers_and_skips_ambiguous_bases(self):
+        codes, valid = encode_kmers('acgtnacgt', k=2)
+        self.assertEquals(list(codes), [1, 6, 11, 12, 0, 1, 6, 11])
+        self.assertEquals(list(valid), [True, True, True, False, False, True, True, True])
+
+    def test_finds_exact_match_on_forward_strand(self):
+        s1 = 'atcggtatcttctatgcgtatgcgtcatgattatatatattagcggcatg'
+        g = self.build_genome(False, s1)
+        query = s1[6:26]
+        r = find_exact(g, query)
+        self.assertEquals(len(r), 1)
+        self.assertEquals(r[0].fragment_id, g.fragments.all()[0].id)
+        self.assertEquals(r[0].query_start, 1)
+        self.assertEquals(r[0].query_end, 20)
+        self.assertEquals(r[0].subject_start, 7)
+        self.assertEquals(r[0].subject_end, 26)
+        self.assertEquals(r[0].strand(), 1)
+        self.assertEquals(r[0].identity_ratio(), 1.0)
+
+    def test_finds_exact_match_on_reverse_strand(self):
+        s1 = 'atcggtatcttctatgcgtatgcgtcatgattatatatattagcggcatg'
+        g = self.build_genome(False, s1)
+        query = str(Seq(s1[6:26]).reverse_complement())
+        r = find_exact(g, query)
+        self.assertEquals(len(r), 1)
+        self.assertEquals(r[0].subject_start, 26)
+        self.assertEquals(r[0].subject_end, 7)
+        self.assertEquals(r[0].strand(), -1)
+        self.assertEquals(r[0].alignment['subject'], query)
+
+        r = find_exact(g, query, both_strands=False)
+        self.assertEquals(r, [])
+
+    def test_finds_short_query_on_multiple_fragments(self):
+        s1 = 'atcggtatcttctatgcgtatgcgtcatgattatatatattagcggcatg'
+        s2 = 'agcgtcgatgcatgagtcgatcggcagtcgtgtagtcgtcgtatgcgtta'
+        g = Genome(name='Foo')
+        g.save()
+        f1 = Fragment.create_with_sequence('Bar', s1)
+        f2 = Fragment.create_with_sequence('Baz', s2)
+        Genome_Fragment(genome=g, fragment=f1, inherited=False).save()
+        Genome_Fragment(genome=g, fragment=f2, inherited=False).save()
+
+        r = find_exact(g, 'tatgcg', both_strands=False)
+        self.assertItemsEqual([(x.fragment_id, x.subject_start) for x in r],
+                              [(f1.id, 13), (f1.id, 19), (f2.id, 42)])
+
+    def test_finds_match_across_circular_boundary_once(self):
+        s1 = 'atcggtatcttctatgcgtatgcgtcatgattatatatattagcggcatg'
+        s = s1[10:]+s1[0:10]
+        g = self.build_genome(True, s)
+        r = find_exact(g, s1[0:20])
+        self.assertEquals(len(r), 1)
+        self.assertEquals(r[0].subject_start, len(s)-10+1)
+        self.assertEquals(r[0].subject_end, len(s)+10)
+
+    def test_only_finds_full_length_exact_matches(self):
+        s1 = 'atcggtatcttctatgcgtatgcgtcatgattatatatattagcggcatg'
+        g = self.build_genome(False, s1)
+        self.assertEquals(find_exact(g, 'aaaaa'+s1[6:20]), [])
+        self.assertEquals(find_exact(g, s1[6:20]+'c'), [])
+
+    def test_returns_none_for_queries_with_ambiguous_bases(self):
+        s1 = 'atcggtatcttctatgcgtatgcgtcatgattatatatattagcggcatg'
+        g = self.build_genome(False, s1)
+        self.assertEquals(find_exact(g, s1[6:20]+'n'), None)
+
+    def test_rebuilds_index_after_fragment_changes(self):
+        s1 = 'atcggtatcttctatgcgtatgcgtcatgattatatatattagcggcatg'
+        g = self.build_genome(False, s1)
+        index = genome_index(g)
+        self.assertEquals(genome_index(g), index)
+
+        f = g.fragments.all()[0].indexed_fragment()
+        f.insert_bases(10, 'gataccagatac')
+        self.assertNotEqual(genome_index(g), index)
+        r = find_exact(g, 'gataccagatac')
+        self.assertEquals(len(r), 1)
+        self.assertEquals(r[0].subject_start, 10)
+
+    def test_rebuilds_index_after_edits_in_same_second(self):
+        s1 = 'atcggtatcttctatgcgtatgcgtcatgattatatatattagcggcatg'
+        g = self.build_genome(False, s1)
+        f = g.fragments.all()[0].indexed_fragment()
+        f.replace_bases(10, 1, 'g')
+        self.assertEquals(len(find_exact(g, s1[0:9]+'g'+s1[10:20])), 1)
+        signature = genome_index_signature(g)
+
+        # same length edit, with same index timestamp
+        updated_on = Fragment_Index.objects.get(fragment_id=f.id).updated_on
+        f.replace_bases(10, 1, 'c')
+        Fragment_Index.objects.filter(fragment_id=f.id).update(updated_on=updated_on)
+        self.assertNotEqual(genome_index_signature(g), signature)
+        self.assertEquals(find_exact(g, s1[0:9]+'g'+s1[10:20]), [])
+        self.assertEquals(len(find_exact(g, s1[0:9]+'c'+s1[10:20])), 1)
+
+
+class LoadedIndicesTest(TestCase):
+
+    class Index(object):
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    def test_drops_least_recently_used_index(self):
+        indices = Loaded_Indices(2)
+        a, b, c = self.Index(), self.Index(), self.Index()
+        indices.put(1, a)
+        indices.put(2, b)
+        self.assertEquals(indices.get(1), a)
+        indices.put(3, c)
+        self.assertEquals(len(indices), 2)
+        self.assertEquals(indices.get(2), None)
+        self.assertEquals(indices.get(1), a)
+        self.assertEquals(indices.get(3), c)
+        # dropped index may still be in use by another thread
+        self.assertEquals((a.closed, b.closed, c.closed), (False, False, False))
+
+    def test_dropped_index_is_garbage_collected(self):
+        indices = Loaded_Indices(1)
+        a = self.Index()
+        ref = weakref.ref(a)
+        indices.put(1, a)
+        indices.put(1, self.Index())
+        self.assertFalse(a.closed)
+        del a
+        self.assertEquals(ref(), None)
+
+    def test_keeps_bounded_number_of_genome_indices(self):
+        genomes = []
+        for i in range(0, 3):
+            g = Genome(name='Foo')
+            g.save()
+            f = Fragment.create_with_sequence('Bar', 'atcggtatcttctatgcgtatgcgtcatga')
+            Genome_Fragment(genome=g, fragment=f, inherited=False).save()
+            genomes.append(g)
+
+        size = edge.kmer._loaded_indices.size
+        edge.kmer._loaded_indices.size = 2
+        try:
+            first = genome_index(genomes[0])
+            for g in genomes[1:]:
+                genome_index(g)
+            self.assertEquals(len(edge.kmer._loaded_indices), 2)
+            # caller can keep using index after it is evicted
+            self.assertEquals(len(first.find('atcggtatcttcta')), 1)
+            # evicted index is loaded again when needed
+            self.assertEquals(len(find_exact(genomes[0], 'atcggtatcttcta')), 1)
+        finally:
+            edge.kmer._loaded_indices.size = size
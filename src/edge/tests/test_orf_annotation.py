@@ -0,0 +1,122 @@
+import json
+import multiprocessing
+from Bio.Seq import Seq
+from celery.signals import task_prerun, task_postrun
+from django.test import TestCase
+from edge.models import Genome, Fragment, Genome_Fragment, Operation
+from edge.orfs import find_orfs
+from edge.orf_annotation import genome_orfs, annotate_genome_orfs
+
+
+def _genome_orfs_in_worker(genome_id):
+    return dict(genome_orfs(Genome.objects.get(pk=genome_id), processes=2))
+
+
+class OrfAnnotationTest(TestCase):
+
+    def setUp(self):
+        self.orf = 'atg'+'gct'*110+'taa'
+        self.s1 = 'cccc'+self.orf+'cccc'
+        self.s2 = 'gg'+str(Seq(self.orf).reverse_complement())+'cccc'+self.orf+'gg'
+        self.genome = Genome(name='Foo')
+        self.genome.save()
+        for name, s in (('Bar', self.s1), ('Baz', self.s2)):
+            f = Fragment.create_with_sequence(name, s)
+            Genome_Fragment(genome=self.genome, fragment=f, inherited=False).save()
+
+    def test_finds_orfs_on_each_fragment(self):
+        expected = dict((f.id, find_orfs(f.indexed_fragment().sequence))
+                        for f in self.genome.fragments.all())
+        serial = dict(genome_orfs(self.genome, processes=1))
+        parallel = dict(genome_orfs(self.genome, processes=2))
+        self.assertEquals(serial, expected)
+        self.assertEquals(parallel, expected)
+        self.assertEquals(sorted(len(x) for x in serial.values()), [1, 2])
+
+    def test_finds_orfs_in_calling_process_when_in_daemonic_worker(self):
+        expected = dict(genome_orfs(self.genome, processes=1))
+        # like a Celery prefork pool worker, a pool worker is daemonic and
+        # cannot start a pool of its own
+        pool = multiprocessing.Pool(1)
+        try:
+            orfs = pool.apply(_genome_orfs_in_worker, (self.genome.id,))
+        finally:
+            pool.terminate()
+            pool.join()
+        self.assertEquals(orfs, expected)
+
+    def test_annotates_orfs_on_new_versions_of_fragments(self):
+        child = self.genome.update()
+        progress = []
+        n = annotate_genome_orfs(child, processes=2,
+                                 progress=lambda *args: progress.append(args))
+        self.assertEquals(n, 3)
+        self.assertEquals(progress[-1], (2, 2, 3))
+
+        fragments = dict((f.name, f.indexed_fragment()) for f in child.fragments.all())
+        a = fragments['Bar'].annotations()
+        self.assertEquals(len(a), 1)
+        self.assertEquals((a[0].base_first, a[0].base_last), (5, 4+len(self.orf)))
+        self.assertEquals(a[0].feature.type, 'ORF')
+        a = sorted(fragments['Baz'].annotations(), key=lambda x: x.base_first)
+        self.assertEquals([(x.base_first, x.feature.strand) for x in a],
+                          [(3, -1), (3+len(self.orf)+4, 1)])
+        for f in child.fragments.all():
+            self.assertEquals(f.parent.name, f.name)
+
+    def test_orf_annotation_api_creates_annotated_child_genome(self):
+        res = self.client.post('/edge/genomes/%s/orfs/' % self.genome.id,
+                               data=json.dumps(dict(create=False)),
+                               content_type='application/json')
+        self.assertEquals(res.status_code, 200)
+        r = json.loads(res.content)
+        self.assertEquals(sorted((x['fragment_name'], x['orfs']) for x in r),
+                          [('Bar', 1), ('Baz', 2)])
+
+        res = self.client.post('/edge/genomes/%s/orfs/' % self.genome.id,
+                               data=json.dumps(dict(create=True)),
+                               content_type='application/json')
+        self.assertEquals(res.status_code, 201)
+        child = Genome.objects.get(pk=json.loads(res.content)['id'])
+        self.assertEquals(child.parent_id, self.genome.id)
+        op = child.operation_set.all()[0]
+        self.assertEquals(op.type, Operation.ORF_ANNOTATION[0])
+        self.assertEquals(op.feature_set.count(), 3)
+
+        res = self.client.post('/edge/genomes/%s/orfs/' % self.genome.id,
+                               data=json.dumps(dict(create=True)),
+                               content_type='application/json')
+        self.assertEquals(res.status_code, 200)
+        self.assertEquals(json.loads(res.content)['id'], child.id)
+
+    def test_builds_blastdb_of_new_genome_after_annotating_orfs(self):
+        # tasks run eagerly in tests, so a task started by another task runs
+        # while the other task is running
+        running = []
+        builds = []
+
+        def prerun(sender=None, task=None, args=None, **kwargs):
+            if task.name == 'build_genome_blastdb':
+                genome = Genome.objects.get(pk=args[0])
+                builds.append((list(running), genome.id,
+                               genome.genome_fragment_set.filter(inherited=True).count(),
+                               sum(len(f.indexed_fragment().annotations())
+                                   for f in genome.fragments.all())))
+            running.append(task.name)
+
+        def postrun(sender=None, task=None, **kwargs):
+            running.pop()
+
+        task_prerun.connect(prerun)
+        task_postrun.connect(postrun)
+        try:
+            res = self.client.post('/edge/genomes/%s/orfs/' % self.genome.id,
+                                   data=json.dumps(dict(create=True)),
+                                   content_type='application/json')
+            self.assertEquals(res.status_code, 201)
+        finally:
+            task_prerun.disconnect(prerun)
+            task_postrun.disconnect(postrun)
+
+        # built once, by the task annotating ORFs, with new annotated fragments
+        self.assertEquals(builds, [(['annotate_genome_orfs'], json.loads(res.content)['id'], 0, 3)])
@@ -0,0 +1,39 @@
+import random
+from Bio.Seq import Seq
+from django.test import TestCase
+from edge.orfs import find_orfs, detect_orfs_by_translation
+import edge.orfs
+
+
+class FindOrfsTest(TestCase):
+
+    def setUp(self):
+        self.old_min_protein_len = edge.orfs.min_protein_len
+        edge.orfs.min_protein_len = 10
+
+    def tearDown(self):
+        edge.orfs.min_protein_len = self.old_min_protein_len
+
+    def test_finds_same_orfs_as_translating_each_frame(self):
+        rng = random.Random(7)
+        for i in range(50):
+            s = ''.join(rng.choice('acgtACGTn') for j in range(rng.randint(0, 2000)))
+            self.assertEquals(find_orfs(s), detect_orfs_by_translation(s))
+
+    def test_finds_orfs_on_both_strands(self):
+        orf = 'atg'+'gct'*20+'taa'
+        s = 'cc'+orf+'ccc'+str(Seq(orf).reverse_complement())+'c'
+        self.assertEquals(find_orfs(s), [
+            dict(name='ORF frame 3', start=3, end=2+len(orf), strand=1),
+            dict(name='ORF frame 2', start=6+len(orf), end=5+2*len(orf), strand=-1)])
+
+    def test_finds_orf_across_circular_boundary(self):
+        orf = 'atg'+'gct'*20+'taa'
+        s = orf[30:]+'cc'+orf[0:30]
+        self.assertEquals(find_orfs(s), [])
+        self.assertEquals(find_orfs(s, circular=True), [
+            dict(name='ORF frame 3', start=len(s)-30+1, end=len(orf)-30, strand=1)])
+
+        s = str(Seq(s).reverse_complement())
+        self.assertEquals(find_orfs(s, circular=True), [
+            dict(name='ORF frame 3', start=len(s)-(len(orf)-30)+1, end=30, strand=-1)])
@@ -0,0 +1,210 @@
+import json
+from Bio.Seq import Seq
+from django.test import TestCase
+from edge.models import Genome, Fragment, Genome_Fragment
+import edge.pam
+from edge.pam import pam_index, match_pam
+import edge.crispr
+from edge.crispr import CrisprOp, check_crispr_guides
+
+
+class PamIndexTest(TestCase):
+
+    def build_genome(self, circular, *sequences):
+        g = Genome(name='Foo')
+        g.save()
+        for seq in sequences:
+            f = Fragment.create_with_sequence('Bar', seq, circular=circular)
+            Genome_Fragment(genome=g, fragment=f, inherited=False).save()
+        return Genome.objects.get(pk=g.id)
+
+    def test_matches_pam_with_ambiguous_bases(self):
+        self.assertEquals(match_pam('ngg', 'agg'), True)
+        self.assertEquals(match_pam('ngg', 'agc'), False)
+        self.assertEquals(match_pam('tttv', 'tttg'), True)
+        self.assertEquals(match_pam('tttv', 'tttt'), False)
+        self.assertEquals(match_pam('ngg', 'gg'), False)
+
+    def test_finds_protospacers_followed_by_pam_on_both_strands(self):
+        s1 = 'agaaggtctggtagcgatgtagtcgatct'
+        s2 = 'gactaggtacgtagtcgtcaggtcagtca'
+        s = s1+'cgg'+s2+str(Seq(s1+'tgg').reverse_complement())
+        g = self.build_genome(False, s)
+        guide = s1[-20:]
+
+        sites = pam_index(g, 'ngg', 20).find(guide)
+        self.assertEquals(len(sites), 2)
+        self.assertEquals(sites[0]['strand'], 1)
+        self.assertEquals(sites[0]['subject_start'], len(s1)-20+1)
+        self.assertEquals(sites[0]['subject_end'], len(s1))
+        self.assertEquals(sites[1]['strand'], -1)
+        self.assertEquals(sites[1]['subject_start'], len(s)-len(s1)+20)
+        self.assertEquals(sites[1]['subject_end'], len(s)-len(s1)+1)
+
+    def test_does_not_find_protospacer_without_pam(self):
+        s1 = 'agaaggtctggtagcgatgtagtcgatct'
+        s2 = 'gactaggtacgtagtcgtcaggtcagtca'
+        g = self.build_genome(False, s1+'cgc'+s2)
+        self.assertEquals(pam_index(g, 'ngg', 20).find(s1[-20:]), [])
+
+    def test_finds_protospacer_with_pam_across_circular_boundary(self):
+        s1 = 'agaaggtctggtagcgatgtagtcgatct'
+        s2 = 'gactaggtacgtagtcgtcaggtcagtca'
+        g = self.build_genome(True, 'gg'+s2+s1+'c')
+        sites = pam_index(g, 'ngg', 20).find(s1[-20:])
+        self.assertEquals(len(sites), 1)
+        self.assertEquals(sites[0]['subject_start'], 2+len(s2)+len(s1)-20+1)
+        self.assertEquals(sites[0]['subject_end'], 2+len(s2)+len(s1))
+
+    def test_finds_protospacer_preceded_by_upstream_pam(self):
+        s1 = 'agaaggtctggtagcgatgtagtcgatct'
+        s2 = 'gactaggtacgtagtcgtcaggtcagtca'
+        g = self.build_genome(False, s1+'tttc'+s2)
+        index = pam_index(g, 'tttv', 20, pam_upstream=True)
+        sites = index.find(s2[0:20])
+        self.assertEquals(len(sites), 1)
+        self.assertEquals(sites[0]['subject_start'], len(s1)+4+1)
+        self.assertEquals(sites[0]['subject_end'], len(s1)+4+20)
+        self.assertEquals(pam_index(g, 'ngg', 20).find(s2[0:20]), [])
+
+    def test_counts_protospacers_by_number_of_mismatches(self):
+        s1 = 'agaaggtctggtagcgatgtagtcgatct'
+        guide = s1[-20:]
+        one_off = guide[:5]+('a' if guide[5] != 'a' else 'c')+guide[6:]
+        two_off = one_off[:15]+('a' if one_off[15] != 'a' else 'c')+one_off[16:]
+        s = guide+'agg'+'tatata'+one_off+'cgg'+'tatata'+two_off+'tgg'
+        g = self.build_genome(False, s)
+        counts = pam_index(g, 'ngg', 20).count_mismatched(guide, 2)
+        self.assertEquals(counts, [1, 1, 1])
+
+    def test_rebuilds_index_after_fragment_changes(self):
+        s1 = 'agaaggtctggtagcgatgtagtcgatct'
+        s2 = 'gactaggtacgtagtcgtcaggtcagtca'
+        g = self.build_genome(False, s1+'cgc'+s2)
+        guide = s1[-20:]
+        self.assertEquals(pam_index(g, 'ngg', 20).find(guide), [])
+
+        f = g.fragments.all()[0].indexed_fragment()
+        f.insert_bases(len(s1)+3, 'g')
+        self.assertEquals(len(pam_index(g, 'ngg', 20).find(guide)), 1)
+
+    def test_keeps_bounded_number_of_pam_indices(self):
+        s1 = 'agaaggtctggtagcgatgtagtcgatctcgg'
+        g = self.build_genome(False, s1)
+        size = edge.pam._loaded_indices.size
+        edge.pam._loaded_indices.size = 2
+        try:
+            for length in (18, 19, 20):
+                self.assertEquals(len(pam_index(g, 'ngg', length).find(s1[-3-length:-3])), 1)
+            self.assertEquals(len(edge.pam._loaded_indices), 2)
+            self.assertEquals(len(pam_index(g, 'ngg', 18).find(s1[-21:-3])), 1)
+        finally:
+            edge.pam._loaded_indices.size = size
+
+    def test_check_accepts_list_of_guides(self):
+        s1 = 'agaaggtctggtagcgatgtagtcgatct'
+        s2 = 'gactaggtacgtagtcgtcaggtcagtca'
+        g = self.build_genome(False, s1+'cgg'+s2+'agg')
+        guides = [s1[-20:], s2[-20:], s2[0:20]]
+        targets = CrisprOp.check(g, guides, 'ngg')
+        self.assertEquals([(t.guide, t.subject_start) for t in targets],
+                          [(guides[0], len(s1)-20+1), (guides[1], len(s1)+3+len(s2)-20+1)])
+
+    def test_checks_guides_with_upstream_pam(self):
+        s1 = 'agaaggtctggtagcgatgtagtcgatct'
+        s2 = 'gactaggtacgtagtcgtcaggtcagtcaggactcatcg'
+        g = self.build_genome(False, s1+'tttc'+s2+'gaaacc')
+        first = len(s1)+4+1
+        last = first+len(s2)-1
+        # guides longer than PAM index protospacers are found using k-mer index
+        guides = [s2[0:20], s2[0:35], str(Seq(s2[-20:]).reverse_complement()),
+                  str(Seq(s2[-35:]).reverse_complement())]
+
+        targets = CrisprOp.check(g, guides, 'tttv', pam_upstream=True)
+        self.assertEquals([(t.guide, t.strand, t.subject_start, t.subject_end) for t in targets],
+                          [(guides[0], 1, first, first+19), (guides[1], 1, first, first+34),
+                           (guides[2], -1, last, last-19), (guides[3], -1, last, last-34)])
+        self.assertEquals(CrisprOp.check(g, guides, 'tttv'), [])
+
+        r = CrisprOp.check_many(g, guides, 'tttv', max_mismatches=1, pam_upstream=True)
+        self.assertEquals([len(x.targets) for x in r], [1, 1, 1, 1])
+        self.assertEquals([x.off_targets for x in r], [[0], None, [0], None])
+
+        data = dict(guides=guides[0:1], pam='tttv', pam_upstream=True)
+        res = self.client.post('/edge/genomes/%s/crispr/guides/' % g.id,
+                               data=json.dumps(data), content_type='application/json')
+        self.assertEquals(res.status_code, 200)
+        self.assertEquals(json.loads(res.content)[0]['targets'][0]['subject_start'], first)
+
+    def test_records_upstream_pam_in_operation(self):
+        op = CrisprOp.get_operation('gactaggtacgtagtcgtca', 'ngg')
+        self.assertEquals(json.loads(op.params), dict(guide='gactaggtacgtagtcgtca', pam='ngg'))
+        op = CrisprOp.get_operation('gactaggtacgtagtcgtca', 'tttv', pam_upstream=True)
+        self.assertEquals(json.loads(op.params),
+                          dict(guide='gactaggtacgtagtcgtca', pam='tttv', pam_upstream=True))
+
+
+class CrisprCheckManyTest(TestCase):
+
+    def setUp(self):
+        self.s1 = 'agaaggtctggtagcgatgtagtcgatct'
+        self.s2 = 'gactaggtacgtagtcgtcaggtcagtca'
+        guide = self.s1[-20:]
+        self.one_off = guide[:5]+('a' if guide[5] != 'a' else 'c')+guide[6:]
+        self.genome = Genome(name='Foo')
+        self.genome.save()
+        s = self.s1+'cgg'+self.s2+'tatata'+self.one_off+'tgg'
+        f = Fragment.create_with_sequence('Bar', s)
+        Genome_Fragment(genome=self.genome, fragment=f, inherited=False).save()
+
+    def test_returns_targets_and_off_target_counts_per_guide(self):
+        guides = [self.s1[-20:], self.s2[0:20], self.s1[-20:]]
+        r = CrisprOp.check_many(self.genome, guides, 'ngg', max_mismatches=2)
+        self.assertEquals([x.guide for x in r], guides[0:2])
+        self.assertEquals(len(r[0].targets), 1)
+        self.assertEquals(r[0].targets[0].subject_start, len(self.s1)-20+1)
+        self.assertEquals(r[0].targets[0].guide, guides[0])
+        self.assertEquals(r[0].off_targets, [1, 0])
+        self.assertEquals(r[1].targets, [])
+
+    def test_looks_up_pam_index_once_per_guide_length(self):
+        guides = [self.s1[-20:], self.one_off, self.s2[0:18]]+[self.s2[i:i+20] for i in range(10)]
+        lengths = []
+
+        def counted_pam_index(genome, pam, length, **kwargs):
+            lengths.append(length)
+            return pam_index(genome, pam, length, **kwargs)
+
+        edge.crispr.pam_index = counted_pam_index
+        try:
+            r = check_crispr_guides(self.genome, guides, 'ngg')
+            self.assertEquals(sorted(lengths), [18, 20])
+            del lengths[:]
+            targets = edge.crispr.find_crispr_targets(self.genome, guides, 'ngg')
+            self.assertEquals(sorted(lengths), [18, 20])
+        finally:
+            edge.crispr.pam_index = pam_index
+        self.assertEquals([x.guide for x in r], guides)
+        self.assertEquals(r[1].off_targets, [1, 0, 0])
+        self.assertEquals([[t.to_dict() for t in x.targets] for x in r],
+                          [[t.to_dict() for t in targets[g]] for g in guides])
+
+    def test_rejects_invalid_number_of_mismatches(self):
+        guides = [self.s1[-20:], self.s2[0:18]]
+        self.assertEquals(len(check_crispr_guides(self.genome, guides, 'ngg',
+                                                  max_mismatches=20)), 2)
+        for n in (-1, 21, 10**9):
+            self.assertRaises(Exception, check_crispr_guides, self.genome, guides, 'ngg',
+                              max_mismatches=n)
+
+    def test_batch_api_works(self):
+        guides = [self.s1[-20:], self.s2[0:20]]
+        data = dict(guides=guides, pam='ngg', max_mismatches=1)
+        res = self.client.post('/edge/genomes/%s/crispr/guides/' % self.genome.id,
+                               data=json.dumps(data), content_type='application/json')
+        self.assertEquals(res.status_code, 200)
+        r = json.loads(res.content)
+        self.assertEquals([x['guide'] for x in r], guides)
+        self.assertEquals(len(r[0]['targets']), 1)
+        self.assertEquals(r[0]['off_targets'], [1])
+        self.assertEquals(r[1]['targets'], [])
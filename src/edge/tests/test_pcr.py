@@ -3,7 +3,8 @@ import os
 import json
 from Bio.Seq import Seq
 from django.test import TestCase
-from edge.pcr import pcr_from_genome
+from edge.pcr import pcr_from_genome, pcr_many, compute_pcr_product, amplicon_candidates
+from edge.blast import Blast_Result, Blast_Result_Context
 from edge.models import Genome, Fragment, Genome_Fragment
 from edge.blastdb import build_all_genome_dbs, fragment_fasta_fn
 
@@ -249,3 +250,134 @@ class GenomePcrTest(TestCase):
         self.assertEquals(d[2][0]['subject_end'], len(template)-len(downstream)-len(p2_bs)+1)
         self.assertEquals(d[2][0]['query_start'], len(p2)-len(p2_bs)+1)
         self.assertEquals(d[2][0]['query_end'], len(p2))
+
+    def test_pcr_many_computes_product_for_each_primer_pair(self):
+        upstream = "gagattgtccgcgtttt"
+        p1_bs = "catagcgcacaggacgcggag"
+        middle = "cggcacctgtgagccg"
+        p2_bs = "taatgaccccgaagcagg"
+        downstream = "gttaaggcgcgaacat"
+        template = ''.join([upstream, p1_bs, middle, p2_bs, downstream])
+        p1 = 'aaaaaaaaaa'+p1_bs
+        p2 = 'tttttttttt'+str(Seq(p2_bs).reverse_complement())
+        g = self.build_genome(False, template)
+
+        r = pcr_many(g, [(p1, p2), (p2, p1), (p1, p1)])
+        self.assertEquals(len(r), 3)
+        self.assertEquals(r[0][0], ''.join([p1, middle, str(Seq(p2).reverse_complement())]))
+        self.assertEquals(r[0][3]['region'], (len(upstream)+1, len(upstream+p1_bs+middle+p2_bs)))
+        self.assertEquals(r[1][0], r[0][0])
+        self.assertEquals(r[1][3]['region'], r[0][3]['region'])
+        self.assertEquals(r[2][0], None)
+        self.assertEquals(len(r[2][1]), 1)
+
+    def test_pcr_batch_api(self):
+        upstream = "gagattgtccgcgtttt"
+        p1_bs = "catagcgcacaggacgcggag"
+        middle = "cggcacctgtgagccg"
+        p2_bs = "taatgaccccgaagcagg"
+        downstream = "gttaaggcgcgaacat"
+        template = ''.join([upstream, p1_bs, middle, p2_bs, downstream])
+        p1 = 'aaaaaaaaaa'+p1_bs
+        p2 = 'tttttttttt'+str(Seq(p2_bs).reverse_complement())
+        g = self.build_genome(False, template)
+
+        res = self.client.post('/edge/genomes/%s/pcr/batch/' % g.id,
+                               data=json.dumps(dict(primer_pairs=[[p1, p2], [p1, p1]])),
+                               content_type='application/json')
+        self.assertEquals(res.status_code, 200)
+        d = json.loads(res.content)
+        self.assertEquals(len(d), 2)
+        self.assertEquals(d[0][0], ''.join([p1, middle, str(Seq(p2).reverse_complement())]))
+        self.assertEquals(d[1][0], None)
+
+
+class AmpliconCandidatesTest(TestCase):
+
+    def binding_site(self, fragment, subject_start, subject_end):
+        return Blast_Result(fragment_id=fragment.id, subject_start=subject_start,
+                            subject_end=subject_end)
+
+    def brute_force(self, fwd_results, rev_results, context):
+        # pairs producing a product, checked the slow way
+        pairs = []
+        for fwd in fwd_results:
+            for rev in rev_results:
+                fragment = context.fragment(fwd.fragment_id)
+                if fwd.fragment_id != rev.fragment_id:
+                    continue
+                if fragment.circular is False and fwd.subject_end >= rev.subject_end:
+                    continue
+                lo = fragment.circ_bp(fwd.subject_end+1)
+                hi = fragment.circ_bp(rev.subject_end-1)
+                size = hi-lo+1 if lo <= hi or fragment.circular is False \
+                    else fragment.length-lo+1+hi
+                if size <= 50000:
+                    pairs.append((fwd.subject_end, rev.subject_end))
+        return sorted(pairs)
+
+    def check_sites(self, fragment, fwd_ends, rev_ends):
+        fwd = [self.binding_site(fragment, e-9, e) for e in fwd_ends]
+        rev = [self.binding_site(fragment, e+9, e) for e in rev_ends]
+        context = Blast_Result_Context()
+        found = sorted((a.subject_end, b.subject_end)
+                       for a, b in amplicon_candidates(fwd, rev, context))
+        self.assertEquals(found, self.brute_force(fwd, rev, context))
+        return found
+
+    def test_finds_same_candidates_as_cross_product_on_linear_fragment(self):
+        f = Fragment.create_with_sequence('Bar', 'a'*120000)
+        found = self.check_sites(f, [20, 1000, 60000, 60100], [21, 22, 500, 50021, 50022, 110100])
+        self.assertEquals(found, [(20, 21), (20, 22), (20, 500), (20, 50021), (1000, 50021),
+                                  (1000, 50022), (60100, 110100)])
+
+    def test_finds_same_candidates_as_cross_product_on_circular_fragment(self):
+        f = Fragment.create_with_sequence('Bar', 'a'*120000, circular=True)
+        found = self.check_sites(f, [20, 100000, 119990, 120005],
+                                 [10, 500, 30000, 50021, 100010, 119995, 120010])
+        self.assertIn((100000, 10), found)
+        self.assertIn((120005, 10), found)
+        self.assertNotIn((20, 10), found)
+
+
+class PcrBlastResultContextTest(TestCase):
+
+    def blast_result(self, fragment, query, query_start, subject_start, subject_end):
+        aligned = query[query_start-1:]
+        return Blast_Result(fragment_id=fragment.id,
+                            fragment_length=fragment.indexed_fragment().length,
+                            hit_def=fragment.name,
+                            query_start=query_start,
+                            query_end=len(query),
+                            subject_start=subject_start,
+                            subject_end=subject_end,
+                            evalue=0.0,
+                            alignment=dict(query=aligned, match='|'*len(aligned),
+                                           matchi=' '*len(aligned), subject=aligned))
+
+    def test_computes_pcr_products_from_context_with_one_query_per_product(self):
+        upstream = "gagattgtccgcgtttt"
+        p1_bs = "catagcgcacaggacgcggag"
+        middle = "cggcacctgtgagccg"
+        p2_bs = "taatgaccccgaagcagg"
+        downstream = "gttaaggcgcgaacat"
+        template = ''.join([upstream, p1_bs, middle, p2_bs, downstream])
+        p1 = 'aaaaaaaaaa'+p1_bs
+        p2 = 'tttttttttt'+str(Seq(p2_bs).reverse_complement())
+        f = Fragment.create_with_sequence('Bar', template)
+
+        a = self.blast_result(f, p1, 11, len(upstream)+1, len(upstream+p1_bs))
+        b = self.blast_result(f, p2, 11, len(upstream+p1_bs+middle+p2_bs),
+                              len(upstream+p1_bs+middle)+1)
+
+        context = Blast_Result_Context()
+        with self.assertNumQueries(1):
+            context.load([a], [b])
+
+        # only query left is fetching sequence between primers
+        for i in range(3):
+            with self.assertNumQueries(1):
+                product = compute_pcr_product(p1, a, p2, b, context=context)
+            self.assertEquals(product[0], ''.join([p1, middle, str(Seq(p2).reverse_complement())]))
+            self.assertEquals(product[1]['region'],
+                              (len(upstream)+1, len(upstream+p1_bs+middle+p2_bs)))
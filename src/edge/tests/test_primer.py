@@ -1,7 +1,10 @@
 import os
+import tempfile
 from Bio.Seq import Seq
 from django.test import TestCase
-from edge.primer import design_primers, design_primers_from_template
+from edge.primer import design_primers, design_primers_from_template, design_primers_many
+from edge.primer import Primer3_Process, Primer3_Cache, primer3_record, primer3_template_opts
+import edge.primer
 from edge.models import Genome, Fragment, Genome_Fragment
 from edge.pcr import pcr_from_genome
 from edge.blastdb import build_all_genome_dbs, fragment_fasta_fn
@@ -60,3 +63,97 @@ class DesignPrimerTest(TestCase):
             self.assertEquals(r['PRIMER_RIGHT_SEQUENCE_DISTANCE_TO_JUNCTION'] >= WIN, True)
             self.assertEquals(template.lower().index(right.lower()) -
                               r['PRIMER_RIGHT_SEQUENCE_DISTANCE_TO_JUNCTION'], junctions[1])
+
+
+class Primer3ProcessTest(TestCase):
+
+    upstream = "cagtacgatcgttggtatgctgactactagcgtagctagcacgtcgtgtccaggcttgagcgacgt"
+    product = "cagctggtaatcgtactcgtactagcatcgtacgtgtctgatcatctgacgtatcatctga"
+    downstream = "agtgacgtcgtgtgtagcgtactgtatcgtgtgtcgcgcgtagtcatctgatcgtacgtactgaat"
+
+    def test_streams_many_records_through_one_process(self):
+        template = ''.join([self.upstream, self.product, self.downstream])
+        opts = primer3_template_opts(template, len(self.upstream)+1, len(self.product), {})
+        process = Primer3_Process()
+        try:
+            r = process.run_many([primer3_record(opts)]*20)
+            self.assertEquals(len(r), 20)
+            self.assertEquals(r[0]['PRIMER_LEFT_NUM_RETURNED'], '5')
+            self.assertEquals(all(x == r[0] for x in r), True)
+            # process stays up for more records
+            self.assertEquals(process.is_alive(), True)
+            self.assertEquals(process.run_many([primer3_record(opts)]), r[0:1])
+        finally:
+            process.close()
+        self.assertEquals(process.is_alive(), False)
+
+    def test_designs_primers_for_many_templates(self):
+        t1 = ''.join([self.upstream, self.product, self.downstream])
+        t2 = ''.join([self.downstream, self.product, self.upstream])
+        templates = [(t1, len(self.upstream)+1, len(self.product), None, {}),
+                     (t2, len(self.downstream)+1, len(self.product), None,
+                      dict(PRIMER_OPT_SIZE=22)),
+                     (t1, len(self.upstream)+1, len(self.product), [len(self.upstream)], {})]
+        res = design_primers_many(templates)
+        self.assertEquals(len(res), 3)
+        # primer3 results are not cached in tests, so compares with primers
+        # from separate primer3 runs
+        self.assertEquals(edge.primer.primer3_cache, None)
+        for args, primers in zip(templates, res):
+            self.assertEquals(primers, design_primers_from_template(*args))
+        self.assertNotEqual(res[0], res[1])
+        self.assertEquals('PRIMER_LEFT_SEQUENCE_DISTANCE_TO_JUNCTION' in res[0][0], False)
+        self.assertEquals('PRIMER_LEFT_SEQUENCE_DISTANCE_TO_JUNCTION' in res[2][0], True)
+
+
+class Primer3CacheTest(TestCase):
+
+    def setUp(self):
+        self.old_cache = edge.primer.primer3_cache
+        self.cache = Primer3_Cache(tempfile.mkdtemp(), 3)
+        edge.primer.primer3_cache = self.cache
+
+    def tearDown(self):
+        self.cache.clear()
+        edge.primer.primer3_cache = self.old_cache
+
+    def test_reuses_primers_designed_with_same_template_and_options(self):
+        upstream = "cagtacgatcgttggtatgctgactactagcgtagctagcacgtcgtgtccaggcttgagcgacgt"
+        product = "cagctggtaatcgtactcgtactagcatcgtacgtgtctgatcatctgacgtatcatctga"
+        downstream = "agtgacgtcgtgtgtagcgtactgtatcgtgtgtcgcgcgtagtcatctgatcgtacgtactgaat"
+        template = ''.join([upstream, product, downstream])
+        junctions = [len(upstream)+1]
+
+        r1 = design_primers_from_template(template, len(upstream)+1, len(product), junctions, {})
+        self.assertEquals(len(r1), 5)
+        self.assertEquals(len(self.cache.entries()), 1)
+        r2 = design_primers_from_template(template, len(upstream)+1, len(product), junctions, {})
+        self.assertEquals(r1, r2)
+        self.assertEquals(len(self.cache.entries()), 1)
+
+        # primers come from the cache entry, not from primer3
+        opts = primer3_template_opts(template, len(upstream)+1, len(product), {})
+        self.cache.put(opts, [])
+        r3 = design_primers_from_template(template, len(upstream)+1, len(product), junctions, {})
+        self.assertEquals(r3, [])
+
+        # different primer3 option is a different entry
+        r4 = design_primers_from_template(template, len(upstream)+1, len(product), junctions,
+                                          dict(PRIMER_OPT_SIZE=22))
+        self.assertEquals(len(r4), 5)
+        self.assertEquals(len(self.cache.entries()), 2)
+
+    def test_evicts_least_recently_used_entries(self):
+        opts = [dict(SEQUENCE_TEMPLATE=c*10) for c in 'acgt']
+        for i, o in enumerate(opts):
+            before = set(self.cache.entries())
+            self.cache.put(o, [dict(i=i)])
+            fn = list(set(self.cache.entries())-before)[0]
+            os.utime(fn, (1000+i, 1000+i))
+
+        # using oldest entry makes it most recently used
+        self.assertEquals(self.cache.get(opts[0]), [dict(i=0)])
+        self.cache.evict()
+        self.assertEquals(len(self.cache.entries()), 3)
+        self.assertEquals(self.cache.get(opts[1]), None)
+        self.assertEquals(self.cache.get(opts[0]), [dict(i=0)])
@@ -3,6 +3,8 @@ import json
 from Bio.Seq import Seq
 from django.test import TestCase
 from edge.recombine import find_swap_region, recombine, remove_overhangs
+from edge.recombine import compute_swap_region_from_results
+from edge.blast import Blast_Result, Blast_Result_Context
 from edge.models import Genome, Fragment, Genome_Fragment, Operation
 from edge.blastdb import build_all_genome_dbs, fragment_fasta_fn
 import edge.recombine
@@ -882,3 +884,84 @@ class SingleCrossoverTest(TestCase):
         self.assertNotEqual(g.id, c.id)
         self.assertEquals(c.fragments.all()[0].indexed_fragment().sequence,
                           ''.join([upstream, locus, insertion, locus, downstream]))
+
+
+class SwapRegionBlastResultContextTest(TestCase):
+
+    def blast_result(self, fragment, query, subject_start, subject_end):
+        return Blast_Result(fragment_id=fragment.id,
+                            fragment_length=len(fragment.indexed_fragment().sequence),
+                            hit_def=fragment.name,
+                            query_start=1,
+                            query_end=len(query),
+                            subject_start=subject_start,
+                            subject_end=subject_end,
+                            evalue=0.0,
+                            alignment=dict(query=query, match='|'*len(query),
+                                           matchi=' '*len(query), subject=query))
+
+    def test_computes_swap_region_from_context_with_one_query_per_region(self):
+        upstream = "gagattgtccgcgtttt"
+        front_bs = "catagcgcacaggacgcggag"
+        middle = "cggcacctgtgagccg"
+        back_bs = "taatgaccccgaagcagg"
+        downstream = "gttaaggcgcgaacat"
+        replaced = "aaaaaaaaaaaaaaaaaaa"
+
+        template = ''.join([upstream, front_bs, middle, back_bs, downstream])
+        cassette = ''.join([front_bs, replaced, back_bs])
+        f = Fragment.create_with_sequence('Bar', template)
+
+        a = self.blast_result(f, front_bs, len(upstream)+1, len(upstream+front_bs))
+        b = self.blast_result(f, back_bs, len(upstream+front_bs+middle)+1,
+                              len(upstream+front_bs+middle+back_bs))
+
+        context = Blast_Result_Context().load([a, b])
+        with self.assertNumQueries(1):
+            r = compute_swap_region_from_results(front_bs, a, back_bs, b, cassette,
+                                                 context=context)
+        self.assertEquals(r.fragment_id, f.id)
+        self.assertEquals(r.start, len(upstream)+1)
+        self.assertEquals(r.end, len(template)-len(downstream))
+        self.assertEquals(r.sequence, ''.join([front_bs, middle, back_bs]))
+
+
+class VerificationPrimersTest(TestCase):
+
+    def setUp(self):
+        self.pcr_many_calls = []
+        self.old_pcr_many = edge.recombine.pcr_many
+
+        def pcr_many(genome, primer_pairs):
+            self.pcr_many_calls.append(primer_pairs)
+            return self.old_pcr_many(genome, primer_pairs)
+
+        edge.recombine.pcr_many = pcr_many
+
+    def tearDown(self):
+        edge.recombine.pcr_many = self.old_pcr_many
+
+    def test_screens_primers_of_all_regions_in_one_batch(self):
+        upstream = "cagtacgatcgttggtatgctgactactagcgtagctagcacgtcgtgtccaggcttgagcgacgt"*4
+        replaced = "cagctggtaatcgtactcgtactagcatcgtacgtgtctgatcatctgacgtatcatctga"
+        downstream = "agtgacgtcgtgtgtagcgtactgtatcgtgtgtcgcgcgtagtcatctgatcgtacgtactgaat"*4
+        cassette = "tggcactagtcgatgcgtgatgcgtagtcgtacgtcagtcgtgatgtcgatgcatgagtcgta"*4
+
+        g = Genome(name='Foo')
+        g.save()
+        regions = []
+        for i in range(2):
+            f = Fragment.create_with_sequence('Bar', upstream+replaced+downstream)
+            Genome_Fragment(genome=g, fragment=f, inherited=False).save()
+            regions.append(edge.recombine.RecombinationRegion(
+                f.id, f.name, len(upstream)+1, len(upstream+replaced), replaced,
+                cassette, False, cassette[0:20], cassette[-20:]))
+
+        edge.recombine.get_verification_primers_many(g, regions, {})
+        self.assertEquals(len(self.pcr_many_calls), 1)
+        for region in regions:
+            self.assertEquals(len(region.verification_front), 5)
+            self.assertEquals(len(region.verification_back), 5)
+            self.assertEquals(len(region.verification_cassette), 5)
+        # front and back junction primers are screened
+        self.assertEquals(len(self.pcr_many_calls[0]), 2*2*5)
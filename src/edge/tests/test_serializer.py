@@ -0,0 +1,45 @@
+import json
+from django.test import TestCase
+from edge.models import Fragment
+from edge.serializer import RawJSON, json_chunks, to_json
+
+
+class SerializerTest(TestCase):
+
+    def test_encodes_like_json(self):
+        obj = [dict(a=1, b=[1, 2, dict(c=None, d=u'\u00e9')], e={}, f=[]),
+               (1.5, 'x'), {1: 'one', None: [True]}, [], {}, 'y']
+        self.assertEquals(json.loads(to_json(obj)), json.loads(json.dumps(obj)))
+
+    def test_splices_raw_json(self):
+        obj = dict(a=1, q=RawJSON('{"note": ["x"]}'), l=[RawJSON('null'), 2])
+        self.assertEquals(json.loads(to_json(obj)), dict(a=1, q=dict(note=['x']), l=[None, 2]))
+        self.assertEquals(to_json([RawJSON(u'[]')]), '[[]]')
+
+    def test_chunks_output(self):
+        obj = [dict(a=i, q=RawJSON('{"x": 1}')) for i in range(0, 1000)]
+        chunks = list(json_chunks(obj, batch_size=30))
+        self.assertEquals(len(chunks), 36)
+        self.assertEquals(''.join(chunks), to_json(obj))
+        self.assertEquals(''.join(json_chunks([])), '[]')
+        self.assertEquals(''.join(json_chunks(dict(a=1))), '{"a": 1}')
+
+
+class StreamingResponseTest(TestCase):
+
+    def test_streams_long_lists(self):
+        fragment = Fragment.create_with_sequence('Foo', 'agttcgaggctga'*200)
+        fragment.indexed_fragment().annotate_many([
+            dict(first_base1=i*2+1, last_base1=i*2+1, name='F%s' % (i,), type='feature',
+                 strand=1, qualifiers=dict(n=i)) for i in range(0, 1200)])
+
+        res = self.client.get('/edge/fragments/%s/annotations/' % (fragment.id,))
+        self.assertEquals(res.status_code, 200)
+        self.assertTrue(res.streaming)
+        annotations = json.loads(''.join(res.streaming_content))
+        self.assertEquals(len(annotations), 1200)
+        self.assertEquals(annotations[5]['qualifiers'], dict(n=5))
+
+        res = self.client.get('/edge/fragments/%s/annotations/?limit=10' % (fragment.id,))
+        self.assertFalse(res.streaming)
+        self.assertEquals(len(json.loads(res.content)), 10)
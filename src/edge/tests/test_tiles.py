@@ -0,0 +1,100 @@
+import os
+import json
+import shutil
+import tempfile
+from django.test import TestCase
+from django.test.utils import override_settings
+from edge.models import Fragment
+from edge.tiles import TILE_BINS, fragment_tile, fragment_version, fragment_tile_dir
+
+
+class FragmentTileTest(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.settings_override = override_settings(TILE_CACHE_DIR=self.tmpdir)
+        self.settings_override.enable()
+
+        # 1024 bps, first half all GC, second half all AT
+        self.fragment = Fragment.create_with_sequence('Bar', 'gc'*256+'at'*256)
+        self.fragment.annotate(1, 8, 'A1', 'gene', 1)
+        self.fragment.annotate(5, 600, 'A2', 'gene', -1)
+        self.fragment.annotate(1000, 1024, 'A3', 'gene', 1)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.tmpdir)
+
+    def test_summarizes_fragment_in_bins(self):
+        tile = fragment_tile(self.fragment, 0, 0)
+        self.assertEquals(tile['tiles'], 1)
+        self.assertEquals(tile['bin_size'], 4)
+        self.assertEquals(len(tile['feature_density']), TILE_BINS)
+        self.assertEquals(tile['feature_density'][0:3], [1, 2, 1])
+        self.assertEquals(tile['feature_density'][150], 0)
+        self.assertEquals(tile['feature_density'][-1], 1)
+        self.assertEquals(tile['gc_content'][0], 1.0)
+        self.assertEquals(tile['gc_content'][-1], 0.0)
+        self.assertEquals([f['name'] for f in tile['features']], ['A2', 'A3', 'A1'])
+        self.assertEquals(tile['features'][0],
+                          dict(base_first=5, base_last=600, name='A2', type='gene', strand=-1))
+
+    def test_tiles_at_higher_zoom_cover_part_of_fragment(self):
+        tile = fragment_tile(self.fragment, 1, 1)
+        self.assertEquals(tile['tiles'], 2)
+        self.assertEquals(tile['bin_size'], 2)
+        self.assertEquals((tile['base_first'], tile['base_last']), (513, 1024))
+        self.assertEquals(tile['gc_content'][0], 0.0)
+        self.assertEquals(tile['feature_density'][0:45], [1]*44+[0])
+        self.assertEquals([f['name'] for f in tile['features']], ['A2', 'A3'])
+
+    def test_reuses_tile_until_fragment_changes(self):
+        tile = fragment_tile(self.fragment, 0, 0)
+        version = fragment_version(self.fragment)
+        fn = '%s/z0-t0.json' % (fragment_tile_dir(self.fragment, version),)
+        self.assertTrue(os.path.exists(fn))
+        with open(fn, 'w') as f:
+            json.dump(dict(cached=True), f)
+        self.assertEquals(fragment_tile(self.fragment, 0, 0), dict(cached=True))
+
+        self.fragment.annotate(300, 310, 'A4', 'gene', 1)
+        new_tile = fragment_tile(self.fragment, 0, 0)
+        self.assertEquals(new_tile['feature_density'][75], tile['feature_density'][75]+1)
+        # tiles of old version are removed
+        self.assertFalse(os.path.exists(os.path.dirname(fn)))
+
+        self.fragment.insert_bases(1, 'aaaa')
+        self.fragment = Fragment.objects.get(pk=self.fragment.pk).indexed_fragment()
+        tile = fragment_tile(self.fragment, 0, 0)
+        self.assertEquals(tile['base_last'], 1028)
+        self.assertEquals(tile['bin_size'], 5)
+        # first bin is aaaag
+        self.assertEquals(tile['gc_content'][0], 0.2)
+
+
+class FragmentTilesViewTest(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.settings_override = override_settings(TILE_CACHE_DIR=self.tmpdir)
+        self.settings_override.enable()
+        self.fragment = Fragment.create_with_sequence('Bar', 'agttcgaggctga'*100)
+        self.fragment.annotate(3, 20, 'A1', 'gene', 1)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.tmpdir)
+
+    def test_returns_tile(self):
+        res = self.client.get('/edge/fragments/%s/tiles/?zoom=2&tile=0' % self.fragment.id)
+        self.assertEquals(res.status_code, 200)
+        tile = json.loads(res.content)
+        self.assertEquals(tile['tiles'], 3)
+        self.assertEquals(tile['bin_size'], 2)
+        self.assertEquals(tile['features'][0]['name'], 'A1')
+
+    def test_returns_404_for_tile_not_on_fragment(self):
+        res = self.client.get('/edge/fragments/%s/tiles/?zoom=2&tile=3' % self.fragment.id)
+        self.assertEquals(res.status_code, 404)
+        res = self.client.get('/edge/fragments/%s/tiles/?zoom=-1' % self.fragment.id)
+        self.assertEquals(res.status_code, 404)
@@ -0,0 +1,167 @@
+import json
+import shutil
+import tempfile
+from celery.signals import task_prerun, task_postrun
+from django.test import TestCase
+from django.test.utils import override_settings
+from edge.models import Genome, Fragment, Genome_Fragment, Operation
+from edge.variants import parse_vcf, apply_genome_variants, overlapping_variants
+
+
+class VariantTest(TestCase):
+
+    def setUp(self):
+        self.s1 = 'agttcgaggctga'
+        self.s2 = 'ttgacacgatcgg'
+        self.genome = Genome(name='Foo')
+        self.genome.save()
+        for name, s in (('chrI', self.s1), ('chrII', self.s2)):
+            f = Fragment.create_with_sequence(name, s)
+            Genome_Fragment(genome=self.genome, fragment=f, inherited=False).save()
+        self.vcf = '\n'.join(['##fileformat=VCFv4.2',
+                              '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO',
+                              'chrI\t2\t.\tG\tC\t.\tPASS\t.',
+                              'chrI\t5\tdel1\tCGA\tC\t.\tPASS\t.',
+                              'chrI\t9\t.\tG\tA\t.\tLowQual\t.',
+                              'chrI\t11\t.\tT\t<DEL>\t.\tPASS\t.',
+                              'chrII\t3\t.\tG\tGAAA,T\t.\t.\t.'])
+
+    def test_parses_vcf_skipping_filtered_and_symbolic_variants(self):
+        variants = list(parse_vcf(self.vcf.splitlines()))
+        self.assertEquals([(v['chrom'], v['pos'], v['id'], v['ref'], v['alt']) for v in variants],
+                          [('chrI', 2, None, 'g', 'c'),
+                           ('chrI', 5, 'del1', 'cga', 'c'),
+                           ('chrII', 3, None, 'g', 'gaaa')])
+
+    def test_applies_and_annotates_variants_on_new_fragments(self):
+        child = self.genome.update()
+        n = apply_genome_variants(child, self.vcf.splitlines())
+        self.assertEquals(n, 3)
+
+        fragments = dict((f.name, f.indexed_fragment()) for f in child.fragments.all())
+        self.assertEquals(fragments['chrI'].sequence, 'acttcggctga')
+        self.assertEquals(fragments['chrII'].sequence, 'ttgaaaacacgatcgg')
+        for f in fragments.values():
+            self.assertEquals(f.parent.name, f.name)
+
+        a = sorted(fragments['chrI'].annotations(), key=lambda x: x.base_first)
+        self.assertEquals([(x.base_first, x.base_last, x.feature.name) for x in a],
+                          [(2, 2, 'G2C'), (5, 5, 'del1')])
+        self.assertEquals(a[1].feature.type, 'variant')
+        a = fragments['chrII'].annotations()
+        self.assertEquals([(x.base_first, x.base_last, x.feature.name) for x in a],
+                          [(3, 6, 'G3GAAA')])
+
+        # parent genome is unchanged
+        fragments = dict((f.name, f.indexed_fragment()) for f in self.genome.fragments.all())
+        self.assertEquals(fragments['chrI'].sequence, self.s1)
+        self.assertEquals(fragments['chrII'].sequence, self.s2)
+
+    def test_rejects_mismatched_reference_and_unknown_chromosome(self):
+        child = self.genome.update()
+        with self.assertRaises(Exception):
+            apply_genome_variants(child, ['chrI\t2\t.\tA\tC'])
+        with self.assertRaises(Exception):
+            apply_genome_variants(child, ['chrIII\t2\t.\tA\tC'])
+        with self.assertRaises(Exception):
+            apply_genome_variants(child, ['chrI\t2\t.\tG\tC', 'chrII\t2\t.\tT\tC',
+                                          'chrI\t4\t.\tT\tC'])
+
+    def test_variant_api_creates_child_genome_with_variants(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with override_settings(VARIANT_DATA_DIR=tmpdir):
+                url = '/edge/genomes/%s/variants/' % self.genome.id
+                res = self.client.post(url, data=json.dumps(dict(create=False, vcf=self.vcf)),
+                                       content_type='application/json')
+                self.assertEquals(res.status_code, 200)
+                self.assertEquals(sorted((x['fragment_name'], x['variants'], x['ref_mismatches'])
+                                         for x in json.loads(res.content)),
+                                  [('chrI', 2, 0), ('chrII', 1, 0)])
+
+                res = self.client.post(url, data=json.dumps(dict(create=True, vcf=self.vcf)),
+                                       content_type='application/json')
+                self.assertEquals(res.status_code, 201)
+                child = Genome.objects.get(pk=json.loads(res.content)['id'])
+                self.assertEquals(child.parent_id, self.genome.id)
+                op = child.operation_set.all()[0]
+                self.assertEquals(op.type, Operation.VARIANT_APPLICATION[0])
+                self.assertEquals(op.feature_set.count(), 3)
+                fragments = dict((f.name, f.indexed_fragment()) for f in child.fragments.all())
+                self.assertEquals(fragments['chrI'].sequence, 'acttcggctga')
+
+                res = self.client.post(url, data=json.dumps(dict(create=True, vcf=self.vcf)),
+                                       content_type='application/json')
+                self.assertEquals(res.status_code, 200)
+                self.assertEquals(json.loads(res.content)['id'], child.id)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_finds_overlapping_variants(self):
+        variants = list(parse_vcf(['chrI\t5\t.\tCGA\tC', 'chrI\t2\t.\tG\tC',
+                                   'chrI\t2\t.\tG\tT', 'chrI\t6\t.\tG\tA',
+                                   'chrI\t8\t.\tG\tA']))
+        self.assertEquals([(v['pos'], v['alt']) for v in overlapping_variants(variants)],
+                          [(2, 't'), (6, 'a')])
+
+    def test_variant_api_rejects_overlapping_variants_without_creating_genome(self):
+        vcf = '\n'.join(['chrI\t2\t.\tG\tC', 'chrI\t2\t.\tG\tT', 'chrII\t3\t.\tG\tA'])
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with override_settings(VARIANT_DATA_DIR=tmpdir):
+                url = '/edge/genomes/%s/variants/' % self.genome.id
+                res = self.client.post(url, data=json.dumps(dict(create=False, vcf=vcf)),
+                                       content_type='application/json')
+                self.assertEquals(res.status_code, 200)
+                self.assertEquals(sorted((x['fragment_name'], x['variants'], x['overlapping'])
+                                         for x in json.loads(res.content)),
+                                  [('chrI', 2, 1), ('chrII', 1, 0)])
+
+                for i in range(0, 2):
+                    res = self.client.post(url, data=json.dumps(dict(create=True, vcf=vcf)),
+                                           content_type='application/json')
+                    self.assertEquals(res.status_code, 400)
+                self.assertEquals(self.genome.children.count(), 0)
+
+                bad_ref = 'chrI\t2\t.\tA\tC'
+                res = self.client.post(url, data=json.dumps(dict(create=True, vcf=bad_ref)),
+                                       content_type='application/json')
+                self.assertEquals(res.status_code, 400)
+                self.assertEquals(self.genome.children.count(), 0)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_builds_blastdb_of_new_genome_after_applying_variants(self):
+        # tasks run eagerly in tests, so a task started by another task runs
+        # while the other task is running
+        running = []
+        builds = []
+
+        def prerun(sender=None, task=None, args=None, **kwargs):
+            if task.name == 'build_genome_blastdb':
+                genome = Genome.objects.get(pk=args[0])
+                builds.append((list(running), genome.id,
+                               sorted(f.indexed_fragment().sequence
+                                      for f in genome.fragments.all())))
+            running.append(task.name)
+
+        def postrun(sender=None, task=None, **kwargs):
+            running.pop()
+
+        tmpdir = tempfile.mkdtemp()
+        task_prerun.connect(prerun)
+        task_postrun.connect(postrun)
+        try:
+            with override_settings(VARIANT_DATA_DIR=tmpdir):
+                url = '/edge/genomes/%s/variants/' % self.genome.id
+                res = self.client.post(url, data=json.dumps(dict(create=True, vcf=self.vcf)),
+                                       content_type='application/json')
+                self.assertEquals(res.status_code, 201)
+        finally:
+            task_prerun.disconnect(prerun)
+            task_postrun.disconnect(postrun)
+            shutil.rmtree(tmpdir)
+
+        # built once, by the task applying variants, with new fragments
+        self.assertEquals(builds, [(['apply_genome_variants'], json.loads(res.content)['id'],
+                                    ['acttcggctga', 'ttgaaaacacgatcgg'])])
@@ -1,8 +1,12 @@
 import os
 import json
 import re
+import gzip
+import shutil
 import tempfile
+from StringIO import StringIO
 from django.test import TestCase
+from django.test.utils import override_settings
 
 
 class GenomeListTest(TestCase):
@@ -256,6 +260,53 @@ class GenomeTest(TestCase):
         self.assertEquals(json.loads(res.content), json.loads(re2.content))
 
 
+class GenomeOperationsTest(TestCase):
+
+    def build_genome(self, nfragments, nops):
+        from edge.models import Genome, Fragment, Genome_Fragment, Operation
+
+        parent = Genome.create('Foo')
+        genome = Genome(name='Bar', parent=parent)
+        genome.save()
+        fragments = []
+        for i in range(0, nfragments):
+            f = Fragment.create_with_sequence('F%s' % (i,), 'agttcgaggctga'*10)
+            Genome_Fragment(genome=genome, fragment=f, inherited=False).save()
+            fragments.append(f)
+        for i in range(0, nops):
+            op = Operation(genome=genome, type=Operation.RECOMBINATION[0],
+                           params=json.dumps(dict(n=i)))
+            op.save()
+            for f in fragments:
+                f.annotate(i+1, i+10, 'A%s' % (i,), 'gene', 1, operation=op)
+        return genome
+
+    def test_returns_operations_with_annotations(self):
+        genome = self.build_genome(2, 2)
+        res = self.client.get('/edge/genomes/%s/' % (genome.id,))
+        d = json.loads(res.content)
+        self.assertEquals([f['length'] for f in d['fragments']], [130, 130])
+        self.assertEquals([op['params'] for op in d['operations']], [dict(n=0), dict(n=1)])
+        annotations = d['operations'][1]['annotations']
+        self.assertEquals([(a['fragment_name'], a['name'], a['base_first'], a['base_last'])
+                           for a in annotations],
+                          [('F0', 'A1', 2, 11), ('F1', 'A1', 2, 11)])
+        self.assertEquals(annotations[0]['fragment_id'], d['fragments'][0]['id'])
+
+    def test_number_of_queries_does_not_depend_on_fragments_or_operations(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        small = self.build_genome(1, 1)
+        large = self.build_genome(4, 5)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get('/edge/genomes/%s/' % (small.id,))
+        with CaptureQueriesContext(connection) as many:
+            res = self.client.get('/edge/genomes/%s/' % (large.id,))
+        self.assertEquals(len(json.loads(res.content)['operations']), 5)
+        self.assertEquals(len(many.captured_queries), len(few.captured_queries))
+
+
 class FragmentTest(TestCase):
 
     def setUp(self):
@@ -483,6 +534,35 @@ class FragmentTest(TestCase):
             "feature_base_last": 4,
         }])
 
+    def test_add_annotations_in_bulk(self):
+        data = [dict(base_first=2, base_last=9, name='proC', type='promoter', strand=1),
+                dict(base_first=5, base_last=12, name='proD', type='promoter', strand=-1,
+                     qualifiers=dict(note=['foo']))]
+        res = self.client.post(self.uri+'annotations/bulk/', data=json.dumps(data),
+                               content_type='application/json')
+        self.assertEquals(res.status_code, 201)
+        self.assertEquals(json.loads(res.content), [
+            dict(fragment_id=self.fragment_id, fragment_name=self.name, annotations=2)])
+
+        res = self.client.get(self.uri+'annotations/')
+        self.assertEquals([(a['base_first'], a['base_last'], a['name'], a['strand'],
+                            a['qualifiers']) for a in json.loads(res.content)],
+                          [(2, 9, 'proC', 1, {}), (5, 12, 'proD', -1, dict(note=['foo']))])
+
+    def test_bulk_annotations_from_gff_must_be_on_fragment(self):
+        gff = '\n'.join(['%s\tedge\tgene\t3\t5\t.\t-\t.\tName=proD' % (self.name,),
+                         'chrII\tedge\tCDS\t10\t14\t.\t+\t.\tName=proE'])
+        with self.assertRaises(Exception):
+            self.client.post(self.uri+'annotations/bulk/', data=gff, content_type='text/plain')
+        res = self.client.get(self.uri+'annotations/')
+        self.assertEquals(json.loads(res.content), [])
+
+        res = self.client.post(self.uri+'annotations/bulk/', data=gff.split('\n')[0],
+                               content_type='text/plain')
+        self.assertEquals(res.status_code, 201)
+        res = self.client.get(self.uri+'annotations/')
+        self.assertEquals([a['name'] for a in json.loads(res.content)], ['proD'])
+
     def test_limit_max_annotations_to_fetch(self):
         from edge.models import Fragment
         import random
@@ -516,6 +596,151 @@ class FragmentTest(TestCase):
         self.assertEquals(len(json.loads(res.content)), 0)
 
 
+class FragmentAnnotationsPaginationTest(TestCase):
+
+    def setUp(self):
+        from edge.models import Fragment
+
+        self.fragment = Fragment.create_with_sequence('Foo', 'agttcgaggctga'*100,
+                                                      initial_chunk_size=20)
+        self.uri = '/edge/fragments/%s/annotations/' % (self.fragment.id,)
+        # 60 features in first 600 bps, 10 bps apart
+        for i in range(0, 60):
+            self.fragment.annotate(i*10+1, i*10+5, 'F%s' % (i,), 'feature', 1)
+
+    def test_samples_annotations_from_each_bin(self):
+        res = self.client.get(self.uri+'?m=10')
+        self.assertEquals(res.status_code, 200)
+        sample = json.loads(res.content)
+        # annotations are in first 5 of 10 bins of 130 bps
+        self.assertEquals([a['base_first'] for a in sample],
+                          [1, 11, 131, 141, 261, 271, 391, 401, 521, 531])
+        self.assertEquals(json.loads(self.client.get(self.uri+'?m=10').content), sample)
+
+        res = self.client.get(self.uri+'?m=3&f=100&l=399')
+        self.assertEquals([a['base_first'] for a in json.loads(res.content)], [101, 201, 301])
+
+    def test_samples_annotations_from_many_annotations_per_bin(self):
+        sample = self.fragment.indexed_fragment().sample_annotations(4)
+        self.assertEquals([a.base_first for a in sample], [1, 11, 331, 341])
+
+    def test_pages_annotations(self):
+        res = self.client.get(self.uri+'?limit=25&offset=50')
+        self.assertEquals([a['name'] for a in json.loads(res.content)],
+                          ['F%s' % (i,) for i in range(50, 60)])
+
+        names = []
+        uri = self.uri+'?limit=25'
+        while True:
+            res = self.client.get(uri)
+            names.extend(a['name'] for a in json.loads(res.content))
+            if 'Link' not in res:
+                break
+            m = re.match(r'^<(.+)>; rel="next"$', res['Link'])
+            uri = m.group(1)
+        self.assertEquals(names, ['F%s' % (i,) for i in range(0, 60)])
+
+
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        from edge.models import Genome, Fragment, Genome_Fragment
+
+        self.genome = Genome.create('Foo')
+        self.fragment = Fragment.create_with_sequence('Bar', 'agttcgaggctga'*10)
+        Genome_Fragment(genome=self.genome, fragment=self.fragment, inherited=False).save()
+        self.uri = '/edge/fragments/%s/' % (self.fragment.id,)
+        self.genome_uri = '/edge/genomes/%s/' % (self.genome.id,)
+
+    def test_returns_not_modified_if_etag_matches(self):
+        for uri in [self.uri, self.uri+'sequence/?f=3&l=20', self.uri+'annotations/',
+                    self.genome_uri]:
+            res = self.client.get(uri)
+            self.assertEquals(res.status_code, 200)
+            self.assertEquals(res['Cache-Control'], 'no-cache')
+            res = self.client.get(uri, HTTP_IF_NONE_MATCH=res['ETag'])
+            self.assertEquals(res.status_code, 304)
+            self.assertEquals(res.content, '')
+            res = self.client.get(uri, HTTP_IF_NONE_MATCH='"foo"')
+            self.assertEquals(res.status_code, 200)
+
+    def test_returns_not_modified_if_not_modified_since(self):
+        res = self.client.get(self.uri+'sequence/')
+        self.assertEquals(res.status_code, 200)
+        res = self.client.get(self.uri+'sequence/', HTTP_IF_MODIFIED_SINCE=res['Last-Modified'])
+        self.assertEquals(res.status_code, 304)
+
+    def test_changing_fragment_changes_etag(self):
+        etags = [self.client.get(uri)['ETag']
+                 for uri in [self.uri+'sequence/', self.uri+'annotations/', self.genome_uri]]
+        self.fragment.annotate(3, 20, 'A1', 'gene', 1)
+        new_etags = [self.client.get(uri)['ETag']
+                     for uri in [self.uri+'sequence/', self.uri+'annotations/', self.genome_uri]]
+        self.assertEquals(new_etags[0], etags[0])
+        self.assertNotEquals(new_etags[1], etags[1])
+        self.assertNotEquals(new_etags[2], etags[2])
+
+        self.fragment.insert_bases(5, 'gataca')
+        res = self.client.get(self.uri+'sequence/', HTTP_IF_NONE_MATCH=etags[0])
+        self.assertEquals(res.status_code, 200)
+        self.assertIn('gataca', json.loads(res.content)['sequence'])
+
+    def test_renaming_fragment_or_parent_genome_changes_genome_etag(self):
+        from edge.models import Fragment, Genome
+
+        child = self.genome.update()
+        uri = '/edge/genomes/%s/' % (child.id,)
+        etag = self.client.get(uri)['ETag']
+
+        Fragment.objects.filter(id=self.fragment.id).update(name='Baz')
+        res = self.client.get(uri, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(res.status_code, 200)
+        self.assertEquals(json.loads(res.content)['fragments'][0]['name'], 'Baz')
+        etag = res['ETag']
+
+        Fragment.objects.filter(id=self.fragment.id).update(circular=True)
+        res = self.client.get(uri, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(res.status_code, 200)
+        self.assertEquals(json.loads(res.content)['fragments'][0]['circular'], True)
+        etag = res['ETag']
+
+        Genome.objects.filter(id=self.genome.id).update(name='Qux')
+        res = self.client.get(uri, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(res.status_code, 200)
+        self.assertEquals(json.loads(res.content)['parent_name'], 'Qux')
+        res = self.client.get(uri, HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEquals(res.status_code, 304)
+
+    def test_annotating_shared_chunks_changes_etag_of_other_fragments(self):
+        child = self.fragment.indexed_fragment().update('Baz')
+        uri = self.uri+'annotations/'
+        etag = self.client.get(uri)['ETag']
+        child.annotate(3, 20, 'A1', 'gene', 1)
+        res = self.client.get(uri, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(res.status_code, 200)
+        self.assertEquals(json.loads(res.content)[0]['name'], 'A1')
+
+    def test_validates_annotations_without_reading_annotations(self):
+        self.fragment.annotate(3, 20, 'A1', 'gene', 1)
+        uri = self.uri+'annotations/?f=1&l=10'
+        etag = self.client.get(uri)['ETag']
+        # fragment, and its location index
+        with self.assertNumQueries(2):
+            res = self.client.get(uri, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(res.status_code, 304)
+
+    def test_sequence_of_fragment_with_child_is_revalidated(self):
+        self.fragment.indexed_fragment().update('Baz')
+        res = self.client.get(self.uri+'sequence/')
+        self.assertEquals(res['Cache-Control'], 'no-cache')
+
+        # nothing stops changing a fragment after it has a child
+        self.fragment.insert_bases(5, 'gataca')
+        res = self.client.get(self.uri+'sequence/', HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEquals(res.status_code, 200)
+        self.assertIn('gataca', json.loads(res.content)['sequence'])
+
+
 class GenomeAnnotationsTest(TestCase):
 
     def setUp(self):
@@ -548,3 +773,116 @@ class GenomeAnnotationsTest(TestCase):
                  "feature_base_first": 1,
                  "feature_base_last": 8}]
         ]])
+
+    def test_add_annotations_in_bulk_from_gff(self):
+        gff = '\n'.join(['##gff-version 3',
+                         'chrI\tedge\tgene\t3\t5\t.\t-\t.\tID=g1;Name=proD;note=a%2Cb,c',
+                         'chrI\tedge\tCDS\t10\t14\t.\t+\t.\tID=c1'])
+        res = self.client.post(self.genome_uri+'annotations/bulk/', data=gff,
+                               content_type='text/plain')
+        self.assertEquals(res.status_code, 201)
+        self.assertEquals(json.loads(res.content)[0]['annotations'], 2)
+
+        res = self.client.get(self.genome_uri+'annotations/?q=proD')
+        a = json.loads(res.content)[0][1][0]
+        self.assertEquals((a['base_first'], a['base_last'], a['type'], a['strand']),
+                          (3, 5, 'gene', -1))
+        self.assertEquals(a['qualifiers']['note'], ['a,b', 'c'])
+
+        with tempfile.NamedTemporaryFile(suffix='.gff') as f:
+            f.write('chrI\tedge\tgene\t1\t4\t.\t+\t.\tName=proE\n')
+            f.flush()
+            f.seek(0)
+            res = self.client.post(self.genome_uri+'annotations/bulk/', data=dict(gff=f))
+        self.assertEquals(res.status_code, 201)
+        res = self.client.get(self.genome_uri+'annotations/?q=proE')
+        self.assertEquals(len(json.loads(res.content)), 1)
+
+    def test_bulk_annotations_must_be_on_genome_fragments(self):
+        data = [dict(fragment_name='chrII', base_first=2, base_last=9, name='proC',
+                     type='promoter', strand=1)]
+        with self.assertRaises(Exception):
+            self.client.post(self.genome_uri+'annotations/bulk/', data=json.dumps(data),
+                             content_type='application/json')
+        res = self.client.get(self.genome_uri+'annotations/?q=proC')
+        self.assertEquals(len(json.loads(res.content)), 1)
+
+
+class GenomeExportTest(TestCase):
+
+    def setUp(self):
+        from edge.models import Genome, Fragment, Genome_Fragment
+        from edge.io import IO
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.settings_override = override_settings(EXPORT_CACHE_DIR=self.tmpdir)
+        self.settings_override.enable()
+
+        self.genome = Genome.create('Foo')
+        self.sequence = 'agttcgaggctga'*10
+        fragment = Fragment.create_with_sequence('chrI', self.sequence, initial_chunk_size=7)
+        fragment.annotate(3, 20, 'A1', 'gene', -1)
+        Genome_Fragment(genome=self.genome, fragment=fragment, inherited=False).save()
+        self.gff = ''.join(IO(self.genome).gff_lines())
+        self.fasta = ''.join(IO(self.genome).fasta_lines())
+        self.uri = '/edge/genomes/%s/export' % (self.genome.id,)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.tmpdir)
+
+    def test_streams_gff_and_fasta(self):
+        res = self.client.get(self.uri+'.gff')
+        self.assertEquals(res.status_code, 200)
+        self.assertEquals(''.join(res.streaming_content), self.gff)
+        self.assertIn('chrI\tfeature\tgene\t3\t20\t.\t-\t.\tname=A1\n', self.gff)
+
+        res = self.client.get(self.uri+'.fa')
+        self.assertEquals(res.status_code, 200)
+        self.assertEquals(res['Accept-Ranges'], 'bytes')
+        self.assertEquals(''.join(res.streaming_content), self.fasta)
+        self.assertEquals(self.fasta.split('\n')[1], self.sequence[0:60])
+
+        res = self.client.get(self.uri+'.gb')
+        self.assertEquals(res.status_code, 200)
+        self.assertIn('complement(3..20)', ''.join(res.streaming_content))
+
+    def test_compresses_export_with_gzip(self):
+        res = self.client.get(self.uri+'.fa', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEquals(res['Content-Encoding'], 'gzip')
+        data = ''.join(res.streaming_content)
+        self.assertEquals(gzip.GzipFile(fileobj=StringIO(data)).read(), self.fasta)
+
+        # same bytes again, so a download can be resumed
+        res = self.client.get(self.uri+'.fa', HTTP_ACCEPT_ENCODING='gzip',
+                              HTTP_RANGE='bytes=10-')
+        self.assertEquals(res.status_code, 206)
+        self.assertEquals(res['Content-Range'], 'bytes 10-%s/%s' % (len(data)-1, len(data)))
+        self.assertEquals(''.join(res.streaming_content), data[10:])
+
+    def test_returns_byte_ranges(self):
+        n = len(self.gff)
+        for header, first, last in (('bytes=0-9', 0, 9), ('bytes=20-', 20, n-1),
+                                    ('bytes=-15', n-15, n-1), ('bytes=5-100000', 5, n-1)):
+            res = self.client.get(self.uri+'.gff', HTTP_RANGE=header)
+            self.assertEquals(res.status_code, 206)
+            self.assertEquals(res['Content-Range'], 'bytes %s-%s/%s' % (first, last, n))
+            self.assertEquals(''.join(res.streaming_content), self.gff[first:last+1])
+
+        res = self.client.get(self.uri+'.gff', HTTP_RANGE='bytes=%s-' % (n,))
+        self.assertEquals(res.status_code, 416)
+        res = self.client.get(self.uri+'.gff', HTTP_RANGE='bytes=10-', HTTP_IF_RANGE='"stale"')
+        self.assertEquals(res.status_code, 200)
+
+    def test_etag_changes_when_genome_changes(self):
+        res = self.client.get(self.uri+'.gff')
+        etag = res['ETag']
+        res = self.client.get(self.uri+'.gff', HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(res.status_code, 304)
+        self.assertNotEquals(self.client.get(self.uri+'.fa')['ETag'], etag)
+
+        fragment = self.genome.fragments.all()[0].indexed_fragment()
+        fragment.insert_bases(5, 'gataca')
+        res = self.client.get(self.uri+'.gff', HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(res.status_code, 200)
+        self.assertNotEquals(res['ETag'], etag)
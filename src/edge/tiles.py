@@ -0,0 +1,132 @@
+import os
+import json
+import heapq
+import shutil
+import hashlib
+import tempfile
+from django.conf import settings
+from edge.models import Fragment_Index
+from edge.blastdb import make_required_dirs
+
+
+# bins per tile; at zoom level 0, one tile covers the whole fragment, and each
+# zoom level doubles number of tiles, until bins are one base pair wide
+TILE_BINS = 256
+
+# number of features, longest first, returned with each tile
+TILE_FEATURES = 20
+
+
+def fragment_version(fragment):
+    """
+    Returns a string identifying current version of an indexed fragment's
+    sequence and annotations.
+    """
+
+    # fragment_index cached on fragment may be out of date, read it again
+    updated_on, version, annotations_version = \
+        Fragment_Index.objects.filter(fragment_id=fragment.id)\
+                              .values_list('updated_on', 'version', 'annotations_version')[0]
+    signature = [fragment.id, updated_on.isoformat() if updated_on else None,
+                 version, annotations_version, fragment.length]
+    return hashlib.sha1(json.dumps(signature)).hexdigest()
+
+
+def fragment_tile_dir(fragment, version):
+    return '%s/fragment/%s/%s/%s/%s' % (settings.TILE_CACHE_DIR,
+                                        fragment.id % 1024, (fragment.id >> 10) % 1024,
+                                        fragment.id, version)
+
+
+def tile_bin_size(length, zoom):
+    return max(1, -(-length // (TILE_BINS*2**zoom)))
+
+
+def tile_count(length, zoom):
+    return -(-length // (tile_bin_size(length, zoom)*TILE_BINS))
+
+
+def compute_tile(fragment, zoom, tile):
+    """
+    Computes number of features and GC content of each bin of a tile, and
+    finds the longest features in the tile. Reads sequence of the tile one
+    chunk at a time.
+    """
+
+    length = fragment.length
+    if zoom < 0 or tile < 0 or tile >= tile_count(length, zoom):
+        raise Exception('Tile %s at zoom level %s is not on fragment' % (tile, zoom))
+
+    bin_size = tile_bin_size(length, zoom)
+    base_first = tile*bin_size*TILE_BINS+1
+    base_last = min(base_first+bin_size*TILE_BINS-1, length)
+    nbins = -(-(base_last-base_first+1) // bin_size)
+
+    features = [0]*nbins
+    longest = []
+    for a in fragment.iter_annotations(bp_lo=base_first, bp_hi=base_last):
+        lo = max(a.base_first, base_first)-base_first
+        hi = min(a.base_last, base_last)-base_first
+        for i in range(lo // bin_size, hi // bin_size+1):
+            features[i] += 1
+        item = (a.base_last-a.base_first, -a.base_first, a)
+        if len(longest) < TILE_FEATURES:
+            heapq.heappush(longest, item)
+        else:
+            heapq.heappushpop(longest, item)
+
+    gc = [0]*nbins
+    q = fragment.fragment_chunk_location_set.filter(base_last__gte=base_first,
+                                                    base_first__lte=base_last)\
+                                            .order_by('base_first')\
+                                            .values_list('base_first', 'chunk__sequence')
+    for chunk_base_first, sequence in q.iterator():
+        # offsets of chunk sequence and its overlap with tile, from tile start
+        offset = chunk_base_first-base_first
+        lo = max(offset, 0)
+        hi = min(offset+len(sequence), base_last-base_first+1)
+        while lo < hi:
+            i = lo // bin_size
+            end = min((i+1)*bin_size, hi)
+            s = sequence[lo-offset:end-offset]
+            gc[i] += s.count('g')+s.count('c')+s.count('G')+s.count('C')
+            lo = end
+
+    bin_lengths = [bin_size]*(nbins-1)+[base_last-base_first+1-bin_size*(nbins-1)]
+    longest = [a for n, neg_first, a in sorted(longest, key=lambda x: (-x[0], -x[1]))]
+    return dict(fragment_id=fragment.id, zoom=zoom, tile=tile, tiles=tile_count(length, zoom),
+                base_first=base_first, base_last=base_last, bin_size=bin_size,
+                feature_density=features,
+                gc_content=[round(float(n)/l, 4) for n, l in zip(gc, bin_lengths)],
+                features=[dict(base_first=a.base_first, base_last=a.base_last,
+                               name=a.feature.name, type=a.feature.type,
+                               strand=a.feature.strand) for a in longest])
+
+
+def fragment_tile(fragment, zoom, tile):
+    """
+    Returns a tile summarizing a region of an indexed fragment. Tiles are
+    computed when first requested, and cached on disk for each version of the
+    fragment; when the fragment changes, tiles of older versions are removed.
+    """
+
+    version = fragment_version(fragment)
+    dirn = fragment_tile_dir(fragment, version)
+    fn = '%s/z%s-t%s.json' % (dirn, zoom, tile)
+    if os.path.exists(fn):
+        with open(fn) as f:
+            return json.load(f)
+
+    if not os.path.isdir(dirn):
+        make_required_dirs(fn)
+        parent = os.path.dirname(dirn)
+        for old_version in os.listdir(parent):
+            if old_version != version:
+                shutil.rmtree('%s/%s' % (parent, old_version), ignore_errors=True)
+
+    res = compute_tile(fragment, zoom, tile)
+    with tempfile.NamedTemporaryFile(dir=dirn, delete=False) as f:
+        json.dump(res, f)
+    os.chmod(f.name, 0644)
+    os.rename(f.name, fn)
+    return res
@@ -24,10 +24,19 @@ urlpatterns = patterns(
 
     url('^fragments/(?P<fragment_id>\d+)/sequence/$', FragmentSequenceView.as_view()),
     url('^fragments/(?P<fragment_id>\d+)/annotations/$', FragmentAnnotationsView.as_view()),
+    url('^fragments/(?P<fragment_id>\d+)/annotations/bulk/$',
+        FragmentAnnotationsBulkView.as_view()),
+    url('^fragments/(?P<fragment_id>\d+)/tiles/$', FragmentTilesView.as_view()),
     url('^genomes/(?P<genome_id>\d+)/annotations/$', GenomeAnnotationsView.as_view()),
+    url('^genomes/(?P<genome_id>\d+)/annotations/bulk/$', GenomeAnnotationsBulkView.as_view()),
     url('^genomes/(?P<genome_id>\d+)/fragments/$', GenomeFragmentListView.as_view()),
+    url('^genomes/(?P<genome_id>\d+)/export\.(?P<fmt>gff|fa|gb)$', GenomeExportView.as_view()),
     url('^genomes/(?P<genome_id>\d+)/blast/$', GenomeBlastView.as_view()),
     url('^genomes/(?P<genome_id>\d+)/pcr/$', GenomePcrView.as_view()),
+    url('^genomes/(?P<genome_id>\d+)/pcr/batch/$', GenomePcrBatchView.as_view()),
     url('^genomes/(?P<genome_id>\d+)/recombination/$', GenomeRecombinationView.as_view()),
     url('^genomes/(?P<genome_id>\d+)/crispr/dsb/$', GenomeCrisprDSBView.as_view()),
+    url('^genomes/(?P<genome_id>\d+)/crispr/guides/$', GenomeCrisprGuidesView.as_view()),
+    url('^genomes/(?P<genome_id>\d+)/orfs/$', GenomeOrfAnnotationView.as_view()),
+    url('^genomes/(?P<genome_id>\d+)/variants/$', GenomeVariantView.as_view()),
 )
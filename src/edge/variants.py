@@ -0,0 +1,234 @@
+import os
+import json
+import hashlib
+import itertools
+from django.conf import settings
+from edge.models import Operation
+
+
+def vcf_path(op):
+    """
+    Returns path of VCF file stored for an operation.
+    """
+
+    return "%s/operation/%s/%s/edge-operation-%d.vcf" % (settings.VARIANT_DATA_DIR,
+                                                         op.id % 1024, (op.id >> 10) % 1024,
+                                                         op.id)
+
+
+def parse_vcf(lines):
+    """
+    Parses VCF records from an iterable of lines, e.g. an open file, one line
+    at a time. Generator yielding a dictionary with chrom, pos, id, ref and alt
+    for each variant. Only the first ALT allele of each record is used;
+    records that did not pass filters, or with symbolic, breakend or missing
+    ALT alleles, are skipped.
+    """
+
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line == '' or line.startswith('#'):
+            continue
+        cols = line.split('\t')
+        if len(cols) < 5:
+            raise Exception('Invalid VCF record: %s' % (line,))
+        chrom, pos, vid, ref, alt = cols[0:5]
+        if len(cols) > 6 and cols[6] not in ('PASS', '.'):
+            continue
+        alt = alt.split(',')[0]
+        if alt in ('.', '*') or alt.startswith('<') or '[' in alt or ']' in alt:
+            continue
+        yield dict(chrom=chrom, pos=int(pos), id=None if vid == '.' else vid,
+                   ref=ref.lower(), alt=alt.lower())
+
+
+def vcf_by_chrom(lines):
+    """
+    Groups variants parsed from VCF lines by chromosome. Generator yielding a
+    (chromosome, list of variants) tuple for each chromosome, so only variants
+    of one chromosome are in memory at a time. VCF records must be grouped by
+    chromosome, as they are in a sorted VCF file.
+    """
+
+    seen = set()
+    for chrom, variants in itertools.groupby(parse_vcf(lines), key=lambda v: v['chrom']):
+        if chrom in seen:
+            raise Exception('VCF records for %s are not grouped together' % (chrom,))
+        seen.add(chrom)
+        yield chrom, list(variants)
+
+
+def ref_mismatches(sequence, variants):
+    return [v for v in variants
+            if sequence[v['pos']-1:v['pos']-1+len(v['ref'])].lower() != v['ref']]
+
+
+def overlapping_variants(variants):
+    """
+    Returns variants whose reference allele overlaps that of a variant at the
+    same or an earlier position, e.g. a second record at the same position,
+    or a SNP inside a deletion. Overlapping variants cannot be applied
+    together.
+    """
+
+    overlapping = []
+    next_allowed = 1
+    for v in sorted(variants, key=lambda v: v['pos']):
+        if v['pos'] < next_allowed:
+            overlapping.append(v)
+        next_allowed = max(next_allowed, v['pos']+max(len(v['ref']), 1))
+    return overlapping
+
+
+def variant_name(variant):
+    if variant['id'] is not None:
+        return variant['id'][0:100]
+    name = '%s%d%s' % (variant['ref'].upper(), variant['pos'], variant['alt'].upper())
+    if len(name) > 100:
+        name = '%d:%dbps>%dbps' % (variant['pos'], len(variant['ref']), len(variant['alt']))
+    return name
+
+
+def apply_fragment_variants(fragment, variants, op=None):
+    """
+    Applies variants to an indexed fragment as a single batch of edits, then
+    annotates each variant at its new location. Raises an exception if
+    reference allele of any variant does not match the fragment, or if any
+    variants overlap.
+    """
+
+    mismatches = ref_mismatches(fragment.sequence, variants)
+    if len(mismatches) > 0:
+        v = mismatches[0]
+        raise Exception('Reference allele %s at %s:%d does not match sequence'
+                        % (v['ref'], v['chrom'], v['pos']))
+    overlapping = overlapping_variants(variants)
+    if len(overlapping) > 0:
+        v = overlapping[0]
+        raise Exception('Variant at %s:%d overlaps another variant' % (v['chrom'], v['pos']))
+
+    fragment.apply_edits([dict(before_base1=v['pos'], length_to_remove=len(v['ref']),
+                               sequence=v['alt']) for v in variants])
+
+    annotations = []
+    shift = 0
+    for v in sorted(variants, key=lambda v: v['pos']):
+        first = v['pos']+shift
+        shift += len(v['alt'])-len(v['ref'])
+        if len(v['alt']) == 0:
+            continue
+        annotations.append(dict(first_base1=first, last_base1=first+len(v['alt'])-1,
+                                name=variant_name(v), type='variant', strand=None,
+                                qualifiers=dict(ref=v['ref'], alt=v['alt'], pos=v['pos']),
+                                operation=op))
+    fragment.annotate_many(annotations)
+
+
+def apply_genome_variants(genome, lines, op=None, progress=None):
+    """
+    Applies variants from VCF lines to fragments of a genome, one chromosome at
+    a time. VCF chromosome names are matched against fragment names. Like
+    other operations, fragments inherited from parent genome are replaced by
+    new versions of the fragments. Calls progress, if specified, with number of
+    chromosomes and number of variants applied so far. Returns number of
+    variants applied.
+    """
+
+    fragments = dict((gf.fragment.name, gf) for gf in
+                     genome.genome_fragment_set.select_related('fragment'))
+    done = 0
+    applied = 0
+    for chrom, variants in vcf_by_chrom(lines):
+        if chrom not in fragments:
+            raise Exception('Genome does not have a fragment named %s' % (chrom,))
+        gf = fragments[chrom]
+        with genome.update_fragment_by_fragment_id(gf.fragment_id,
+                                                   new_fragment=gf.inherited) as f:
+            apply_fragment_variants(f, variants, op)
+        done += 1
+        applied += len(variants)
+        if progress is not None:
+            progress(done, applied)
+    return applied
+
+
+class VariantFragmentSummary(object):
+
+    def __init__(self, fragment_id, fragment_name, variants, ref_mismatches, overlapping):
+        self.fragment_id = fragment_id
+        self.fragment_name = fragment_name
+        self.variants = variants
+        self.ref_mismatches = ref_mismatches
+        self.overlapping = overlapping
+
+    def to_dict(self):
+        return self.__dict__
+
+
+def variant_application(genome, vcf, genome_name=None, notes=None):
+
+    # variants are applied in the background, after the new genome is
+    # returned, so make sure they can be applied before creating the genome
+    summaries = VariantOp.check(genome, vcf)
+    if summaries is None or \
+       any(s.ref_mismatches > 0 or s.overlapping > 0 for s in summaries):
+        return None
+
+    if genome_name is None or genome_name.strip() == "":
+        genome_name = "%s with variants" % (genome.name,)
+
+    new_genome = genome.update()
+    new_genome.name = genome_name
+    new_genome.notes = notes
+    new_genome.save()
+
+    op = VariantOp.get_operation(vcf)
+    op.genome = new_genome
+    op.save()
+
+    fn = vcf_path(op)
+    if not os.path.isdir(os.path.dirname(fn)):
+        os.makedirs(os.path.dirname(fn))
+    with open(fn, 'w') as f:
+        f.write(vcf)
+
+    # applying many variants takes a while, do it in the background
+    from edge.tasks import apply_genome_variants_task
+    apply_genome_variants_task.apply_async((new_genome.id, op.id), countdown=10)
+
+    return new_genome
+
+
+class VariantOp(object):
+
+    @staticmethod
+    def check(genome, vcf, genome_name=None, notes=None):
+        """
+        Returns number of variants, number of variants with reference allele
+        not matching sequence, and number of variants overlapping another
+        variant, for each fragment with variants. Variants can only be applied
+        if there are no mismatches or overlaps. Returns None if VCF has
+        variants on sequences not in the genome.
+        """
+
+        fragments = dict((f.name, f) for f in genome.fragments.all())
+        r = []
+        for chrom, variants in vcf_by_chrom(vcf.splitlines()):
+            if chrom not in fragments:
+                return None
+            fragment = fragments[chrom].indexed_fragment()
+            mismatches = ref_mismatches(fragment.sequence, variants)
+            overlapping = overlapping_variants(variants)
+            r.append(VariantFragmentSummary(fragment.id, fragment.name, len(variants),
+                                            len(mismatches), len(overlapping)))
+        return r
+
+    @staticmethod
+    def get_operation(vcf, genome_name=None, notes=None):
+        params = dict(vcf_sha1=hashlib.sha1(vcf).hexdigest())
+        op = Operation(type=Operation.VARIANT_APPLICATION[0], params=json.dumps(params))
+        return op
+
+    @staticmethod
+    def perform(genome, vcf, genome_name, notes):
+        return variant_application(genome, vcf, genome_name=genome_name, notes=notes)
@@ -1,13 +1,19 @@
+import re
+import os
 import json
-import random
+import hashlib
+import calendar
+import itertools
 from contextlib import contextmanager
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse, Http404
 from django.views.generic.base import View
+from django.utils.http import http_date, parse_http_date_safe, parse_etags, quote_etag
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
+from django.db.models import Q, Max
 from django.db import transaction
 from edge.models import *
+from edge.serializer import RawJSON, json_chunks, to_json
 
 
 def schedule_building_blast_db(genome_id, countdown=None):
@@ -27,18 +33,78 @@ def get_fragment_or_404(pk):
     return get_object_or_404(Fragment, pk=pk)
 
 
+def get_fresh_index_version(fragment_id):
+    """
+    Returns version, time location index of a fragment was last updated, and
+    annotations version, or None if fragment does not have a fresh location
+    index.
+    """
+
+    q = Fragment_Index.objects.filter(fragment_id=fragment_id, fresh=True,
+                                      updated_on__isnull=False)\
+                              .values_list('version', 'updated_on', 'annotations_version')
+    return q[0] if len(q) > 0 else None
+
+
 class ViewBase(View):
+
+    # responses that are lists longer than this are streamed
+    STREAM_MIN_LENGTH = 1000
+
+    def json_response(self, res, status=200):
+        if type(res) in (list, tuple) and len(res) > self.STREAM_MIN_LENGTH:
+            return StreamingHttpResponse(json_chunks(res), status=status,
+                                         content_type='application/json')
+        return HttpResponse(to_json(res), status=status, content_type='application/json')
+
+    def on_get_validators(self, request, *args, **kwargs):
+        """
+        Views override this to support conditional GET. Returns (version,
+        last modified time) of the resource a GET would return, where version
+        is a JSON serializable object that changes whenever the response
+        changes, or None to always compute the response. Should be much
+        cheaper than on_get.
+        """
+
+        return None
+
     def get(self, request, *args, **kwargs):
-        res = self.on_get(request, *args, **kwargs)
-        return HttpResponse(json.dumps(res), content_type='application/json')
+        validators = self.on_get_validators(request, *args, **kwargs)
+        if validators is None:
+            return self.json_response(self.on_get(request, *args, **kwargs))
+
+        version, last_modified = validators
+        etag = hashlib.sha1(json.dumps(version)).hexdigest()
+        if last_modified is not None:
+            last_modified = calendar.timegm(last_modified.utctimetuple())
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if if_none_match is not None:
+            not_modified = etag in parse_etags(if_none_match) or if_none_match.strip() == '*'
+        else:
+            not_modified = last_modified is not None and if_modified_since is not None and\
+                last_modified <= if_modified_since
+
+        if not_modified:
+            response = HttpResponse(status=304)
+        else:
+            response = self.json_response(self.on_get(request, *args, **kwargs))
+
+        response['ETag'] = quote_etag(etag)
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        # clients may keep response, but must check it is still current
+        response['Cache-Control'] = 'no-cache'
+        return response
 
     def put(self, request, *args, **kwargs):
         res, status = self.on_put(request, *args, **kwargs)
-        return HttpResponse(json.dumps(res), status=status, content_type='application/json')
+        return self.json_response(res, status=status)
 
     def post(self, request, *args, **kwargs):
         res, status = self.on_post(request, *args, **kwargs)
-        return HttpResponse(json.dumps(res), status=status, content_type='application/json')
+        return self.json_response(res, status=status)
 
 
 class RequestParser(object):
@@ -54,8 +120,7 @@ class RequestParser(object):
                 field_type = [field_type]
         self.__args.append((name, field_type, required, default, location))
 
-    def parse_args(self, request):
-        json_payload = None
+    def parse_args(self, request, json_payload=None):
         args = {}
         for name, field_type, required, default, location in self.__args:
             if location == 'get':
@@ -65,7 +130,7 @@ class RequestParser(object):
             else:
                 if json_payload is None:
                     json_payload = json.loads(request.body)
-                    d = json_payload
+                d = json_payload
             if name not in d and required:
                 raise Exception('Missing required field "%s"' % (name,))
             if name not in d:
@@ -101,9 +166,19 @@ class FragmentView(ViewBase):
                     uri=reverse('fragment', kwargs=dict(fragment_id=fragment.id)),
                     name=fragment.name,
                     circular=fragment.circular,
-                    parent_id=fragment.parent.id if fragment.parent else None,
+                    parent_id=fragment.parent_id,
                     length=length)
 
+    def on_get_validators(self, request, fragment_id):
+        fragment = get_fragment_or_404(fragment_id)
+        index = get_fresh_index_version(fragment.id)
+        if index is None:
+            return None
+        index_version, updated_on, annotations_version = index
+        version = [fragment.id, fragment.name, fragment.circular, fragment.parent_id,
+                   index_version, updated_on.isoformat()]
+        return version, updated_on
+
     def on_get(self, request, fragment_id):
         fragment = get_fragment_or_404(fragment_id)
         return FragmentView.to_dict(fragment)
@@ -111,6 +186,14 @@ class FragmentView(ViewBase):
 
 class FragmentSequenceView(ViewBase):
 
+    def on_get_validators(self, request, fragment_id):
+        fragment = get_fragment_or_404(fragment_id)
+        index = get_fresh_index_version(fragment.id)
+        if index is None:
+            return None
+        index_version, updated_on, annotations_version = index
+        return [fragment.id, index_version, updated_on.isoformat()], updated_on
+
     def on_get(self, request, fragment_id):
         q_parser = RequestParser()
         q_parser.add_argument('f', field_type=int, location='get')
@@ -136,31 +219,64 @@ class FragmentAnnotationsView(ViewBase):
                     name=annotation.feature.name,
                     type=annotation.feature.type,
                     strand=annotation.feature.strand,
-                    qualifiers=annotation.feature.qualifiers,
+                    qualifiers=RawJSON(annotation.feature.qualifiers_json),
                     feature_full_length=annotation.feature.length,
                     feature_base_first=annotation.feature_base_first,
                     feature_base_last=annotation.feature_base_last)
 
+    def get(self, request, *args, **kwargs):
+        self.next_cursor = None
+        response = super(FragmentAnnotationsView, self).get(request, *args, **kwargs)
+        if self.next_cursor is not None:
+            params = request.GET.copy()
+            params.pop('offset', None)
+            params['after'] = self.next_cursor
+            response['Link'] = '<%s?%s>; rel="next"' % (request.path, params.urlencode())
+        return response
+
+    def on_get_validators(self, request, fragment_id):
+        fragment = get_fragment_or_404(fragment_id)
+        index = get_fresh_index_version(fragment.id)
+        if index is None:
+            return None
+        index_version, updated_on, annotations_version = index
+        version = [fragment.id, index_version, updated_on.isoformat(), annotations_version]
+        return version, None
+
     def on_get(self, request, fragment_id):
+        """
+        Returns annotations in a region, in location order. If m is specified,
+        returns a deterministic sample of up to m annotations spread over the
+        region. Otherwise, limit and offset, or after, a cursor from the Link
+        header of the previous page, select a page of annotations.
+        """
+
         q_parser = RequestParser()
         q_parser.add_argument('f', field_type=int, location='get')
         q_parser.add_argument('l', field_type=int, location='get')
         q_parser.add_argument('m', field_type=int, location='get')
+        q_parser.add_argument('limit', field_type=int, location='get')
+        q_parser.add_argument('offset', field_type=int, default=0, location='get')
+        q_parser.add_argument('after', field_type=str, location='get')
         args = q_parser.parse_args(request)
         f = args['f']
         l = args['l']
         m = args['m']
+        limit = args['limit']
+        after = args['after']
 
-        fragment = get_fragment_or_404(fragment_id)
-        annotations = fragment.indexed_fragment().annotations(bp_lo=f, bp_hi=l)
-        if m is not None and len(annotations) > m:
-            to_return = []
-            while len(to_return) < m:
-                i = random.randint(0, len(annotations)-1)
-                to_return.append(annotations[i])
-                new_a = annotations[0:i]+annotations[i+1:]
-                annotations = new_a
-            annotations = to_return
+        fragment = get_fragment_or_404(fragment_id).indexed_fragment()
+        if m is not None:
+            annotations = fragment.sample_annotations(m, bp_lo=f, bp_hi=l)
+        else:
+            if after is not None:
+                after = tuple(int(x) for x in after.split(':'))
+            annotations = fragment.iter_annotations(bp_lo=f, bp_hi=l, after=after)
+            last = None if limit is None else args['offset']+limit
+            annotations = list(itertools.islice(annotations, args['offset'], last))
+            if limit is not None and len(annotations) == limit and limit > 0:
+                a = annotations[-1]
+                self.next_cursor = '%s:%s' % (a.base_first, a.feature.id)
         return [FragmentAnnotationsView.to_dict(annotation) for annotation in annotations]
 
     @transaction.atomic()
@@ -183,6 +299,123 @@ class FragmentAnnotationsView(ViewBase):
         return {}, 201
 
 
+def parse_bulk_annotations(request):
+    """
+    Parses annotations uploaded as JSON array, or as GFF3 text, either as
+    request body or as an uploaded file named "gff". Returns list of
+    (fragment ID or None, sequence name or None, annotate arguments).
+    """
+
+    from edge.importer import parse_gff3_annotations
+
+    if 'gff' in request.FILES:
+        return [(None, seqid, a) for seqid, a in parse_gff3_annotations(request.FILES['gff'])]
+
+    if not request.META.get('CONTENT_TYPE', '').startswith('application/json'):
+        lines = request.body.splitlines()
+        return [(None, seqid, a) for seqid, a in parse_gff3_annotations(lines)]
+
+    annotation_parser = RequestParser()
+    annotation_parser.add_argument('base_first', field_type=int, required=True, location='json')
+    annotation_parser.add_argument('base_last', field_type=int, required=True, location='json')
+    annotation_parser.add_argument('name', field_type=str, required=True, location='json')
+    annotation_parser.add_argument('type', field_type=str, required=True, location='json')
+    annotation_parser.add_argument('strand', field_type=int, required=True, location='json')
+    annotation_parser.add_argument('qualifiers', field_type=dict, default=None, location='json')
+    annotation_parser.add_argument('fragment_id', field_type=int, default=None, location='json')
+    annotation_parser.add_argument('fragment_name', field_type=str, default=None, location='json')
+
+    annotations = json.loads(request.body)
+    if type(annotations) != list:
+        raise Exception('Expecting a list of annotations')
+    res = []
+    for d in annotations:
+        args = annotation_parser.parse_args(request, json_payload=d)
+        res.append((args['fragment_id'], args['fragment_name'],
+                    dict(first_base1=args['base_first'], last_base1=args['base_last'],
+                         name=args['name'], type=args['type'], strand=args['strand'],
+                         qualifiers=args['qualifiers'])))
+    return res
+
+
+def annotate_fragments(fragments, annotations):
+    """
+    Adds lists of annotations to fragments, in one batch per fragment. Returns
+    list of number of annotations added to each fragment.
+    """
+
+    res = []
+    for fragment, fragment_annotations in zip(fragments, annotations):
+        fragment.indexed_fragment().annotate_many(fragment_annotations)
+        res.append(dict(fragment_id=fragment.id, fragment_name=fragment.name,
+                        annotations=len(fragment_annotations)))
+    return res
+
+
+class FragmentTilesView(ViewBase):
+    """
+    Returns a tile of a fragment at a zoom level: feature density and GC
+    content for each bin of the tile, and longest features in the tile. At
+    zoom level 0, a single tile covers the whole fragment.
+    """
+
+    def on_get(self, request, fragment_id):
+        from edge.tiles import fragment_tile, tile_count
+
+        q_parser = RequestParser()
+        q_parser.add_argument('zoom', field_type=int, default=0, location='get')
+        q_parser.add_argument('tile', field_type=int, default=0, location='get')
+        args = q_parser.parse_args(request)
+        zoom = args['zoom']
+        tile = args['tile']
+
+        fragment = get_fragment_or_404(fragment_id).indexed_fragment()
+        if zoom < 0 or tile < 0 or tile >= tile_count(fragment.length, zoom):
+            raise Http404
+        return fragment_tile(fragment, zoom, tile)
+
+
+class FragmentAnnotationsBulkView(ViewBase):
+
+    @transaction.atomic()
+    def on_post(self, request, fragment_id):
+        fragment = get_fragment_or_404(fragment_id)
+        annotations = []
+        for annotation_fragment_id, fragment_name, a in parse_bulk_annotations(request):
+            # annotations may name a fragment, e.g. GFF sequence ID, which
+            # must be this fragment
+            if (annotation_fragment_id is not None and annotation_fragment_id != fragment.id) or\
+               (fragment_name is not None and fragment_name != fragment.name):
+                raise Exception('Annotation is not on fragment "%s", but on "%s"' %
+                                (fragment.name, annotation_fragment_id
+                                 if annotation_fragment_id is not None else fragment_name))
+            annotations.append(a)
+        return annotate_fragments([fragment], [annotations]), 201
+
+
+class GenomeAnnotationsBulkView(ViewBase):
+
+    @transaction.atomic()
+    def on_post(self, request, genome_id):
+        genome = get_genome_or_404(genome_id)
+        fragments = list(genome.fragments.all())
+        by_id = dict((f.id, f) for f in fragments)
+        by_name = dict((f.name, f) for f in fragments)
+
+        annotations = dict((f.id, []) for f in fragments)
+        for fragment_id, fragment_name, a in parse_bulk_annotations(request):
+            if fragment_id is not None and fragment_id in by_id:
+                annotations[fragment_id].append(a)
+            elif fragment_id is None and fragment_name in by_name:
+                annotations[by_name[fragment_name].id].append(a)
+            else:
+                raise Exception('Genome does not have fragment "%s"' %
+                                (fragment_id if fragment_id is not None else fragment_name,))
+
+        fragments = [f for f in fragments if len(annotations[f.id]) > 0]
+        return annotate_fragments(fragments, [annotations[f.id] for f in fragments]), 201
+
+
 class FragmentListView(ViewBase):
 
     def on_get(self, request):
@@ -213,7 +446,61 @@ class FragmentListView(ViewBase):
 class GenomeView(ViewBase):
 
     @staticmethod
-    def op_to_dict(genome, op):
+    def fragment_index_states(fragment_ids):
+        """
+        Returns dictionary of fragment ID to length of fragment's location
+        index, or None if fragment does not have a fresh location index, in
+        one query. Unlike Fragment.indexed_fragment, does not index fragments.
+        """
+
+        q = Fragment.objects.filter(id__in=fragment_ids)\
+                            .annotate(indexed_length=Max('fragment_chunk_location__base_last'))\
+                            .values_list('id', 'fragment_index__fresh', 'indexed_length')
+        states = dict((fragment_id, None) for fragment_id in fragment_ids)
+        for fragment_id, fresh, length in q:
+            if fresh is True and length is not None:
+                states[fragment_id] = length
+        return states
+
+    @staticmethod
+    def operation_annotations(genome, operations, fragments):
+        """
+        Returns dictionary of operation ID to annotations of features added by
+        the operation, on the specified fragments of the genome, in two
+        queries.
+        """
+
+        features = dict((f.id, f) for f in Feature.objects.filter(operation__in=operations))
+        if len(features) == 0:
+            return {}
+
+        fcl_tb = Fragment_Chunk_Location._meta.db_table
+        columns = dict((f.name, f.column) for f in Fragment_Chunk_Location._meta.fields)
+        q = Chunk_Feature.objects.filter(chunk__fragment_chunk_location__fragment__genome=genome,
+                                         feature__operation__in=operations)\
+                                 .extra(select=dict((k, '%s.%s' % (fcl_tb, columns[f]))
+                                                    for k, f in [('fcl_fragment_id', 'fragment'),
+                                                                 ('fcl_base_first', 'base_first'),
+                                                                 ('fcl_base_last', 'base_last')]))\
+                                 .values_list('feature_id', 'feature_base_first',
+                                              'feature_base_last', 'fcl_fragment_id',
+                                              'fcl_base_first', 'fcl_base_last')
+
+        cf_fcl = []
+        for feature_id, feature_base_first, feature_base_last, fragment_id, bf, bl in q:
+            cf = Chunk_Feature(feature=features[feature_id], feature_base_first=feature_base_first,
+                               feature_base_last=feature_base_last)
+            fcl = Fragment_Chunk_Location(fragment=fragments[int(fragment_id)],
+                                          base_first=int(bf), base_last=int(bl))
+            cf_fcl.append((cf, fcl))
+
+        by_op = {}
+        for annotation in Annotation.from_chunk_feature_and_location_array(cf_fcl):
+            by_op.setdefault(annotation.feature.operation_id, []).append(annotation)
+        return by_op
+
+    @staticmethod
+    def op_to_dict(op, annotations):
         choices = Operation._meta.get_field_by_name('type')[0].choices
         type_str = [t[1] for t in choices if t[0] == op.type]
         if len(type_str) > 0:
@@ -221,43 +508,51 @@ class GenomeView(ViewBase):
         else:
             type_str = ''
 
-        annotations = {}
-        if genome.has_location_index:
-            genome = genome.indexed_genome()
-            for feature in op.feature_set.all():
-                fragment_annotations = genome.find_annotation_by_feature(feature)
-                for fragment_id, fragment_annotations in fragment_annotations.iteritems():
-                    if fragment_id not in annotations:
-                        annotations[fragment_id] = []
-                    annotations[fragment_id].extend(fragment_annotations)
-
         annotation_list = []
-        for fragment_id in annotations:
-            f = genome.fragments.filter(id=fragment_id)[0]
-            v = annotations[fragment_id]
-            v = [FragmentAnnotationsView.to_dict(x) for x in v]
-            for a in v:
-                a['fragment_id'] = fragment_id
-                a['fragment_name'] = f.name
-                annotation_list.append(a)
+        for x in sorted(annotations, key=lambda a: a.fragment.id):
+            a = FragmentAnnotationsView.to_dict(x)
+            a['fragment_id'] = x.fragment.id
+            a['fragment_name'] = x.fragment.name
+            annotation_list.append(a)
 
         d = dict(type=type_str, params=json.loads(op.params), annotations=annotation_list)
         return d
 
     @staticmethod
     def to_dict(genome, compute_length=True, include_fragments=True, include_operations=True):
+        """
+        Returns dictionary describing a genome. Fragments, their index states,
+        operations and annotations added by operations are each loaded in a
+        fixed number of queries, regardless of number of fragments and
+        operations.
+        """
+
+        fragments = []
+        index_states = {}
+        if include_fragments or include_operations:
+            fragments = list(genome.fragments.all())
+            index_states = GenomeView.fragment_index_states([f.id for f in fragments])
+
         operations = []
         if include_operations:
-            for op in genome.operation_set.order_by('id'):
-                d = GenomeView.op_to_dict(genome, op)
+            ops = list(genome.operation_set.order_by('id'))
+            annotations = {}
+            # annotations are only shown if all fragments are indexed
+            if len(ops) > 0 and None not in index_states.values():
+                annotations = GenomeView.operation_annotations(
+                    genome, ops, dict((f.id, f) for f in fragments))
+            for op in ops:
+                d = GenomeView.op_to_dict(op, annotations.get(op.id, []))
                 operations.append(d)
 
-        fragments = None
+        fragment_list = None
         if include_fragments:
-            fragments = []
-            for f in genome.fragments.all():
-                d = FragmentView.to_dict(f, compute_length=compute_length)
-                fragments.append(d)
+            fragment_list = []
+            for f in fragments:
+                d = FragmentView.to_dict(f, compute_length=False)
+                if compute_length is True and index_states[f.id] is not None:
+                    d['length'] = index_states[f.id]
+                fragment_list.append(d)
 
         d = dict(id=genome.id,
                  uri=reverse('genome', kwargs=dict(genome_id=genome.id)),
@@ -265,13 +560,32 @@ class GenomeView(ViewBase):
                  notes=genome.notes,
                  parent_id=genome.parent_id,
                  parent_name=genome.parent.name if genome.parent is not None else '',
-                 fragments=fragments)
+                 fragments=fragment_list)
 
         if len(operations):
             d['operations'] = operations
 
         return d
 
+    def on_get_validators(self, request, genome_id):
+        from edge.kmer import genome_index_signature
+
+        genome = get_genome_or_404(genome_id)
+        signature = genome_index_signature(genome)
+        if signature is None:
+            return None
+        annotations = Fragment.annotation_versions([x[0] for x in signature])
+        # fragment fields shown in the response, which may change without
+        # changing the location index
+        fragments = dict((x[0], list(x[1:])) for x in
+                         genome.fragments.values_list('id', 'name', 'circular', 'parent_id'))
+        signature = [x+[annotations[x[0]]]+fragments[x[0]] for x in signature]
+        operations = list(genome.operation_set.order_by('id').values_list('id', 'params'))
+        parent_name = genome.parent.name if genome.parent is not None else None
+        version = [genome.id, genome.name, genome.notes, genome.parent_id, parent_name,
+                   signature, operations]
+        return version, None
+
     def on_get(self, request, genome_id):
         genome = get_genome_or_404(genome_id)
         return GenomeView.to_dict(genome)
@@ -322,26 +636,7 @@ class GenomeListView(ViewBase):
             if len(fragment_ids) == 0:
                 return []
 
-            sql_joins = 5
-            q = Genome.objects.filter(genome_fragment__fragment_id=fragment_ids[0])
-            for i in range(1, sql_joins):
-                if i < len(fragment_ids):
-                    q = q.filter(genome_fragment__fragment_id=fragment_ids[i])
-            candidates = list(q)
-            genomes = []
-            for g in candidates:
-                x = Genome.objects.raw("""
-                  SELECT edge_genome.id,
-                         GROUP_CONCAT(edge_genome_fragment.fragment_id) as fragment_id_list
-                    FROM edge_genome
-                    JOIN edge_genome_fragment ON edge_genome_fragment.genome_id = edge_genome.id
-                   WHERE edge_genome.id = %s
-                """, [g.id])
-                x = list(x)[0]
-                id_list = [int(n) for n in x.fragment_id_list.split(',')]
-                if set(id_list) == set(fragment_ids):
-                    genomes.append(g)
-
+            genomes = Genome.with_fragments(fragment_ids).order_by('-id')
         else:
             q_parser = RequestParser()
             q_parser.add_argument('q', field_type=str, location='get')
@@ -382,6 +677,94 @@ class GenomeListView(ViewBase):
         return GenomeView.to_dict(genome), 201
 
 
+def parse_range_header(header):
+    """
+    Parses a single byte range from a Range header. Returns (first byte, last
+    byte or None), with first byte negative for a suffix range, or None if
+    header is missing or not a single byte range.
+    """
+
+    m = re.match(r'^bytes=(\d*)-(\d*)$', header.strip()) if header else None
+    if m is None or (m.group(1) == '' and m.group(2) == ''):
+        return None
+    if m.group(1) == '':
+        return -int(m.group(2)), None
+    last = int(m.group(2)) if m.group(2) != '' else None
+    if last is not None and last < int(m.group(1)):
+        return None
+    return int(m.group(1)), last
+
+
+def file_blocks(fn, first, last, block_size=65536):
+    """
+    Generator yielding bytes first to last, inclusive, of a file.
+    """
+
+    with open(fn, 'rb') as f:
+        f.seek(first)
+        remaining = last-first+1
+        while remaining > 0:
+            data = f.read(min(block_size, remaining))
+            if len(data) == 0:
+                break
+            remaining -= len(data)
+            yield data
+
+
+class GenomeExportView(View):
+    """
+    Streams GFF, FASTA or GenBank export of a genome, gzip compressed if client
+    accepts gzip encoding. Exports are cached on disk for each version of a
+    genome. Supports conditional requests with ETag, and resuming with a single
+    byte range.
+    """
+
+    CONTENT_TYPES = {'gff': 'text/x-gff3', 'fa': 'text/x-fasta', 'gb': 'text/x-genbank'}
+
+    def get(self, request, genome_id, fmt):
+        from edge.exports import cached_export
+
+        genome = get_genome_or_404(genome_id)
+        version, fn, gz_fn = cached_export(genome, fmt)
+        gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if gzip:
+            fn = gz_fn
+        etag = '"%s-%s%s"' % (version, fmt, '-gzip' if gzip else '')
+
+        if etag in [t.strip() for t in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+            response = HttpResponse(status=304)
+        else:
+            total = os.path.getsize(fn)
+            first, last = 0, total-1
+            byte_range = parse_range_header(request.META.get('HTTP_RANGE'))
+            if_range = request.META.get('HTTP_IF_RANGE')
+            if byte_range is not None and (if_range is None or if_range == etag):
+                first, last = byte_range
+                if first < 0:
+                    first = max(total+first, 0)
+                last = total-1 if last is None else min(last, total-1)
+                if first >= total:
+                    response = HttpResponse(status=416)
+                    response['Content-Range'] = 'bytes */%s' % (total,)
+                    return response
+                response = StreamingHttpResponse(file_blocks(fn, first, last), status=206,
+                                                 content_type=self.CONTENT_TYPES[fmt])
+                response['Content-Range'] = 'bytes %s-%s/%s' % (first, last, total)
+            else:
+                response = StreamingHttpResponse(file_blocks(fn, first, last),
+                                                 content_type=self.CONTENT_TYPES[fmt])
+            response['Content-Length'] = last-first+1
+            response['Content-Disposition'] = \
+                'attachment; filename="edge-genome-%s.%s"' % (genome.id, fmt)
+            if gzip:
+                response['Content-Encoding'] = 'gzip'
+
+        response['ETag'] = etag
+        response['Accept-Ranges'] = 'bytes'
+        response['Vary'] = 'Accept-Encoding'
+        return response
+
+
 class GenomeBlastView(ViewBase):
 
     def on_post(self, request, genome_id):
@@ -423,14 +806,43 @@ class GenomePcrView(ViewBase):
         return r, 200
 
 
+class GenomePcrBatchView(ViewBase):
+
+    def on_post(self, request, genome_id):
+        from edge.pcr import pcr_many
+        from edge.blastdb import check_and_build_genome_db
+
+        genome = get_genome_or_404(genome_id)
+        check_and_build_genome_db(genome)
+
+        parser = RequestParser()
+        parser.add_argument('primer_pairs', field_type=list, required=True, location='json')
+
+        args = parser.parse_args(request)
+        primer_pairs = args['primer_pairs']
+        for primers in primer_pairs:
+            if len(primers) != 2:
+                raise Exception('Expecting two primers, got %s' % (primers,))
+
+        results = pcr_many(genome, [tuple(primers) for primers in primer_pairs])
+        results = [(r[0], [b.to_dict() for b in r[1]], [b.to_dict() for b in r[2]], r[3])
+                   for r in results]
+        return results, 200
+
+
 class GenomeOperationViewBase(ViewBase):
+    requires_blastdb = True
+    # set to False if operation changes the new genome in a background task,
+    # which should then build BLAST db of the new genome when it is done
+    builds_child_blastdb = True
 
     @transaction.atomic()
     def on_post(self, request, genome_id):
         from edge.blastdb import check_and_build_genome_db
 
         genome = get_genome_or_404(genome_id)
-        check_and_build_genome_db(genome)
+        if self.requires_blastdb:
+            check_and_build_genome_db(genome)
 
         # always require a 'create' argument
         parser = RequestParser()
@@ -450,17 +862,13 @@ class GenomeOperationViewBase(ViewBase):
             op = op_class.get_operation(**args)
 
             # find another a child genome with same operation
-            child = None
-            for existing_child in genome.children.all():
-                if existing_child.operation_set.count() == 1 and\
-                   existing_child.operation_set.all()[0].type == op.type and\
-                   existing_child.operation_set.all()[0].params == op.params:
-                    child = existing_child
+            child = genome.child_with_operation(op)
 
             if child is None:
                 child = op_class.perform(genome, **args)
                 if child:
-                    schedule_building_blast_db(child.id)
+                    if self.builds_child_blastdb:
+                        schedule_building_blast_db(child.id)
                     return GenomeView.to_dict(child), 201
             else:  # found existing child, turn child to 'active' if it is not
                 if child.active is False:
@@ -487,14 +895,82 @@ class GenomeCrisprDSBView(GenomeOperationViewBase):
                             default=None, location='json')
         parser.add_argument('notes', field_type=str, required=False,
                             default=None, location='json')
+        parser.add_argument('pam_upstream', field_type=bool, required=False,
+                            default=False, location='json')
 
         args = parser.parse_args(request)
         guide = args['guide']
         pam = args['pam']
         genome_name = args['genome_name']
         notes = args['notes']
+        pam_upstream = args['pam_upstream']
+
+        return (dict(guide=guide, pam=pam, genome_name=genome_name, notes=notes,
+                     pam_upstream=pam_upstream), CrisprOp)
+
+
+class GenomeCrisprGuidesView(ViewBase):
+
+    def on_post(self, request, genome_id):
+        from edge.crispr import CrisprOp, can_use_pam_index
+        from edge.blastdb import check_and_build_genome_db
+
+        genome = get_genome_or_404(genome_id)
+
+        parser = RequestParser()
+        parser.add_argument('guides', field_type=list, required=True, location='json')
+        parser.add_argument('pam', field_type=str, required=True, location='json')
+        parser.add_argument('max_mismatches', field_type=int, required=False,
+                            default=3, location='json')
+        parser.add_argument('pam_upstream', field_type=bool, required=False,
+                            default=False, location='json')
+
+        args = parser.parse_args(request)
+        # only guides that cannot be looked up in PAM site index need BLAST
+        if not all(can_use_pam_index(guide, args['pam']) for guide in args['guides']):
+            check_and_build_genome_db(genome)
+
+        r = CrisprOp.check_many(genome, args['guides'], args['pam'],
+                                max_mismatches=args['max_mismatches'],
+                                pam_upstream=args['pam_upstream'])
+        return [x.to_dict() for x in r], 200
+
+
+class GenomeOrfAnnotationView(GenomeOperationViewBase):
+    requires_blastdb = False
+    builds_child_blastdb = False
+
+    def parse_arguments(self, request):
+        from edge.orf_annotation import OrfAnnotationOp
+
+        parser = RequestParser()
+        parser.add_argument('genome_name', field_type=str, required=False,
+                            default=None, location='json')
+        parser.add_argument('notes', field_type=str, required=False,
+                            default=None, location='json')
+
+        args = parser.parse_args(request)
+        return (dict(genome_name=args['genome_name'], notes=args['notes']), OrfAnnotationOp)
+
+
+class GenomeVariantView(GenomeOperationViewBase):
+    requires_blastdb = False
+    builds_child_blastdb = False
+
+    def parse_arguments(self, request):
+        from edge.variants import VariantOp
 
-        return (dict(guide=guide, pam=pam, genome_name=genome_name, notes=notes), CrisprOp)
+        parser = RequestParser()
+        parser.add_argument('vcf', field_type=str, required=True, location='json')
+        parser.add_argument('genome_name', field_type=str, required=False,
+                            default=None, location='json')
+        parser.add_argument('notes', field_type=str, required=False,
+                            default=None, location='json')
+
+        args = parser.parse_args(request)
+        vcf = args['vcf'].encode('utf-8')
+        return (dict(vcf=vcf, genome_name=args['genome_name'], notes=args['notes']),
+                VariantOp)
 
 
 class GenomeRecombinationView(GenomeOperationViewBase):
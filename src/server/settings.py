@@ -145,3 +145,29 @@ NCBI_DATA_DIR = NCBI_DIR+'/blastdb'
 
 # Primer3
 PRIMER3_DIR = BASE_DIR+'/../primer3'
+# long running primer3_core processes, per set of primer3 options
+PRIMER3_PROCESSES = 4
+# cache of primer3 results, shared by all processes; max number of entries.
+# None to always run primer3
+PRIMER3_CACHE_DIR = PRIMER3_DIR+'/cache'
+PRIMER3_CACHE_SIZE = 10000
+if TESTING:
+    PRIMER3_CACHE_DIR = None  # tests should see results from primer3
+
+# k-mer sequence index, for exact sequence search without BLAST
+KMER_DATA_DIR = BASE_DIR+'/../kmerdb'
+# max number of k-mer indices, and of PAM indices, each process keeps open
+KMER_LOADED_INDICES = 8
+
+# processes for finding ORFs when annotating ORFs on a genome; None to use all
+# CPUs, 1 to find ORFs in the calling process
+ORF_ANNOTATION_PROCESSES = None
+
+# VCF files uploaded for variant application operations
+VARIANT_DATA_DIR = BASE_DIR+'/../variants'
+
+# rendered genome exports, cached for each version of a genome
+EXPORT_CACHE_DIR = BASE_DIR+'/../exports'
+
+# fragment summary tiles, cached for each version of a fragment
+TILE_CACHE_DIR = BASE_DIR+'/../tiles'